@@ -0,0 +1,206 @@
+import json
+import os
+import struct
+import sys
+import warnings
+from typing import Dict, List, Any, Iterable, Optional
+
+import networkx as nx
+import numpy as np
+from tqdm import tqdm
+
+from Util.general_util import get_pattern_paths
+from deltaPDG.Util.graph_cache import FORMAT_VERSION, graph_to_arrays, arrays_to_graph
+from deltaPDG.Util.pygraph_util import read_networkx_from_dot
+
+PACK_SUFFIX = '.pack'
+_MAGIC = b'FLXPACK1'
+_HEADER = struct.Struct('<8sQQ')  # magic, index offset, index length
+_ALIGNMENT = 64
+
+
+def corpus_root(repository_name: str) -> str:
+    return os.path.join('.', 'data', 'corpora_clean', repository_name)
+
+
+def _source_stat(location: str) -> Optional[List[int]]:
+    """
+    :return: The mtime (ns) and size of a graph file as the pack records them, None if it does not exist
+    """
+    try:
+        stat = os.stat(location)
+    except FileNotFoundError:
+        return None
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def build_corpus_pack(repository_name: str, pattern: str = '*merged.dot', pack_location: str = None) -> str:
+    """
+    Pack all graphs of a repository corpus into a single file.
+    The file starts with a fixed header pointing at a JSON index, graphs are stored as the (aligned) arrays of
+    graph_cache.graph_to_arrays so that they can be memory mapped without copying. The mtime and size of every graph
+    file are recorded so that graphs changed after packing can be told apart.
+    :param repository_name: The corpus under ./data/corpora_clean to pack
+    :param pattern: The filename pattern of the graphs to pack
+    :param pack_location: Where to write the pack, defaults to ./data/corpora_clean/<repository_name>.pack
+    :return: The location of the pack
+    """
+    root = corpus_root(repository_name)
+    pack_location = root + PACK_SUFFIX if pack_location is None else pack_location
+    entries = list()
+    temp_location = '%s.%d.tmp' % (pack_location, os.getpid())
+    with open(temp_location, 'wb') as f:
+        f.write(_HEADER.pack(_MAGIC, 0, 0))
+        for graph_location in tqdm(sorted(get_pattern_paths(pattern, root)), leave=False):
+            # Stat before reading, a graph that changes while it is packed is then seen as stale
+            source = _source_stat(graph_location)
+            arrays = dict()
+            for key, array in graph_to_arrays(read_networkx_from_dot(graph_location)).items():
+                f.write(b'\0' * (-f.tell() % _ALIGNMENT))
+                arrays[key] = [array.dtype.str, list(array.shape), f.tell()]
+                f.write(np.ascontiguousarray(array).tobytes())
+            entries.append({'path': os.path.relpath(graph_location, root), 'arrays': arrays, 'source': source})
+        index = json.dumps({'repository': repository_name, 'pattern': pattern, 'version': FORMAT_VERSION,
+                            'entries': entries}).encode('utf-8')
+        index_offset = f.tell()
+        f.write(index)
+        f.seek(0)
+        f.write(_HEADER.pack(_MAGIC, index_offset, len(index)))
+    os.replace(temp_location, pack_location)
+    return pack_location
+
+
+class Corpus_Pack(object):
+    """
+    Read-only, memory mapped view of a packed repository corpus.
+    Paths returned by the pack are the same as get_pattern_paths would return for the unpacked corpus, so they can
+    be used wherever a datapoint location is expected. Lookups are answered from the packed index alone; check
+    matches the pack against the corpus on disk, after which graphs added, changed or removed since it was built are
+    listed in stale (and removed) and read from their DOT files. Pickling only carries the location and the paths,
+    each process maps the file itself and the OS shares the pages between them.
+    """
+
+    def __init__(self, location: str):
+        self.location = location
+        self._map()
+
+    def _map(self):
+        with open(self.location, 'rb') as f:
+            magic, index_offset, index_length = _HEADER.unpack(f.read(_HEADER.size))
+            if magic != _MAGIC:
+                raise ValueError('%s is not a corpus pack' % self.location)
+            f.seek(index_offset)
+            index = json.loads(f.read(index_length).decode('utf-8'))
+        self.repository_name = index['repository']
+        self.root = corpus_root(self.repository_name)
+        self.pattern = index.get('pattern', '*merged.dot')
+        self.version = index.get('version')
+        # Graphs packed in an older array layout can not be loaded
+        self.entries = index['entries'] if self.version == FORMAT_VERSION else list()
+        self.by_path = {self.path(e): e for e in self.entries}
+        self.all_paths = sorted(self.by_path.keys())
+        self.stale = list()
+        self.removed = list()
+        self.buffer = np.memmap(self.location, dtype=np.uint8, mode='r')
+
+    def check(self) -> bool:
+        """
+        Match the pack against the corpus on disk. This walks the corpus tree and stats every graph, so it is only
+        done on request. Afterwards only graphs whose file still has the mtime and size it had when it was packed are
+        loaded from the pack, the others (stale) from their DOT files, and graphs removed from disk are left out.
+        :return: Whether the pack is up to date
+        """
+        packed = {self.path(e): e for e in self.entries}
+        self.all_paths = sorted(get_pattern_paths(self.pattern, self.root))
+        self.by_path = {path: packed[path] for path in self.all_paths
+                        if path in packed and packed[path].get('source') == _source_stat(path)}
+        self.stale = [path for path in self.all_paths if path not in self.by_path]
+        self.removed = sorted(set(packed.keys()).difference(self.all_paths))
+        return len(self.stale) == 0 and len(self.removed) == 0
+
+    def __getstate__(self):
+        return {'location': self.location, 'all_paths': self.all_paths, 'packed': list(self.by_path.keys()),
+                'removed': self.removed}
+
+    def __setstate__(self, state):
+        self.location = state['location']
+        self._map()
+        packed = self.by_path
+        self.all_paths = state['all_paths']
+        self.by_path = {path: packed[path] for path in state['packed']}
+        self.stale = [path for path in self.all_paths if path not in self.by_path]
+        self.removed = state['removed']
+
+    def __len__(self):
+        return len(self.all_paths)
+
+    def path(self, entry: Dict[str, Any]) -> str:
+        """
+        :return: The location on disk of a graph in entries
+        """
+        return os.path.join(self.root, entry['path'])
+
+    def datapoints(self) -> List[str]:
+        return sorted({os.path.basename(os.path.dirname(os.path.dirname(path))) for path in self.all_paths})
+
+    def paths(self, concepts: Optional[int] = None, exclude: Iterable[str] = ()) -> List[str]:
+        """
+        :param concepts: Only return graphs with this many concepts (q)
+        :param exclude: Datapoints to leave out, e.g. the ones already in a results csv
+        :return: The sorted locations of all matching graphs, packed or (after check) not
+        """
+        exclude = set(exclude)
+        return [path for path in self.all_paths
+                if (concepts is None or os.path.basename(os.path.dirname(path)) == str(concepts))
+                and os.path.basename(os.path.dirname(os.path.dirname(path))) not in exclude]
+
+    def arrays(self, path: str) -> Dict[str, np.ndarray]:
+        """
+        :return: Zero-copy views into the mapped pack for the graph stored under path
+        """
+        arrays = dict()
+        for key, (dtype, shape, offset) in self.by_path[path]['arrays'].items():
+            dtype = np.dtype(dtype)
+            count = int(np.prod(shape))
+            arrays[key] = np.frombuffer(self.buffer, dtype=dtype, count=count, offset=offset).reshape(shape)
+        return arrays
+
+    def load(self, path: str) -> nx.MultiDiGraph:
+        """
+        :return: The graph stored under path, read from disk when it is not part of the pack or stale
+        """
+        if path not in self.by_path:
+            return read_networkx_from_dot(path)
+        return arrays_to_graph(self.arrays(path))
+
+
+def open_corpus_pack(repository_name: str, check: bool = False, rebuild: bool = False) -> Optional[Corpus_Pack]:
+    """
+    :param check: Match the pack against the corpus on disk (see Corpus_Pack.check) and warn when it is out of date.
+                  This walks the whole corpus tree, without it the pack is taken as is
+    :param rebuild: Check the pack and rebuild it when graphs were added, changed or removed since it was built
+    :return: The pack of a repository corpus, None if it has not been packed or was packed in an older format
+    """
+    try:
+        pack = Corpus_Pack(corpus_root(repository_name) + PACK_SUFFIX)
+    except FileNotFoundError:
+        return None
+    if pack.version != FORMAT_VERSION:
+        if rebuild:
+            return Corpus_Pack(build_corpus_pack(repository_name, pack.pattern, pack.location))
+        warnings.warn('The pack of %s was built in an older format and is not used. Rebuild it with '
+                      'python -m Util.corpus_pack %s' % (repository_name, repository_name))
+        return None
+    if not (check or rebuild) or pack.check():
+        return pack
+    if rebuild:
+        return Corpus_Pack(build_corpus_pack(repository_name, pack.pattern, pack.location))
+    warnings.warn('The pack of %s is out of date, %d of %d graphs are read from their DOT files (%d packed graphs '
+                  'were removed). Rebuild it with python -m Util.corpus_pack %s'
+                  % (repository_name, len(pack.stale), len(pack), len(pack.removed), repository_name))
+    return pack
+
+
+if __name__ == '__main__':
+    for repository_name in tqdm(sys.argv[1:]):
+        print('Packed %s' % build_corpus_pack(repository_name))
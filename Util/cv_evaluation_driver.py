@@ -8,12 +8,13 @@ import numpy as np
 import scipy.sparse
 from tqdm import tqdm
 
+from Util.corpus_pack import open_corpus_pack
 from Util.evaluation import evaluate
 from Util.general_util import get_pattern_paths
 from confidence_voters.Util.generate_corpus_file import build_occurrence_matrix, build_corpus
 from confidence_voters.confidence_voters import cluster_diffs, convert_diff_to_diff_regions
 from confidence_voters.confidence_voters_graph_only import cluster_diffs as graph_cluster_diffs
-from deltaPDG.Util.pygraph_util import read_graph_from_dot, obj_dict_to_networkx, get_context_from_nxgraph
+from deltaPDG.Util.pygraph_util import read_networkx_from_dot, get_context_from_nxgraph
 
 
 def driver(times_, out_name_, projects_, worker_wrapper_, temp_dir_):
@@ -39,8 +40,7 @@ def driver(times_, out_name_, projects_, worker_wrapper_, temp_dir_):
                 f.write(jsonpickle.encode(file_index_map))
             scipy.sparse.save_npz('./out/%s/occurrence_matrix.npz' % repository_name, occurrence_matrix)
 
-        all_graphs = sorted(
-            get_pattern_paths('*merged.dot', os.path.join('.', 'data', 'corpora_clean', repository_name)))
+        pack = open_corpus_pack(repository_name, check=True)
         os.makedirs('./out/%s' % repository_name, exist_ok=True)
 
         try:
@@ -59,8 +59,13 @@ def driver(times_, out_name_, projects_, worker_wrapper_, temp_dir_):
         except FileNotFoundError:
             pass
 
-        all_graphs = [d for d in all_graphs
-                      if os.path.basename(os.path.dirname(os.path.dirname(d))) not in datapoints_done]
+        if pack is not None:
+            all_graphs = pack.paths(exclude=datapoints_done)
+        else:
+            all_graphs = sorted(
+                get_pattern_paths('*merged.dot', os.path.join('.', 'data', 'corpora_clean', repository_name)))
+            all_graphs = [d for d in all_graphs
+                          if os.path.basename(os.path.dirname(os.path.dirname(d))) not in datapoints_done]
         random.shuffle(all_graphs)
 
         corpus = {k: (i, convert_diff_to_diff_regions(v)) for k, (i, v) in corpus.items()}
@@ -105,7 +110,7 @@ if __name__ == '__main__':
                         graph_location = os.path.join('.', 'data', 'corpora_clean',
                                                       repository_name, data_point_name,
                                                       str(concepts), 'merged.dot')
-                        deltaPDG = obj_dict_to_networkx(read_graph_from_dot(graph_location))
+                        deltaPDG = read_networkx_from_dot(graph_location)
                         context = get_context_from_nxgraph(deltaPDG)
 
                         try:
@@ -4,6 +4,7 @@ import sys
 import jsonpickle
 from tqdm import tqdm
 
+from Util.corpus_pack import open_corpus_pack
 from Util.general_util import get_pattern_paths
 
 if __name__ == '__main__':
@@ -21,8 +22,7 @@ if __name__ == '__main__':
         out_name = 'wl_%s_%d_results_raw' % (edges_kept, k_hop)
 
     for repository_name in tqdm(repository_names):
-        all_graphs = sorted(
-            get_pattern_paths('*merged.dot', os.path.join('.', 'data', 'corpora_clean', repository_name)))
+        pack = open_corpus_pack(repository_name, check=True)
         os.makedirs('./out/%s' % repository_name, exist_ok=True)
         try:
             with open('./out/%s/%s.csv' % (repository_name, out_name)) as f:
@@ -39,11 +39,16 @@ if __name__ == '__main__':
                 continue
         except FileNotFoundError:
             pass
-        all_graphs = [d for d in all_graphs
-                      if os.path.basename(os.path.dirname(os.path.dirname(d))) not in datapoints_done]
+        if pack is not None:
+            all_graphs = pack.paths(exclude=datapoints_done)
+        else:
+            all_graphs = sorted(
+                get_pattern_paths('*merged.dot', os.path.join('.', 'data', 'corpora_clean', repository_name)))
+            all_graphs = [d for d in all_graphs
+                          if os.path.basename(os.path.dirname(os.path.dirname(d))) not in datapoints_done]
         if mode == 'du':
-            du_validate(all_graphs, times, repository_name)
+            du_validate(all_graphs, times, repository_name, pack=pack)
         else:
-            wl_validate(all_graphs, times, k_hop, repository_name)
+            wl_validate(all_graphs, times, k_hop, repository_name, pack=pack)
         with open('./out/%s/%s.json' % (repository_name, out_name), 'w') as f:
             f.write(jsonpickle.encode({'done'}))
@@ -12,6 +12,7 @@ import scipy.spatial
 import scipy.special
 from tqdm import tqdm
 
+from deltaPDG.Util.commit_index import Commit_Index
 from deltaPDG.Util.git_util import Git_Util
 
 
@@ -27,7 +28,7 @@ def build_corpus(json_location_, subject_location_, temp_dir_):
     file_length_map = defaultdict(lambda: dict())
 
     def worker(work_):
-        git_handler = Git_Util(temp_dir=temp_dir_)
+        git_handler = Git_Util(temp_dir=temp_dir_, mode='worktree')
         with git_handler as gh:
             v1 = gh.move_git_repo_to_tmp(subject_location_)
             v2 = gh.move_git_repo_to_tmp(subject_location_)
@@ -91,26 +92,24 @@ def diffs_by_file(diff):
 
 
 def build_occurrence_matrix(subject_location_, temp_dir_, filter_commits):
-    git_handler = Git_Util(temp_dir=temp_dir_)
-    with git_handler as gh:
-        temp = gh.move_git_repo_to_tmp(subject_location_)
-        candidates = gh.get_all_commit_hashes_authors_dates_messages(temp)
-        all_commits = list()
-        all_files = list()
-        file_commit_map = defaultdict(list)
-        for sha, author, date, msg, diff in candidates:
-            if (filter_commits is not None and sha in filter_commits) or filter_commits is None:
-                all_commits.append(sha)
-                files = {fn for _, fn, _, _, _ in diff}
-                for file in files:
-                    file_commit_map[file].append(sha)
-                    if 'file' not in all_files:
-                        all_files.append(file)
-
-        file_commit_map = dict(file_commit_map)
-
-        occurrence_matrix_ = generate_occurrence_matrix(all_files, all_commits, file_commit_map)
-        return occurrence_matrix_, {fn: i for i, fn in enumerate(all_files)}
+    # The commit index only reads the repository, it does not need a temporary copy
+    commit_index = Commit_Index.open(subject_location_)
+    all_commits = list()
+    all_files = list()
+    file_commit_map = defaultdict(list)
+    for sha, author, date, msg in commit_index.candidates():
+        if (filter_commits is not None and sha in filter_commits) or filter_commits is None:
+            all_commits.append(sha)
+            files = set(commit_index.diff_files(sha))
+            for file in files:
+                file_commit_map[file].append(sha)
+                if 'file' not in all_files:
+                    all_files.append(file)
+
+    file_commit_map = dict(file_commit_map)
+
+    occurrence_matrix_ = generate_occurrence_matrix(all_files, all_commits, file_commit_map)
+    return occurrence_matrix_, {fn: i for i, fn in enumerate(all_files)}
 
 
 def generate_occurrence_matrix(list_of_files: List[str],
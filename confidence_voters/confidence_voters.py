@@ -8,7 +8,8 @@ import numpy as np
 
 from confidence_voters.Util.voter_util import integer_distance_between_intervals, prefix_distance, call_graph_distance, \
     cluster_from_voter_affinity, generate_empty_affinity
-from deltaPDG.Util.pygraph_util import read_graph_from_dot, obj_dict_to_networkx, get_context_from_nxgraph
+from deltaPDG.Util.pygraph_util import read_networkx_from_dot, get_context_from_nxgraph
+from deltaPDG.Util.span_index import Span_Index
 
 
 def file_distance(file_length_map):
@@ -42,24 +43,36 @@ def file_distance(file_length_map):
     return voter
 
 
+def _span_indices(graph):
+    """
+    :return: Span indices over the added (green) nodes and over all other nodes, matched against the after and
+             before coordinates of diff-regions respectively
+    """
+    green = [n for n, d in graph.nodes(data=True) if 'color' in d.keys() and d['color'] == 'green']
+    others = [n for n, d in graph.nodes(data=True) if not ('color' in d.keys() and d['color'] == 'green')]
+    return Span_Index.from_graph(graph, green, missing=(-1, -1)), Span_Index.from_graph(graph, others, missing=(-1, -1))
+
+
+def _region_nodes(indices, diff_region, offset=0):
+    """
+    :return: The nodes whose span contains the (offset) start or end line of diff_region
+    """
+    after_index, before_index = indices
+    region_nodes = set()
+    for index, span in [(after_index, 'span_after'), (before_index, 'span_before')]:
+        region_nodes.update(index.stab(diff_region[span]['start'] + offset))
+        region_nodes.update(index.stab(diff_region[span]['end'] + offset))
+    return region_nodes
+
+
 def namespace_distance(graph, context):
     graph = graph.copy()
+    indices = _span_indices(graph)
 
     def voter(diff_region1, diff_region2):
         # Get the nodes representing each diff-region
-        region1_nodes = list()
-        region2_nodes = list()
-        for node, data in graph.nodes(data=True):
-            if 'color' in data.keys() and data['color'] == 'green':
-                span = 'span_after'
-            else:
-                span = 'span_before'
-            start, end = [int(n) for n in data['span'].split('-')] \
-                if 'span' in data.keys() and '-' in data['span'] else [-1, -1]
-            if start <= diff_region1[span]['start'] - 1 <= end or start <= diff_region1[span]['end'] - 1 <= end:
-                region1_nodes.append(node)
-            if start <= diff_region2[span]['start'] - 1 <= end or start <= diff_region2[span]['end'] - 1 <= end:
-                region2_nodes.append(node)
+        region1_nodes = _region_nodes(indices, diff_region1, offset=-1)
+        region2_nodes = _region_nodes(indices, diff_region2, offset=-1)
 
         region1_nodes = {context[k] for k in region1_nodes if k in context.keys()}
         region2_nodes = {context[k] for k in region2_nodes if k in context.keys()}
@@ -110,21 +123,12 @@ def data_dependency(graph):
             except KeyError:
                 pass
 
+    indices = _span_indices(graph)
+
     def voter(diff_region1, diff_region2):
         # Get the nodes representing each diff-region
-        region1_nodes = list()
-        region2_nodes = list()
-        for node, data in graph.nodes(data=True):
-            if 'color' in data.keys() and data['color'] == 'green':
-                span = 'span_after'
-            else:
-                span = 'span_before'
-            start, end = [int(n) for n in data['span'].split('-')] \
-                if 'span' in data.keys() and '-' in data['span'] else [-1, -1]
-            if start <= diff_region1[span]['start'] <= end or start <= diff_region1[span]['end'] <= end:
-                region1_nodes.append(node)
-            if start <= diff_region2[span]['start'] <= end or start <= diff_region2[span]['end'] <= end:
-                region2_nodes.append(node)
+        region1_nodes = _region_nodes(indices, diff_region1)
+        region2_nodes = _region_nodes(indices, diff_region2)
 
         # Are the regions reachable? (ignoring edge direction)
         # 1 if reachable, 0 otherwise
@@ -165,7 +169,7 @@ def cluster_diffs(concepts, data, graph_location, file_length_map, occurrence_ma
     :param file_index_map: The map between filenames and occurrence_matrix indices
     :return: The proposed clustering of diff_regions
     """
-    deltaPDG = obj_dict_to_networkx(read_graph_from_dot(graph_location))
+    deltaPDG = read_networkx_from_dot(graph_location)
     if edges_kept is not None:
         deltaPDG = remove_all_except(deltaPDG, edges_kept)
     context = get_context_from_nxgraph(deltaPDG)
@@ -184,13 +188,14 @@ def cluster_diffs(concepts, data, graph_location, file_length_map, occurrence_ma
     ]
     voters = [v for v in voters if v is not None]
 
+    span_index = Span_Index.from_graph(deltaPDG)
     for diff_region in data:
         active_spans = [(span['start'], span['end']) for span in [diff_region['span_before'], diff_region['span_after']]
                         if span['start'] != -1]
-        region_nodes = [n for n in deltaPDG.nodes if len(deltaPDG.nodes[n]['span']) > 0 and any([s <= int(
-            deltaPDG.nodes[n]['span'].split('-')[0]) <= e or s <= int(deltaPDG.nodes[n]['span'].split('-')[1]) <= e for
-                                                                                                 s, e in active_spans])]
-        diff_region['nodes'] = region_nodes
+        region_nodes = set()
+        for s, e in active_spans:
+            region_nodes.update(span_index.starting_or_ending_in(s, e))
+        diff_region['nodes'] = [n for n in deltaPDG.nodes if n in region_nodes]
 
     n = len(data)
 
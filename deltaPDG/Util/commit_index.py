@@ -0,0 +1,224 @@
+import datetime
+import json
+import os
+import subprocess
+from typing import Dict, List, Any, Iterable, Iterator, Optional, Set, Tuple
+
+from deltaPDG.Util.git_util import Git_Util
+
+INDEX_VERSION = 1
+INDEX_FILENAME = 'flexeme_commit_index.json'
+# One record per commit: \x01 sha \0 parents \0 author \0 email \0 author date \0 message \x02
+_log_format = '--format=%x01%H%x00%P%x00%aN%x00%aE%x00%aI%x00%B%x02'
+
+
+def _git_lines(args: List[str], path: str) -> Iterator[str]:
+    with subprocess.Popen(['git'] + args, bufsize=-1, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                          cwd=path) as git_process:
+        for line in git_process.stdout:
+            yield line.decode('utf-8', 'replace')
+    if git_process.returncode != 0:
+        raise subprocess.CalledProcessError(git_process.returncode, ['git'] + args)
+
+
+def _git_output(args: List[str], path: str) -> List[str]:
+    return [line.strip() for line in _git_lines(args, path)]
+
+
+def _parse_log(lines: Iterable[str]) -> Iterator[Dict[str, Any]]:
+    """
+    Parse the output of `git log --raw --numstat -p` in _log_format, one commit at a time
+    """
+    header, patch, commit = None, None, None
+    for line in lines:
+        if header is None and line.startswith('\x01'):
+            if commit is not None:
+                yield _finish_commit(commit, patch)
+            header, commit = '', None
+        if header is not None:
+            header += line
+            if '\x02' in line:
+                sha, parents, author, email, date, message = header[1:header.rindex('\x02')].split('\x00')
+                commit = {'sha': sha, 'parents': parents.split(), 'author': author, 'email': email, 'date': date,
+                          'message': message, 'files': list(), 'lines_changed': 0}
+                header, patch = None, list()
+        elif len(patch) > 0 or line.startswith('diff --'):
+            patch.append(line)
+        elif line.startswith(':'):
+            # :<old mode> <new mode> <old sha> <new sha> <status>\t<path>[\t<new path>]
+            fields = line.rstrip('\n').split('\t')
+            commit['files'].append((fields[0].split()[-1][:1], fields[-1]))
+        elif line.strip() != '':
+            # <added>\t<deleted>\t<path>, binary files report - for both
+            added, deleted, _ = line.split('\t', 2)
+            commit['lines_changed'] += (int(added) if added != '-' else 0) + (int(deleted) if deleted != '-' else 0)
+    if commit is not None:
+        yield _finish_commit(commit, patch)
+
+
+def _finish_commit(commit: Dict[str, Any], patch: List[str]) -> Dict[str, Any]:
+    changes = [v for changes in Git_Util.iter_diff_output(patch) for v in changes]
+    commit['diff_files'] = list(dict.fromkeys(filename for _, filename, _, _, _ in changes))
+    commit['diff_regions'] = len(Git_Util.merge_diff_into_diff_regions(changes))
+    return commit
+
+
+class Commit_Index(object):
+    """
+    Per-commit metadata of a repository, built from a single streamed `git log --raw --numstat -p` pass over all
+    branches: author, author date, message, touched files, changed line count and the number of diff-regions of the
+    commit against its first parent. The index is stored as JSON (by default in the repository's git directory) and
+    refresh only logs the commits that are not reachable from the branch tips seen when it was last built.
+    """
+
+    def __init__(self, path: str, location: Optional[str] = None):
+        self.path = path
+        self.location = location
+        self.tips = list()
+        self.order = list()
+        self.commits = dict()
+        self.words = dict()
+
+    @classmethod
+    def open(cls, path: str, location: Optional[str] = None) -> 'Commit_Index':
+        """
+        Load the index of the repository at path, bringing it up to date with the repository and saving it back
+        :param path: The repository
+        :param location: Where the index is stored, defaults to the repository's git directory
+        """
+        if location is None:
+            location = os.path.join(path, _git_output(['rev-parse', '--git-dir'], path)[0], INDEX_FILENAME)
+        index = cls(path, location)
+        try:
+            with open(location) as f:
+                stored = json.load(f)
+            if stored['version'] == INDEX_VERSION:
+                index.tips = stored['tips']
+                index.order = [c['sha'] for c in stored['commits']]
+                index.commits = {c['sha']: c for c in stored['commits']}
+        except (FileNotFoundError, ValueError, KeyError):
+            pass
+        if index.refresh() > 0 or not os.path.exists(location):
+            index.save()
+        return index
+
+    def _branch_tips(self) -> List[str]:
+        return sorted(set(_git_output(['for-each-ref', '--format=%(objectname)', 'refs/heads/'], self.path)))
+
+    def refresh(self) -> int:
+        """
+        Add the commits that appeared since the index was built, rebuilding it if history was rewritten
+        :return: The number of commits that were added
+        """
+        tips = self._branch_tips()
+        if tips == self.tips:
+            return 0
+        exclude = list()
+        if len(self.tips) > 0:
+            try:
+                # All previously indexed commits must still be reachable for the index to be extended
+                lost = _git_output(['rev-list', '--count'] + self.tips + ['--not'] + tips, self.path)
+                if lost == ['0']:
+                    exclude = ['--not'] + self.tips
+            except subprocess.CalledProcessError:
+                pass
+        if len(exclude) == 0:
+            self.order, self.commits, self.words = list(), dict(), dict()
+
+        new_commits = list(_parse_log(_git_lines(['log', '--branches=*', '--raw', '--numstat', '-p', _log_format]
+                                                 + exclude, self.path)))
+        new_commits = [c for c in new_commits if c['sha'] not in self.commits]
+        self.order = [c['sha'] for c in new_commits] + self.order
+        self.commits.update({c['sha']: c for c in new_commits})
+        self.tips = tips
+        return len(new_commits)
+
+    def save(self):
+        temp_location = '%s.%d.tmp' % (self.location, os.getpid())
+        try:
+            with open(temp_location, 'w') as f:
+                json.dump({'version': INDEX_VERSION, 'tips': self.tips,
+                           'commits': [self.commits[sha] for sha in self.order]}, f)
+            os.replace(temp_location, self.location)
+        except OSError:
+            pass  # Read-only repositories still get an in-memory index
+
+    def __contains__(self, sha: str) -> bool:
+        return sha in self.commits
+
+    def __len__(self) -> int:
+        return len(self.order)
+
+    def author(self, sha: str) -> str:
+        return self.commits[sha]['author']
+
+    def date(self, sha: str) -> datetime.datetime:
+        return datetime.datetime.fromisoformat(self.commits[sha]['date'])
+
+    def message(self, sha: str) -> str:
+        return self.commits[sha]['message']
+
+    def parents(self, sha: str) -> List[str]:
+        return self.commits[sha]['parents']
+
+    def files(self, sha: str) -> List[Tuple[str, str]]:
+        """
+        :return: The (status, path) of every file the commit touches, as reported by git log --raw
+        """
+        return [tuple(f) for f in self.commits[sha]['files']]
+
+    def diff_files(self, sha: str) -> List[str]:
+        """
+        :return: The files with changed lines, named as in Git_Util.process_diff_output
+        """
+        return self.commits[sha]['diff_files']
+
+    def lines_changed(self, sha: str) -> int:
+        return self.commits[sha]['lines_changed']
+
+    def diff_regions(self, sha: str) -> int:
+        """
+        :return: The number of diff-regions between the commit and its first parent
+        """
+        return self.commits[sha]['diff_regions']
+
+    def keywords(self, sha: str, keywords: Set[str]) -> Set[str]:
+        """
+        :return: The (upper case) keywords that occur as words in the commit message
+        """
+        if sha not in self.words:
+            self.words[sha] = frozenset(self.message(sha).upper().split())
+        return self.words[sha].intersection(keywords)
+
+    def candidates(self) -> List[Tuple[str, str, datetime.datetime, str]]:
+        """
+        :return: The sha, author, date and message of every non-merge commit, in git log order
+        """
+        return [(sha, self.author(sha), self.date(sha), self.message(sha))
+                for sha in self.order if len(self.parents(sha)) <= 1]
+
+
+if __name__ == '__main__':
+    import sys
+    import time
+
+    # Build (or refresh) the index of a repository and time lookups against asking git
+    repository = sys.argv[1]
+    t0 = time.perf_counter()
+    commit_index = Commit_Index.open(repository)
+    t1 = time.perf_counter()
+    print('Indexed %d commits in %.3fs' % (len(commit_index), t1 - t0))
+    shas = commit_index.order[:200]
+    with Git_Util(temp_dir=None) as gh:
+        t2 = time.perf_counter()
+        for sha in shas:
+            gh.get_author(sha, repository)
+            gh.get_commit_msg(sha, repository)
+            gh.get_time_between_commits(sha, shas[0], repository)
+        t3 = time.perf_counter()
+    for sha in shas:
+        commit_index.author(sha)
+        commit_index.keywords(sha, {'FIX'})
+        commit_index.date(shas[0]) - commit_index.date(sha)
+    t4 = time.perf_counter()
+    print('%d lookups: git %.3fs, index %.6fs' % (len(shas), t3 - t2, t4 - t3))
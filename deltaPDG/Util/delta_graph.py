@@ -0,0 +1,217 @@
+from typing import Dict, List, Any, Iterable, Tuple, Optional
+
+import networkx as nx
+import numpy as np
+import scipy.sparse
+
+# Edge keys as written by the extractor and add_nameflow_edges
+CONTROL, DATA, CALL, NAME = 0, 1, 2, 3
+EDGE_KEYS = (CONTROL, DATA, CALL, NAME)
+
+_node_columns = ['label', 'cluster', 'file', 'color', 'community']
+_edge_columns = ['style', 'color', 'label']
+
+
+class _Interned(object):
+    def __init__(self):
+        self.index = dict()
+        self.values = list()
+
+    def __call__(self, value: str) -> int:
+        try:
+            return self.index[value]
+        except KeyError:
+            self.index[value] = len(self.values)
+            self.values.append(value)
+            return self.index[value]
+
+
+def _parse_span(span: str) -> Tuple[int, int]:
+    try:
+        start, end = span.split('-')
+        return int(start), int(end)
+    except ValueError:
+        return -1, -1
+
+
+def _edge_key(key: Any) -> Optional[int]:
+    """
+    :return: The edge kind of a networkx edge key, None when it is not one of EDGE_KEYS
+    """
+    if isinstance(key, str) and key in ['0', '1', '2', '3']:
+        return int(key)
+    if isinstance(key, int) and not isinstance(key, bool) and key in EDGE_KEYS:
+        return key
+    return None
+
+
+class DeltaGraph(object):
+    """
+    Array backed deltaPDG. Nodes are the integers 0..n-1 (names holds the original string ids), spans are parsed
+    into span_start/span_end (-1 when missing) and label, cluster, file, color and community are codes into interned
+    per-attribute tables (-1 when absent). Out-edges are stored as one CSR matrix per edge key
+    (CONTROL, DATA, CALL, NAME) with interned style/color/label codes per edge.
+    Anything that does not fit these columns is kept verbatim in node_extra/edge_extra so that
+    from_networkx/to_networkx round trip; edges come back grouped by key.
+    """
+
+    def __init__(self):
+        self.names = list()
+        self.node_index = dict()
+        self.span_start = np.zeros(shape=(0,), dtype=np.int32)
+        self.span_end = np.zeros(shape=(0,), dtype=np.int32)
+        self.span_raw = dict()
+        self.tables = {c: list() for c in _node_columns + ['edge_' + c for c in _edge_columns]}
+        self.node_codes = {c: np.zeros(shape=(0,), dtype=np.int32) for c in _node_columns}
+        self.node_extra = dict()
+        self.indptr = {k: np.zeros(shape=(1,), dtype=np.int64) for k in EDGE_KEYS}
+        self.indices = {k: np.zeros(shape=(0,), dtype=np.int32) for k in EDGE_KEYS}
+        self.edge_codes = {k: {c: np.zeros(shape=(0,), dtype=np.int32) for c in _edge_columns} for k in EDGE_KEYS}
+        self.int_key = {k: np.zeros(shape=(0,), dtype=bool) for k in EDGE_KEYS}
+        self.edge_extra = list()
+
+    def __len__(self):
+        return len(self.names)
+
+    @classmethod
+    def from_networkx(cls, graph: nx.MultiDiGraph) -> 'DeltaGraph':
+        delta = cls()
+        delta.names = list(graph.nodes)
+        delta.node_index = {n: i for i, n in enumerate(delta.names)}
+        n = len(delta.names)
+
+        tables = {c: _Interned() for c in delta.tables.keys()}
+        delta.span_start = np.full(shape=(n,), fill_value=-1, dtype=np.int32)
+        delta.span_end = np.full(shape=(n,), fill_value=-1, dtype=np.int32)
+        delta.node_codes = {c: np.full(shape=(n,), fill_value=-1, dtype=np.int32) for c in _node_columns}
+        for i, name in enumerate(delta.names):
+            data = graph.nodes[name]
+            extra = dict()
+            for attr, value in data.items():
+                if attr == 'span':
+                    start, end = _parse_span(value) if isinstance(value, str) else (-1, -1)
+                    delta.span_start[i], delta.span_end[i] = start, end
+                    if '%d-%d' % (start, end) != value:
+                        delta.span_raw[i] = value
+                elif attr in _node_columns and isinstance(value, str):
+                    delta.node_codes[attr][i] = tables[attr](value)
+                else:
+                    extra[attr] = value
+            if len(extra) > 0:
+                delta.node_extra[i] = extra
+
+        by_key = {k: ([list() for _ in range(n)]) for k in EDGE_KEYS}
+        for source, target, key, data in graph.edges(keys=True, data=True):
+            k = _edge_key(key)
+            if k is None or any(attr not in _edge_columns or not isinstance(value, str)
+                                for attr, value in data.items()):
+                delta.edge_extra.append((delta.node_index[source], delta.node_index[target], key, dict(data)))
+                continue
+            by_key[k][delta.node_index[source]].append(
+                (delta.node_index[target], isinstance(key, int),
+                 [tables['edge_' + c](data[c]) if c in data.keys() else -1 for c in _edge_columns]))
+        for k in EDGE_KEYS:
+            delta._set_edges(k, by_key[k])
+
+        delta.tables = {c: t.values for c, t in tables.items()}
+        return delta
+
+    def _set_edges(self, k: int, rows: List[List[Tuple[int, bool, List[int]]]]):
+        """
+        :param rows: Per source node, its out-edges of key k as (target, int key, edge column codes)
+        """
+        self.indptr[k] = np.zeros(shape=(len(rows) + 1,), dtype=np.int64)
+        np.cumsum([len(r) for r in rows], out=self.indptr[k][1:])
+        flat = [e for r in rows for e in r]
+        self.indices[k] = np.asarray([t for t, _, _ in flat], dtype=np.int32)
+        self.int_key[k] = np.asarray([i for _, i, _ in flat], dtype=bool)
+        codes = np.asarray([c for _, _, c in flat], dtype=np.int32).reshape((len(flat), len(_edge_columns)))
+        self.edge_codes[k] = {c: codes[:, j].copy() for j, c in enumerate(_edge_columns)}
+
+    def edge_subgraph(self, keys: Iterable[int], targets: np.ndarray = None) -> 'DeltaGraph':
+        """
+        :param keys: The edge kinds to keep
+        :param targets: A boolean mask over the nodes, only edges into nodes where it is set are kept
+        :return: A graph with the same nodes and only the selected edges
+        """
+        keys = set(keys)
+        delta = DeltaGraph()
+        delta.names, delta.node_index = self.names, self.node_index
+        delta.span_start, delta.span_end, delta.span_raw = self.span_start, self.span_end, self.span_raw
+        delta.tables, delta.node_codes, delta.node_extra = self.tables, self.node_codes, self.node_extra
+        n = len(self.names)
+        for k in EDGE_KEYS:
+            delta.indptr[k] = np.zeros(shape=(n + 1,), dtype=np.int64)
+            if k not in keys:
+                continue
+            keep = np.ones(shape=self.indices[k].shape, dtype=bool) if targets is None else targets[self.indices[k]]
+            sources = np.repeat(np.arange(n), np.diff(self.indptr[k]))
+            np.cumsum(np.bincount(sources[keep], minlength=n), out=delta.indptr[k][1:])
+            delta.indices[k] = self.indices[k][keep]
+            delta.int_key[k] = self.int_key[k][keep]
+            delta.edge_codes[k] = {c: codes[keep] for c, codes in self.edge_codes[k].items()}
+        delta.edge_extra = [(s, t, key, data) for s, t, key, data in self.edge_extra
+                            if _edge_key(key) in keys and (targets is None or targets[t])]
+        return delta
+
+    def node_attributes(self, i: int) -> Dict[str, Any]:
+        data = dict()
+        if i in self.span_raw:
+            data['span'] = self.span_raw[i]
+        elif self.span_start[i] != -1 or self.span_end[i] != -1:
+            data['span'] = '%d-%d' % (self.span_start[i], self.span_end[i])
+        for c in _node_columns:
+            code = self.node_codes[c][i]
+            if code != -1:
+                data[c] = self.tables[c][code]
+        data.update(self.node_extra.get(i, dict()))
+        return data
+
+    def to_networkx(self) -> nx.MultiDiGraph:
+        graph = nx.MultiDiGraph()
+        graph.add_nodes_from((name, self.node_attributes(i)) for i, name in enumerate(self.names))
+        for k in EDGE_KEYS:
+            sources = np.repeat(np.arange(len(self.names)), np.diff(self.indptr[k])).tolist()
+            codes = [self.edge_codes[k][c].tolist() for c in _edge_columns]
+            int_key = self.int_key[k].tolist()
+            for e, (s, t) in enumerate(zip(sources, self.indices[k].tolist())):
+                graph.add_edge(self.names[s], self.names[t], k if int_key[e] else str(k),
+                               **{c: self.tables['edge_' + c][codes[j][e]]
+                                  for j, c in enumerate(_edge_columns) if codes[j][e] != -1})
+        for s, t, key, data in self.edge_extra:
+            graph.add_edge(self.names[s], self.names[t], key, **data)
+        return graph
+
+    def codes_of(self, column: str, value: str) -> int:
+        """
+        :return: The code of value in the interned table of a node column, -1 if it does not occur
+        """
+        try:
+            return self.tables[column].index(value)
+        except ValueError:
+            return -1
+
+    def changed_nodes(self) -> np.ndarray:
+        """
+        :return: The ids of all nodes marked as changed, i.e. with a color other than orange
+        """
+        colors = self.node_codes['color']
+        return np.flatnonzero((colors != -1) & (colors != self.codes_of('color', 'orange')))
+
+    def adjacency(self, keys: Iterable[int] = EDGE_KEYS, symmetric: bool = False) -> scipy.sparse.csr_matrix:
+        """
+        :param keys: The edge kinds to include
+        :param symmetric: Whether to ignore edge direction
+        :return: A boolean n x n adjacency matrix over the selected edge kinds
+        """
+        n = len(self.names)
+        matrix = scipy.sparse.csr_matrix((n, n), dtype=bool)
+        for k in keys:
+            data = np.ones(shape=self.indices[k].shape, dtype=bool)
+            matrix = matrix + scipy.sparse.csr_matrix((data, self.indices[k], self.indptr[k]), shape=(n, n))
+        if symmetric:
+            matrix = matrix + matrix.T
+        return matrix.tocsr()
+
+    def out_neighbours(self, i: int, keys: Iterable[int] = EDGE_KEYS) -> List[int]:
+        return [t for k in keys for t in self.indices[k][self.indptr[k][i]:self.indptr[k][i + 1]].tolist()]
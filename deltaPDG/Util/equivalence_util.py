@@ -1,26 +1,149 @@
-from rapidfuzz import fuzz
+from functools import lru_cache
+from typing import List, Optional
+
+import numpy as np
+from rapidfuzz import fuzz, process
+
+# Rows of the similarity matrices computed per cdist call, bounds the transient float matrix
+_block_size = 1024
+# Entries of the per-process cache of individual fuzzy comparisons
+_default_cache_size = 100000
+# Threads each cdist call runs on, -1 uses all cores
+_workers = -1
+
+
+def _ratio_eq(string_a: str, string_b: str, cutoff: int) -> bool:
+    return fuzz.ratio(string_a, string_b, score_cutoff=cutoff) > 0
+
+
+_cached_ratio_eq = lru_cache(maxsize=_default_cache_size)(_ratio_eq)
+
+
+def configure_similarity_cache(max_size: int):
+    """
+    Resize (and empty) the LRU cache shared by all Eq_Utils in this process, 0 disables caching
+    """
+    global _cached_ratio_eq
+    _cached_ratio_eq = lru_cache(maxsize=max_size)(_ratio_eq)
+
+
+def similarity_cache_info():
+    """
+    :return: The hits, misses, maxsize and currsize of the fuzzy comparison cache
+    """
+    return _cached_ratio_eq.cache_info()
+
+
+def configure_similarity_workers(workers: int):
+    """
+    Set the threads the batched fuzzy comparisons of this process run on, -1 for one per core. Processes that already
+    run one per core, like the generate_corpus workers, should use 1.
+    """
+    global _workers
+    _workers = workers
+
+
+def _fuzzy_eq(string_a: str, string_b: str, cutoff: int) -> bool:
+    # fuzz.ratio is symmetric, order the pair so both orientations share a cache entry
+    if string_b < string_a:
+        string_a, string_b = string_b, string_a
+    return _cached_ratio_eq(string_a, string_b, cutoff)
+
+
+def _similarity_matrix(strings_a: List[str], strings_b: List[str], cutoff: int) -> np.ndarray:
+    """
+    :return: A boolean matrix, True where fuzz.ratio(strings_a[i], strings_b[j], score_cutoff=cutoff) > 0
+    """
+    result = np.zeros(shape=(len(strings_a), len(strings_b)), dtype=bool)
+    if len(strings_a) == 0 or len(strings_b) == 0:
+        return result
+    for start in range(0, len(strings_a), _block_size):
+        result[start:start + _block_size] = process.cdist(strings_a[start:start + _block_size], strings_b,
+                                                          scorer=fuzz.ratio, processor=None,
+                                                          score_cutoff=cutoff, workers=_workers) > 0
+    return result
+
+
+class _Similarity_Table(object):
+    """
+    Precomputed fuzz.ratio cutoff test between two sets of strings, fuzz.ratio is symmetric so lookups
+    work in either orientation
+    """
+
+    def __init__(self, strings_a: List[str], strings_b: List[str], cutoff: int):
+        self.strings_b = list(dict.fromkeys(strings_b))
+        self.index_a = {s: i for i, s in enumerate(dict.fromkeys(strings_a))}
+        self.index_b = {s: i for i, s in enumerate(self.strings_b)}
+        self.matrix = _similarity_matrix(list(self.index_a.keys()), self.strings_b, cutoff)
+
+    def lookup(self, string_a: str, string_b: str) -> Optional[bool]:
+        if string_a in self.index_a and string_b in self.index_b:
+            return bool(self.matrix[self.index_a[string_a], self.index_b[string_b]])
+        if string_b in self.index_a and string_a in self.index_b:
+            return bool(self.matrix[self.index_a[string_b], self.index_b[string_a]])
+        return None
+
+    def similar(self, string_a: str) -> Optional[List[str]]:
+        if string_a not in self.index_a:
+            return None
+        return [self.strings_b[j] for j in np.flatnonzero(self.matrix[self.index_a[string_a]])]
 
 
 class Eq_Utils(object):
     def __init__(self, m_fuzziness, n_fuzziness):
         self.m_fuzziness = m_fuzziness
         self.n_fuzziness = n_fuzziness
+        self.label_table = None
+        self.context_table = None
+
+    def precompute(self, labels_a: List[str], labels_b: List[str], contexts_a: List[str], contexts_b: List[str]):
+        """
+        Batch the fuzzy comparisons between two graphs into label-vs-label and context-vs-context matrices,
+        later calls to node_label_eq and context_eq on these strings become lookups.
+        With a fuzziness of 100 the comparison is plain equality and nothing is precomputed.
+        """
+        self.label_table = _Similarity_Table(labels_a, labels_b, self.n_fuzziness) \
+            if self.n_fuzziness < 100 else None
+        self.context_table = _Similarity_Table(contexts_a, contexts_b, self.m_fuzziness) \
+            if self.m_fuzziness < 100 else None
+
+    def similar_labels(self, node_label_a: str, labels_b: List[str]) -> List[str]:
+        """
+        :return: The labels out of labels_b that are node_label_eq to node_label_a
+        """
+        if self.label_table is not None:
+            similar = self.label_table.similar(node_label_a)
+            if similar is not None:
+                return similar
+        return [label for label in labels_b if self.node_label_eq(node_label_a, label)]
 
     def context_eq(self, context_a: str, context_b: str) -> bool:
-        return fuzz.ratio(context_a, context_b, score_cutoff=self.m_fuzziness) > 0
+        if self.m_fuzziness >= 100:
+            return context_a == context_b
+        if self.context_table is not None:
+            equal = self.context_table.lookup(context_a, context_b)
+            if equal is not None:
+                return equal
+        return _fuzzy_eq(context_a, context_b, self.m_fuzziness)
 
     def node_label_eq(self, node_label_a: str, node_label_b: str) -> bool:
-        return fuzz.ratio(node_label_a, node_label_b, score_cutoff=self.n_fuzziness) > 0
+        if self.n_fuzziness >= 100:
+            return node_label_a == node_label_b
+        if self.label_table is not None:
+            equal = self.label_table.lookup(node_label_a, node_label_b)
+            if equal is not None:
+                return equal
+        return _fuzzy_eq(node_label_a, node_label_b, self.n_fuzziness)
 
     def node_eq(self, graph_a, node_a, graph_b, node_b):
-        if not (self.node_label_eq(graph_a.node[node_a]['label'], graph_b.node[node_b]['label'])):
+        if not (self.node_label_eq(graph_a.nodes[node_a]['label'], graph_b.nodes[node_b]['label'])):
             return False
 
         n_a = [n for n in list(graph_a.successors(node_a)) + list(graph_a.predecessors(node_a)) if
-               'color' not in graph_a.node[n].keys() or graph_a.node[n]['color'] == 'orange']
+               'color' not in graph_a.nodes[n].keys() or graph_a.nodes[n]['color'] == 'orange']
 
         n_b = [n for n in list(graph_b.successors(node_b)) + list(graph_b.predecessors(node_b)) if
-               'color' not in graph_b.node[n].keys() or graph_b.node[n]['color'] == 'orange']
+               'color' not in graph_b.nodes[n].keys() or graph_b.nodes[n]['color'] == 'orange']
 
         # We check for set inclusion, make sure we have the smaller set in the outer loop!
         if len(n_a) > len(n_b):
@@ -32,7 +155,7 @@ class Eq_Utils(object):
             found = False
             for other_node in n_b:
                 try:
-                    if self.node_label_eq(graph_a.node[node]['label'], graph_b.node[other_node]['label']):
+                    if self.node_label_eq(graph_a.nodes[node]['label'], graph_b.nodes[other_node]['label']):
                         found = True
                         break
                 except KeyError:
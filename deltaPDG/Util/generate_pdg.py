@@ -1,12 +1,22 @@
+import itertools
 import json
 import os
 import shutil
 import subprocess
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, List, Optional, Tuple
 
 import networkx as nx
 
 from deltaPDG.Util.merge_nameflow import add_nameflow_edges
-from deltaPDG.Util.pygraph_util import read_graph_from_dot, obj_dict_to_networkx
+from deltaPDG.Util.pdg_cache import PDG_Cache, relocate_nameflows
+from deltaPDG.Util.pygraph_util import read_graph_from_dot, read_graph_from_dot_string, obj_dict_to_networkx, \
+    read_back, write_dot
+
+# Stands in for the checkout directory in cached nameflow locations
+_repository_placeholder = '<repository>'
 
 
 class PDG_Generator(object):
@@ -14,56 +24,214 @@ class PDG_Generator(object):
     This class serves as a wrapper to abstract away calling the C# compiled PDG extractor
     """
 
-    def __init__(self, extractor_location, repository_location, target_filename="pdg.dot", target_location=os.getcwd()):
+    def __init__(self, extractor_location, repository_location, target_filename="pdg.dot", target_location=os.getcwd(),
+                 cache: PDG_Cache = None):
+        """
+        :param cache: Where to look up (and store) the extractor output by file content, None to always extract
+        """
         self.location = extractor_location
         self.repository_location = repository_location
         self.target_filename = target_filename
         self.target_location = target_location
+        self.cache = cache
+
+    def _extract(self, filename, work_location) -> Tuple[Optional[str], Any]:
+        """
+        Run the extractor on filename
+        :param work_location: The directory to run the extractor in, either the repository itself or a mirror of it
+        :return: The PDG as DOT text, None if the extractor produced none, and the raw nameflow data
+        """
+        try:
+            # A nameflow file left over from an earlier file must not be mistaken for this one's
+            os.remove(os.path.join(work_location, 'nameflows.json'))
+        except FileNotFoundError:
+            pass
 
-    def __call__(self, filename):
         from sys import platform
         if platform == "linux" or platform == "linux2":
             # linux
             generate_a_pdg = subprocess.Popen([self.location, '.', '.' + filename.replace('/', '\\')],
-                                              bufsize=1, cwd=self.repository_location)
+                                              bufsize=1, cwd=work_location)
             generate_a_pdg.wait()
         elif platform == "win32":
             # Windows...
             generate_a_pdg = subprocess.Popen([self.location, '.', '.' + filename.replace('/', '\\')], bufsize=1,
-                                              cwd=self.repository_location)
+                                              cwd=work_location)
             generate_a_pdg.wait()
 
+        pdg = None
         try:
-            shutil.move(os.path.join(self.repository_location, 'pdg.dot'),
-                        os.path.join(self.target_location, self.target_filename))
+            with open(os.path.join(work_location, 'pdg.dot'), encoding='utf-8', errors='surrogateescape',
+                      newline='') as f:
+                pdg = f.read()
+            os.remove(os.path.join(work_location, 'pdg.dot'))
         except FileNotFoundError:
-            with open(os.path.join(self.target_location, self.target_filename), 'w') as f:
-                f.write('digraph "extractedGraph"{\n}\n')
+            pass
 
+        nameflow_data = None
         try:
-            # shutil.move(os.path.join(self.repository_location, 'nameflows.json'),
-            # os.path.join(self.target_location, 'nameflows_' + self.target_filename.split('.')[0] + '.json'))
-            with open(os.path.join(self.repository_location, 'nameflows.json'), encoding='utf-8-sig') as json_data:
+            with open(os.path.join(work_location, 'nameflows.json'), encoding='utf-8-sig') as json_data:
                 nameflow_data = json.loads(json_data.read())
+        except FileNotFoundError:
+            pass
+        return pdg, relocate_nameflows(nameflow_data, work_location, self.repository_location) \
+            if work_location != self.repository_location else nameflow_data
 
-            # Normalise the nameflow json
-            if nameflow_data is not None:
-                for node in nameflow_data['nodes']:
-                    file, line = node['Location'].split(' : ')
-                    node['Location'] = (file[len(self.repository_location):]
-                                        if self.repository_location in file
-                                        else file,
-                                        line)
-                    node['Infile'] = \
-                        os.path.normcase(os.path.normpath(filename)) == os.path.normcase(os.path.normpath(file[1:]))
+    def __call__(self, filename, target_filename=None, work_location=None, lazy=False) -> 'PDG_Artifact':
+        """
+        Extract the PDG of filename and merge its nameflow edges into it
+        :param target_filename: The file to write the PDG to in target_location, defaults to self.target_filename
+        :param work_location: The directory to run the extractor in, defaults to the repository itself
+        :param lazy: Whether to keep the PDG in memory and only write it when asked to
+        :return: The PDG
+        """
+        target = os.path.join(self.target_location,
+                              self.target_filename if target_filename is None else target_filename)
+        key = None
+        if self.cache is not None:
+            key = self.cache.key(self.location, self.repository_location, filename)
+        cached = self.cache.get(key) if key is not None else None
+        if cached is not None:
+            pdg, nameflow_data = cached
+            nameflow_data = relocate_nameflows(nameflow_data, _repository_placeholder, self.repository_location)
+        else:
+            pdg, nameflow_data = self._extract(filename, self.repository_location if work_location is None
+                                               else work_location)
+            if key is not None:
+                # Nameflow locations name the checkout the file was extracted in, which differs between hits
+                self.cache.put(key, pdg, relocate_nameflows(nameflow_data, self.repository_location,
+                                                            _repository_placeholder))
 
-            nameflow_data['relations'] = [[] if v is None else v for v in nameflow_data['relations']]
+        artifact = PDG_Artifact(target, pdg if pdg is not None else 'digraph "extractedGraph"{\n}\n')
+        if nameflow_data is None:
+            # No file, nothing to add
+            return artifact if lazy else artifact.write()
 
-            # And add nameflow edges
-            apdg = obj_dict_to_networkx(read_graph_from_dot(os.path.join(self.target_location, self.target_filename)))
-            apdg = add_nameflow_edges(nameflow_data, apdg)
-            nx.drawing.nx_pydot.write_dot(apdg, os.path.join(self.target_location, self.target_filename))
+        # Normalise the nameflow json
+        for node in nameflow_data['nodes']:
+            file, line = node['Location'].split(' : ')
+            node['Location'] = (file[len(self.repository_location):]
+                                if self.repository_location in file
+                                else file,
+                                line)
+            node['Infile'] = \
+                os.path.normcase(os.path.normpath(filename)) == os.path.normcase(os.path.normpath(file[1:]))
 
-        except FileNotFoundError:
-            # No file, nothing to add
-            pass
+        nameflow_data['relations'] = [[] if v is None else v for v in nameflow_data['relations']]
+
+        # And add nameflow edges
+        apdg = add_nameflow_edges(nameflow_data, artifact.graph())
+        artifact = PDG_Artifact(target, augmented=apdg)
+        return artifact if lazy else artifact.write()
+
+
+class PDG_Artifact(object):
+    """
+    An extracted PDG: the graph as deltaPDG reads it and the DOT file it is stored in. The file is written on
+    write(), until then the graph only lives in memory.
+    """
+
+    def __init__(self, location: str, text: str = None, augmented: nx.MultiDiGraph = None):
+        """
+        :param location: Where the PDG is written to
+        :param text: The DOT source of the PDG
+        :param augmented: The PDG with its nameflow edges, written with write_dot instead of text
+        """
+        self.location = location
+        self.text = text
+        self.augmented = augmented
+        self.written = False
+        self._graph = None
+
+    def graph(self) -> nx.MultiDiGraph:
+        """
+        :return: The PDG as reading back its DOT file would return it, without going through the file
+        """
+        if self._graph is None:
+            if self.written:
+                self._graph = obj_dict_to_networkx(read_graph_from_dot(self.location))
+            elif self.augmented is not None:
+                self._graph = read_back(self.augmented)
+            else:
+                self._graph = obj_dict_to_networkx(read_graph_from_dot_string(self.text))
+        return self._graph
+
+    def write(self) -> 'PDG_Artifact':
+        if not self.written:
+            if self.augmented is not None:
+                write_dot(self.augmented, self.location)
+            else:
+                with open(self.location, 'w', encoding='utf-8', errors='surrogateescape', newline='') as f:
+                    f.write(self.text)
+            self.written = True
+            # Read the file back when asked for the graph, it is what every later reader sees
+            self._graph = None
+        return self
+
+
+class PDG_Executor(object):
+    """
+    Runs batches of PDG_Generator calls concurrently, with at most max_processes extractors at a time.
+    The extractor writes its output into its working directory, so every call gets a scratch directory of its own
+    that mirrors the top level of the repository through symbolic links. Where links cannot be created the
+    extractor runs in the repository itself and calls on the same repository take turns.
+    """
+
+    def __init__(self, max_processes: int, scratch_location: str = None):
+        self.max_processes = max(1, max_processes)
+        self.scratch_location = tempfile.mkdtemp(prefix='pdg_', dir=scratch_location)
+        self.pool = ThreadPoolExecutor(max_workers=self.max_processes)
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+        self.repository_locks = dict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self.pool.shutdown()
+        shutil.rmtree(self.scratch_location, ignore_errors=True)
+
+    def _mirror(self, repository_location: str) -> Optional[str]:
+        """
+        :return: A fresh directory linking to every top level entry of the repository, None if links are unsupported
+        """
+        mirror = os.path.join(self.scratch_location, str(next(self.counter)))
+        os.mkdir(mirror)
+        try:
+            for entry in os.listdir(repository_location):
+                if entry not in ['pdg.dot', 'nameflows.json']:
+                    os.symlink(os.path.abspath(os.path.join(repository_location, entry)), os.path.join(mirror, entry))
+        except (OSError, NotImplementedError):
+            shutil.rmtree(mirror, ignore_errors=True)
+            return None
+        return mirror
+
+    def _repository_lock(self, repository_location: str) -> threading.Lock:
+        with self.lock:
+            return self.repository_locks.setdefault(repository_location, threading.Lock())
+
+    def _run(self, generator: PDG_Generator, filename: str, target_filename: Optional[str],
+             lazy: bool) -> PDG_Artifact:
+        mirror = self._mirror(generator.repository_location)
+        if mirror is None:
+            with self._repository_lock(generator.repository_location):
+                return generator(filename, target_filename, lazy=lazy)
+        try:
+            return generator(filename, target_filename, work_location=mirror, lazy=lazy)
+        finally:
+            shutil.rmtree(mirror, ignore_errors=True)
+
+    def run(self, jobs: List[Tuple[PDG_Generator, str, Optional[str]]], lazy: bool = False) -> List[PDG_Artifact]:
+        """
+        :param jobs: The generator, the file to extract and the target file name (None for the generator's default)
+                     of every call; the target files must be distinct
+        :param lazy: Whether to keep the PDGs in memory rather than writing them out
+        :return: Each PDG, in the order of jobs
+        """
+        futures = [self.pool.submit(self._run, generator, filename, target_filename, lazy)
+                   for generator, filename, target_filename in jobs]
+        return [future.result() for future in futures]
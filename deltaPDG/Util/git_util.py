@@ -1,34 +1,241 @@
 import datetime
 import email.utils as eut
+import os
 import re
 import shutil
 import subprocess
 import tempfile
-from typing import Tuple, List, Any, Optional
+import threading
+from typing import Tuple, List, Any, Optional, Iterable, Iterator, Dict
 
 commit_line = re.compile(r'commit [0-9a-f]{40}\n')
 captured_commit_line = re.compile(r'(commit [0-9a-f]{40}\n)')
 
+# How move_git_repo_to_tmp sets up a private checkout: a full copy of the repository (.git included), a detached
+# `git worktree` of it, or a `git clone --shared` that borrows its objects
+CHECKOUT_MODES = ['copy', 'worktree', 'shared']
+
+
+class _File_Diff(object):
+    """
+    Incremental state of process_diff_output for the diff of a single file.
+    Only the header lines up to the first hunk are kept, hunk lines are turned into change records as they arrive.
+    Anything that does not start like a regular file diff is buffered and handed to process_diff_output as a whole.
+    """
+
+    def __init__(self, first_line: str, buffered: bool = False):
+        self.lines = [first_line]
+        self.buffered = buffered
+        self.in_hunks = False
+        self.new_file = 'new file mode' in first_line
+        self.filepath = None
+        self.changes = list()
+        self.add_ctr = 0
+        self.del_ctr = 0
+
+    def _filepath(self) -> str:
+        # The ---/+++ lines directly precede the first hunk, new files only have a meaningful +++ line
+        return re.sub(r'^("?)[ab]/', r'\1/', self.lines[-1 if self.new_file else -2][4:])
+
+    def feed(self, line: str):
+        if 'new file mode' in line and not self.new_file:
+            self.new_file = True
+            if self.in_hunks:
+                filepath = self._filepath()
+                self.changes = [(c[0], filepath) + c[2:] for c in self.changes]
+                self.filepath = filepath
+        if self.in_hunks:
+            line = line.strip()
+            first = line[:1]
+            if first == '-':
+                self.changes.append(('-', self.filepath, -1, self.del_ctr, line[1:]))
+                self.del_ctr += 1
+            elif first == '+':
+                self.changes.append(('+', self.filepath, self.add_ctr, -1, line[1:]))
+                self.add_ctr += 1
+            elif line.startswith('@@'):
+                self.del_ctr = int(line.split(' ')[1].split(',')[0][1:])
+                self.add_ctr = int(line.split(' ')[2].split(',')[0][1:])
+            elif not line.startswith('\\ No newline at end of file'):
+                self.del_ctr += 1
+                self.add_ctr += 1
+        elif self.buffered or not line.startswith('@@'):
+            self.lines.append(line)
+        elif len(self.lines) < 2:
+            self.buffered = True
+            self.lines.append(line)
+        else:
+            self.in_hunks = True
+            self.filepath = self._filepath()
+            self.feed(line)
+
+    def finish(self) -> List[Tuple[str, str, int, int, str]]:
+        if self.buffered:
+            return Git_Util.process_diff_output('\n'.join(self.lines).strip())
+        return self.changes
+
+
+class Git_Batch(object):
+    """
+    Long-lived `git cat-file --batch` (and, on demand, `--batch-check`) session on a repository.
+    Object names are resolved by git for every request, so moving HEAD or creating objects in between is fine.
+    Requests on one session are serialised, it can be shared between threads.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.batch = None
+        self.batch_check = None
+
+    def _start(self, mode: str) -> subprocess.Popen:
+        return subprocess.Popen(['git', 'cat-file', mode], cwd=self.path,
+                                stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+    @staticmethod
+    def _request(process: subprocess.Popen, name: str) -> Optional[List[str]]:
+        if '\n' in name:
+            raise ValueError('Object names cannot contain newlines: %r' % name)
+        process.stdin.write(name.encode('utf-8') + b'\n')
+        process.stdin.flush()
+        header = process.stdout.readline().decode('utf-8', 'replace').split()
+        if len(header) != 3:
+            return None  # <name> missing or <name> ambiguous
+        return header
+
+    def info(self, name: str) -> Optional[Tuple[str, str, int]]:
+        """
+        :param name: Any object name git understands, e.g. a sha, HEAD or <sha>^
+        :return: The sha, type and size of the object, None if it does not exist
+        """
+        with self.lock:
+            if self.batch_check is None:
+                self.batch_check = self._start('--batch-check')
+            header = self._request(self.batch_check, name)
+        if header is None:
+            return None
+        sha, type_, size = header
+        return sha, type_, int(size)
+
+    def read(self, name: str) -> Optional[Tuple[str, str, bytes]]:
+        """
+        :param name: Any object name git understands, e.g. a sha, HEAD or <sha>^
+        :return: The sha, type and raw content of the object, None if it does not exist
+        """
+        with self.lock:
+            if self.batch is None:
+                self.batch = self._start('--batch')
+            header = self._request(self.batch, name)
+            if header is None:
+                return None
+            sha, type_, size = header
+            content = self.batch.stdout.read(int(size))
+            self.batch.stdout.read(1)  # Trailing newline
+        return sha, type_, content
+
+    def commit(self, name: str) -> Optional[Tuple[Dict[str, List[str]], str]]:
+        """
+        :return: The headers (e.g. tree, parent, author) and the message of a commit, None if it does not exist
+        """
+        found = self.read(name)
+        if found is None or found[1] != 'commit':
+            return None
+        raw_headers, _, raw_message = found[2].partition(b'\n\n')
+        headers = dict()
+        for line in raw_headers.decode('utf-8', 'replace').split('\n'):
+            if line.startswith(' '):
+                continue  # Continuation of a multi-line header, e.g. gpgsig
+            key, _, value = line.partition(' ')
+            headers.setdefault(key, list()).append(value)
+        try:
+            message = raw_message.decode(headers.get('encoding', ['utf-8'])[0], 'replace')
+        except LookupError:
+            message = raw_message.decode('utf-8', 'replace')
+        return headers, message
+
+    @staticmethod
+    def parse_ident(ident: str) -> Tuple[str, str, datetime.datetime]:
+        """
+        :param ident: An author or committer header, i.e. `Name <email> <unix time> <+hhmm offset>`
+        :return: The name, email and (timezone aware) date
+        """
+        name, _, rest = ident.partition('<')
+        email, _, when = rest.partition('>')
+        timestamp, offset = when.split()
+        sign = -1 if offset.startswith('-') else 1
+        tz = datetime.timezone(sign * datetime.timedelta(hours=int(offset[1:3]), minutes=int(offset[3:5])))
+        return name.strip(), email, datetime.datetime.fromtimestamp(int(timestamp), tz)
+
+    def close(self):
+        for process in [self.batch, self.batch_check]:
+            if process is not None:
+                process.stdin.close()
+                process.wait()
+                process.stdout.close()
+        self.batch = None
+        self.batch_check = None
+
 
 class Git_Util(object):
-    def __init__(self, temp_dir):
+    def __init__(self, temp_dir, mode: str = 'copy'):
+        """
+        :param temp_dir: Where move_git_repo_to_tmp creates its checkouts, the system default if None
+        :param mode: How move_git_repo_to_tmp sets up a checkout, one of CHECKOUT_MODES
+        """
+        if mode not in CHECKOUT_MODES:
+            raise ValueError('Unknown checkout mode %s, expected one of %s' % (mode, ', '.join(CHECKOUT_MODES)))
         self.temp_dir = temp_dir
+        self.mode = mode
+        self.batch_sessions = dict()
+        self.worktrees = dict()
 
     def _clean_up(self):
+        for session in self.batch_sessions.values():
+            session.close()
+        self.batch_sessions = dict()
         for path in self.temp_paths:
+            if path in self.worktrees.keys():
+                subprocess.run(['git', 'worktree', 'remove', '--force', os.path.abspath(path)],
+                               cwd=self.worktrees[path], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
             shutil.rmtree(path, ignore_errors=True)
+        for source in set(self.worktrees.values()):
+            subprocess.run(['git', 'worktree', 'prune'], cwd=source, stdout=subprocess.DEVNULL,
+                           stderr=subprocess.DEVNULL)
+        self.worktrees = dict()
 
     def __enter__(self):
         self.temp_paths = []
         return self
 
+    def batch_session(self, path: str) -> Git_Batch:
+        """
+        :return: The cat-file session on the repository at path, started on first use and closed on exit
+        """
+        if path not in self.batch_sessions:
+            self.batch_sessions[path] = Git_Batch(path)
+        return self.batch_sessions[path]
+
     def __exit__(self, *exc_details):
         self._clean_up()
 
     def move_git_repo_to_tmp(self, url: str) -> str:
+        """
+        Set up a private checkout of the repository at url, removed again when the context manager exits.
+        In worktree and shared mode the checkout is at the current HEAD of url and shares its object store,
+        local changes in url are not carried over and, in shared mode, only the checked out branch exists locally.
+        :return: The location of the checkout
+        """
         path = tempfile.mkdtemp(suffix=".gitYarn", dir=self.temp_dir)
         shutil.rmtree(path)
-        shutil.copytree(url, path, symlinks=True, )
+        if self.mode == 'worktree':
+            subprocess.run(['git', 'worktree', 'add', '--detach', os.path.abspath(path), 'HEAD'],
+                           cwd=url, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+            self.worktrees[path] = url
+        elif self.mode == 'shared':
+            subprocess.run(['git', 'clone', '--shared', '--quiet', url, path],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        else:
+            shutil.copytree(url, path, symlinks=True, )
 
         self.temp_paths.append(path)
         return path
@@ -47,21 +254,15 @@ class Git_Util(object):
         git_log_process.stdout.close()
         return result
 
-    # git log HEAD~[newer_commit] -n 1 --format=%ad; \
-    # git log HEAD~[older_commit] -n 1 --format=%ad
-    @staticmethod
-    def get_time_between_commits(old: str, new: str, path: str) -> datetime.timedelta:
-        gen_str_process = subprocess.Popen(('git log ' + new + ' -n 1 --format=%ad').split(' '),
-                                           bufsize=1, cwd=path, stdout=subprocess.PIPE)
+    def get_time_between_commits(self, old: str, new: str, path: str) -> datetime.timedelta:
+        """
+        :return: The time between the author dates of two commits, 999999999 days if either cannot be found
+        """
         dates = list()
-        dates += list(map(lambda line: eut.parsedate_to_datetime(line.decode('utf-8', 'replace').strip()),
-                          gen_str_process.stdout.readlines()))
-        gen_str_process.stdout.close()
-        gen_str_process = subprocess.Popen(('git log ' + old + ' -n 1 --format=%ad').split(' '),
-                                           bufsize=1, cwd=path, stdout=subprocess.PIPE)
-        dates += list(map(lambda line: eut.parsedate_to_datetime(line.decode('utf-8', 'replace').strip()),
-                          gen_str_process.stdout.readlines()))
-        gen_str_process.stdout.close()
+        for sha in [new, old]:
+            commit = self.batch_session(path).commit(sha)
+            if commit is not None and 'author' in commit[0].keys():
+                dates.append(Git_Batch.parse_ident(commit[0]['author'][0])[2])
         if len(dates) == 2:
             return dates[0] - dates[1]
         else:
@@ -73,51 +274,30 @@ class Git_Util(object):
                                               bufsize=1, cwd=path)
         git_cherry_process.wait()
 
-    @staticmethod
-    def get_current_head(path: str) -> str:
-        get_head_process = subprocess.Popen(['git', 'rev-parse', 'HEAD'],
-                                            bufsize=1, stdout=subprocess.PIPE, cwd=path).stdout
-        show_lines = list(map(lambda line: line.decode('utf-8', 'replace'), get_head_process.readlines()))
-        get_head_process.close()
-
-        return show_lines[0]
+    def get_current_head(self, path: str) -> str:
+        return self.batch_session(path).info('HEAD')[0] + '\n'
 
     @staticmethod
-    def process_diff_between_commits(sha_old: str, sha_new: str, path: str) -> List[Tuple[str, str, int, int, str]]:
-        diff_show_process = subprocess.Popen(['git', 'diff', '%s..%s' % (sha_old, sha_new)],
-                                             bufsize=1, stdout=subprocess.PIPE, cwd=path).stdout
-        show_lines = list(map(lambda line: line.decode('utf-8', 'replace'), diff_show_process.readlines()))
-        diff_show_process.close()
-
-        current_index = 0
-        diffs = []
-        if current_index < len(show_lines):
-            current_diff = ''
-            while True:
-                curr_line = show_lines[current_index]
-                if current_index + 1 == len(show_lines):  # We reached the EOF
-                    current_diff += curr_line
-                    diffs.append(current_diff.strip())
-                    break
-                elif (curr_line.startswith('diff --git')) or (
-                        curr_line.startswith('diff --cc')):  # New diff for this commit
-                    if current_diff != '':
-                        diffs.append(current_diff.strip())
-                    current_diff = curr_line
-                else:
-                    current_diff += curr_line
-                current_index += 1
-
-        return [v for sublist in list(map(Git_Util.process_diff_output, diffs)) for v in sublist]
+    def iter_diff_between_commits(sha_old: str, sha_new: str, path: str) \
+            -> Iterator[List[Tuple[str, str, int, int, str]]]:
+        """
+        Stream the diff between two commits
+        :return: A generator yielding the changes of one file at a time
+        """
+        with subprocess.Popen(['git', 'diff', '%s..%s' % (sha_old, sha_new)],
+                              bufsize=-1, stdout=subprocess.PIPE, cwd=path) as diff_process:
+            yield from Git_Util.iter_diff_output(line.decode('utf-8', 'replace') for line in diff_process.stdout)
 
     @staticmethod
-    def get_commit_msg(sha: str, path: str) -> str:
-        commit_msg_process = subprocess.Popen(('git log --format=%B -n 1 ' + sha).split(' '),
-                                              bufsize=1, stdout=subprocess.PIPE, cwd=path).stdout
-        show_lines = list(map(lambda line: line.decode('utf-8', 'replace'), commit_msg_process.readlines()))
-        commit_msg_process.close()
+    def process_diff_between_commits(sha_old: str, sha_new: str, path: str) -> List[Tuple[str, str, int, int, str]]:
+        return [v for changes in Git_Util.iter_diff_between_commits(sha_old, sha_new, path) for v in changes]
 
-        return '\n'.join(show_lines)
+    def get_commit_msg(self, sha: str, path: str) -> str:
+        commit = self.batch_session(path).commit(sha)
+        if commit is None:
+            return ''
+        # Laid out as the lines of `git log --format=%B` joined by newlines
+        return '\n'.join(line + '\n' for line in (commit[1] + '\n').split('\n')[:-1])
 
     @staticmethod
     def get_all_commit_hashes(path: str) -> List[str]:
@@ -171,75 +351,48 @@ class Git_Util(object):
                                    zip(list_of_commit_metadata[0::2], list_of_commit_metadata[1::2])]
         return [e for e in [Git_Util.parse_git_log_entry(e) for e in list_of_commit_metadata] if e is not None]
 
-    @staticmethod
-    def get_author(sha: str, path: str) -> str:
-        commit_show_process = subprocess.Popen(['git', 'show', '--format=fuller', '--unified=0', sha],
-                                               bufsize=1, stdout=subprocess.PIPE, cwd=path).stdout
-        show_lines = list(map(lambda line: line.decode('utf-8', 'replace'), commit_show_process.readlines()))
-        commit_show_process.close()
+    def get_author(self, sha: str, path: str) -> str:
+        commit = self.batch_session(path).commit(sha)
 
-        # Sanity check that we are looking at the expected commit
-        assert (len(show_lines) > 0)
-        assert (show_lines[0].split(' ')[-1].strip().startswith(sha))
+        # Sanity check that we are looking at a commit
+        assert (commit is not None and 'author' in commit[0].keys())
 
-        # Navigate to the start of the commit diff
-        current_index = 0
-        while not (show_lines[current_index].startswith('Author')):
-            current_index += 1
-        author = show_lines[current_index].split(':')[-1][1:].strip().split('<')[0][:-1]
-        return author
+        return Git_Batch.parse_ident(commit[0]['author'][0])[0]
 
     @staticmethod
     def process_a_commit(sha: str, path: str) -> Tuple[str, List[Tuple[str, str, int, int, str]]]:
-        commit_show_process = subprocess.Popen(['git', 'show', '--format=fuller', '--unified=0', sha],
-                                               bufsize=1, stdout=subprocess.PIPE, cwd=path).stdout
-        show_lines = list(map(lambda line: line.decode('utf-8', 'replace'), commit_show_process.readlines()))
-        commit_show_process.close()
-
-        # Sanity check that we are looking at the expected commit
-        assert (len(show_lines) > 0)
-        assert (show_lines[0].split(' ')[-1].strip().startswith(sha))
-
-        # Navigate to the start of the commit diff
-        current_index = 0
-        while not (show_lines[current_index].startswith('Author')):
-            current_index += 1
-        author = show_lines[current_index].split(':')[-1][1:].strip().split('<')[0][:-1]
-        current_index += 4
-        while not (show_lines[current_index] == '\n'):
-            current_index += 1
-        current_index += 1
-        if current_index < len(show_lines):
-            while True:
-                curr_line = show_lines[current_index]
-                current_index += 1
+        with subprocess.Popen(['git', 'show', '--format=fuller', '--unified=0', sha],
+                              bufsize=-1, stdout=subprocess.PIPE, cwd=path) as commit_show_process:
+            show_lines = (line.decode('utf-8', 'replace') for line in commit_show_process.stdout)
+            curr_line = next(show_lines, None)
+
+            # Sanity check that we are looking at the expected commit
+            assert (curr_line is not None)
+            assert (curr_line.split(' ')[-1].strip().startswith(sha))
+
+            # Navigate to the start of the commit diff
+            while not (curr_line.startswith('Author')):
+                curr_line = Git_Util._next_line(show_lines)
+            author = curr_line.split(':')[-1][1:].strip().split('<')[0][:-1]
+            for _ in range(4):
+                curr_line = Git_Util._next_line(show_lines)
+            while not (curr_line == '\n'):
+                curr_line = Git_Util._next_line(show_lines)
+            for curr_line in show_lines:
                 if curr_line == '\n':
                     break
-                if current_index == len(show_lines):  # We reached EOF in title, i.e. the commit has no diff-s
-                    break
-        # End of navigation to start of diff
-
-        diffs = []
-        if current_index < len(show_lines):
-            current_diff = ''
-            while True:
-                curr_line = show_lines[current_index]
-                if current_index + 1 == len(show_lines):  # We reached the EOF
-                    current_diff += curr_line
-                    diffs.append(current_diff.strip())
-                    break
-                elif (curr_line.startswith('diff --git')) or (
-                        curr_line.startswith('diff --cc')):  # New diff for this commit
-                    if current_diff != '':
-                        diffs.append(current_diff.strip())
-                    current_diff = curr_line
-                else:
-                    current_diff += curr_line
-                current_index += 1
+            # End of navigation to start of diff
 
-        diffs = [v for sublist in list(map(Git_Util.process_diff_output, diffs)) for v in sublist]
+            diffs = [v for changes in Git_Util.iter_diff_output(show_lines) for v in changes]
         return author, diffs
 
+    @staticmethod
+    def _next_line(lines: Iterator[str]) -> str:
+        line = next(lines, None)
+        if line is None:
+            raise IndexError('Unexpected end of git output')
+        return line
+
     @staticmethod
     def process_git_blame(file, path):
         commit_show_process = subprocess.Popen(['git', 'blame', file],
@@ -279,6 +432,32 @@ class Git_Util(object):
 
         return result
 
+    @staticmethod
+    def iter_diff_output(lines: Iterable[str]) -> Iterator[List[Tuple[str, str, int, int, str]]]:
+        """
+        Incrementally parse git diff (or show) output, only the changes of the current file are held in memory
+        :param lines: The decoded lines of the diff, with or without their line endings
+        :return: A generator yielding, per file, the changes process_diff_output would return for that file
+        """
+        current = None
+        for line in lines:
+            if line.endswith('\n'):
+                line = line[:-1]
+            if line.startswith('diff --git') or line.startswith('diff --cc'):  # New diff for this commit
+                if current is not None:
+                    changes = current.finish()
+                    if len(changes) > 0:
+                        yield changes
+                current = _File_Diff(line)
+            elif current is None:
+                current = _File_Diff(line, buffered=True)  # Content preceding the first file diff
+            else:
+                current.feed(line)
+        if current is not None:
+            changes = current.finish()
+            if len(changes) > 0:
+                yield changes
+
     @staticmethod
     def process_diff_output(diff: str) -> List[Tuple[str, str, int, int, str]]:
         header = 0
@@ -313,3 +492,126 @@ class Git_Util(object):
                 add_ctr += 1
 
         return [p for p in segmented_diffs if p[0] != ' ']
+
+
+def _synthetic_diff(files: int, hunks: int, hunk_size: int) -> Iterator[str]:
+    for f in range(files):
+        yield 'diff --git a/src/file%d.cs b/src/file%d.cs\n' % (f, f)
+        yield 'index 0000000..1111111 100644\n'
+        yield '--- a/src/file%d.cs\n' % f
+        yield '+++ b/src/file%d.cs\n' % f
+        for h in range(hunks):
+            start = h * hunk_size * 3 + 1
+            yield '@@ -%d,%d +%d,%d @@ class C%d\n' % (start, hunk_size, start, hunk_size, f)
+            for i in range(hunk_size):
+                yield '-            var value%d = Compute(%d, %d);\n' % (i, f, h)
+                yield '+            var value%d = ComputeFaster(%d, %d);\n' % (i, f, h)
+                yield '             Consume(value%d);\n' % i
+
+
+def _split_diff_output(lines: Iterable[str]) -> List[Tuple[str, str, int, int, str]]:
+    # Reads the whole diff before parsing it, as process_diff_between_commits used to
+    show_lines = list(lines)
+    diffs = list()
+    current_diff = ''
+    for curr_line in show_lines:
+        if curr_line.startswith('diff --git') or curr_line.startswith('diff --cc'):
+            if current_diff != '':
+                diffs.append(current_diff.strip())
+            current_diff = curr_line
+        else:
+            current_diff += curr_line
+    diffs.append(current_diff.strip())
+    return [v for sublist in list(map(Git_Util.process_diff_output, diffs)) for v in sublist]
+
+
+def _benchmark_diff(files: int):
+    import time
+    import tracemalloc
+
+    # Throughput and peak memory of the streaming diff parser against reading the whole diff up front,
+    # on a synthetic diff of <files> files with 20 hunks of 20 changed line pairs each
+    size = sum(len(line) for line in _synthetic_diff(files, hunks=20, hunk_size=20)) / 2 ** 20
+    results = dict()
+    for name, parse in [('streaming', lambda lines: [v for changes in Git_Util.iter_diff_output(lines)
+                                                     for v in changes]),
+                        ('buffered', _split_diff_output)]:
+        t0 = time.perf_counter()
+        results[name] = parse(_synthetic_diff(files, hunks=20, hunk_size=20))
+        t1 = time.perf_counter()
+        tracemalloc.start()
+        parse(_synthetic_diff(files, hunks=20, hunk_size=20))
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print('%s: %.1fMB diff (%d changes) in %.3fs, %.1fMB/s, peak memory %.1fMB'
+              % (name, size, len(results[name]), t1 - t0, size / (t1 - t0), peak / 2 ** 20))
+    assert results['streaming'] == results['buffered']
+
+
+def _benchmark_lookups(path: str):
+    import time
+
+    # Author, date and message lookups for every commit of a repository, over one cat-file session against
+    # one `git log` process per commit
+    shas = Git_Util.get_all_commit_hashes(path)
+    with Git_Util(temp_dir=None) as gh:
+        t0 = time.perf_counter()
+        for sha in shas:
+            gh.get_author(sha, path)
+            gh.get_commit_msg(sha, path)
+            gh.get_time_between_commits(sha, shas[0], path)
+        t1 = time.perf_counter()
+    for sha in shas:
+        for format_ in ['%an', '%B', '%ad']:
+            subprocess.run(['git', 'log', '-n', '1', '--format=' + format_, sha], cwd=path, stdout=subprocess.PIPE)
+    t2 = time.perf_counter()
+    print('%d commits: cat-file session %.3fs, process per lookup %.3fs' % (len(shas), t1 - t0, t2 - t1))
+
+
+def _disk_usage(path: str) -> int:
+    """
+    :return: The bytes allocated to the files under path, hard-linked files are counted once
+    """
+    seen = set()
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for name in dirs + files:
+            stat = os.lstat(os.path.join(root, name))
+            if (stat.st_dev, stat.st_ino) not in seen:
+                seen.add((stat.st_dev, stat.st_ino))
+                total += stat.st_blocks * 512
+    return total
+
+
+def _benchmark_setup(path: str, temp_dir: Optional[str]):
+    import time
+
+    # Time and disk space to set up the two checkouts a corpus worker uses, in each checkout mode
+    with Git_Util(temp_dir=temp_dir) as gh:
+        head = gh.batch_session(path).info('HEAD')[0]
+    for mode in CHECKOUT_MODES:
+        with Git_Util(temp_dir=temp_dir, mode=mode) as gh:
+            t0 = time.perf_counter()
+            v1 = gh.move_git_repo_to_tmp(path)
+            v2 = gh.move_git_repo_to_tmp(path)
+            t1 = time.perf_counter()
+            gh.set_git_to_rev(head, v1)
+            gh.set_git_to_rev(head, v2)
+            usage = _disk_usage(v1) + _disk_usage(v2)
+        print('%s: set up in %.3fs, %.1fMB on disk' % (mode, t1 - t0, usage / 2 ** 20))
+
+
+if __name__ == '__main__':
+    import sys
+
+    if len(sys.argv) < 2 or sys.argv[1] not in ['diff', 'lookups', 'setup']:
+        print('To use this script please run as `[python] git_util.py diff [<number of files>]`, '
+              '`[python] git_util.py lookups <git location>` '
+              'or `[python] git_util.py setup <git location> [<temp location>]`')
+        exit(1)
+    if sys.argv[1] == 'diff':
+        _benchmark_diff(int(sys.argv[2]) if len(sys.argv) > 2 else 200)
+    elif sys.argv[1] == 'lookups':
+        _benchmark_lookups(sys.argv[2])
+    else:
+        _benchmark_setup(sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else None)
@@ -0,0 +1,290 @@
+import hashlib
+import heapq
+import os
+import zipfile
+from typing import Any, Dict, List, Optional, Tuple
+
+import networkx as nx
+import numpy as np
+
+# Binary sidecar of a DOT file: <file>.dot -> <file>.dot.npz
+CACHE_SUFFIX = '.npz'
+FORMAT_VERSION = 2
+# The arrays _attribute_columns stores per attribute kind, under node_attr_<name> and edge_attr_<name>
+_attribute_arrays = ('names', 'codes', 'layout_offsets', 'layout_rows', 'layout')
+
+
+class _String_Table(object):
+    """
+    Interns strings (node names, edge keys, attribute names and values) so that each distinct string is stored once
+    """
+
+    def __init__(self):
+        self.index = dict()
+        self.strings = list()
+
+    def __call__(self, string: str) -> int:
+        try:
+            return self.index[string]
+        except KeyError:
+            self.index[string] = len(self.strings)
+            self.strings.append(string)
+            return self.index[string]
+
+    def to_arrays(self) -> Tuple[np.ndarray, np.ndarray]:
+        encoded = [s.encode('utf-8') for s in self.strings]
+        offsets = np.zeros(shape=(len(encoded) + 1,), dtype=np.int64)
+        np.cumsum([len(e) for e in encoded], out=offsets[1:])
+        return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+
+def _strings_from_arrays(blob: np.ndarray, offsets: np.ndarray) -> List[str]:
+    data = blob.tobytes()
+    offsets = offsets.tolist()
+    return [data[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(len(offsets) - 1)]
+
+
+def _attribute_columns(table: _String_Table, attributes: List[Dict[str, str]]) \
+        -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    :return: The interned attribute names, per name a row of value codes (-1 where absent), the distinct key orders
+             (layouts) as rows of the codes in CSR layout (offsets/rows), and the layout of each attribute dict
+    """
+    names = list(dict.fromkeys(name for attr in attributes for name in attr.keys()))
+    row_of = {name: row for row, name in enumerate(names)}
+    codes = np.full(shape=(len(names), len(attributes)), fill_value=-1, dtype=np.int32)
+    layouts = dict()
+    layout = np.zeros(shape=(len(attributes),), dtype=np.int32)
+    for column, attr in enumerate(attributes):
+        rows = tuple(row_of[name] for name in attr.keys())
+        layout[column] = layouts.setdefault(rows, len(layouts))
+        for row, value in zip(rows, attr.values()):
+            codes[row, column] = table(str(value))
+    layout_offsets = np.zeros(shape=(len(layouts) + 1,), dtype=np.int64)
+    np.cumsum([len(rows) for rows in layouts.keys()], out=layout_offsets[1:])
+    layout_rows = np.asarray([row for rows in layouts.keys() for row in rows], dtype=np.int32)
+    return np.asarray([table(name) for name in names], dtype=np.int32), codes, layout_offsets, layout_rows, layout
+
+
+def _attribute_dicts(strings: List[str], names: np.ndarray, codes: np.ndarray, layout_offsets: np.ndarray,
+                     layout_rows: np.ndarray, layout: np.ndarray) -> List[Dict[str, str]]:
+    names = [strings[n] for n in names.tolist()]
+    layout_offsets, layout_rows = layout_offsets.tolist(), layout_rows.tolist()
+    layouts = [layout_rows[layout_offsets[i]:layout_offsets[i + 1]] for i in range(len(layout_offsets) - 1)]
+    codes = codes.T.tolist()
+    return [{names[row]: strings[column[row]] for row in layouts[l]} for column, l in zip(codes, layout.tolist())]
+
+
+def _insertion_order(graph: nx.MultiDiGraph, nodes: List[Any]) -> np.ndarray:
+    """
+    An order to add the edges of graph in that reproduces the successor, predecessor and key order of every node.
+    NetworkX keeps the successors (predecessors) of a node in the order their first edge was added and the keys of
+    an edge in the order they were added, any order consistent with these will do, e.g. the one graph was built in.
+    This is a topological order of these constraints, ties broken by out-edge CSR position to make it deterministic.
+    :return: The CSR positions of the edges (as graph_to_arrays lays them out) in the order to add them in
+    """
+    follows = list()
+    first_edge = dict()
+    for node in nodes:
+        previous_first = -1
+        for target, key_dict in graph.adj[node].items():
+            first_edge[(node, target)] = len(follows)
+            if previous_first != -1:
+                follows[previous_first].append(len(follows))
+            previous_first = len(follows)
+            for j in range(len(key_dict)):
+                follows.append([len(follows) + 1] if j + 1 < len(key_dict) else [])
+    for node in nodes:
+        previous_first = -1
+        for source in graph.pred[node].keys():
+            if previous_first != -1:
+                follows[previous_first].append(first_edge[(source, node)])
+            previous_first = first_edge[(source, node)]
+
+    in_degree = [0] * len(follows)
+    for successors in follows:
+        for f in successors:
+            in_degree[f] += 1
+    ready = [e for e in range(len(follows)) if in_degree[e] == 0]
+    heapq.heapify(ready)
+    order = list()
+    while len(ready) > 0:
+        e = heapq.heappop(ready)
+        order.append(e)
+        for f in follows[e]:
+            in_degree[f] -= 1
+            if in_degree[f] == 0:
+                heapq.heappush(ready, f)
+    return np.asarray(order, dtype=np.int64)
+
+
+def graph_to_arrays(graph: nx.MultiDiGraph) -> Dict[str, np.ndarray]:
+    """
+    Flatten a deltaPDG into arrays: node names, out-edges in CSR layout (indptr/targets) with their keys, and per
+    attribute (label, span, cluster, color, community, ...) an array of codes into a shared interned string table.
+    Absent attributes are coded as -1. The order edges were added in and the key order of every attribute dict are
+    kept too, so that arrays_to_graph iterates nodes, edges (in and out) and attributes exactly as graph does.
+    Edge keys must be strings, as they are in graphs read from DOT: an int key would come back as a string.
+    :raises TypeError: when graph has an edge key that is not a string
+    """
+    table = _String_Table()
+    nodes = list(graph.nodes)
+    node_index = {n: i for i, n in enumerate(nodes)}
+    node_names = np.asarray([table(str(n)) for n in nodes], dtype=np.int32)
+    node_attributes = _attribute_columns(table, [graph.nodes[n] for n in nodes])
+
+    indptr = np.zeros(shape=(len(nodes) + 1,), dtype=np.int64)
+    targets = list()
+    keys = list()
+    edge_attributes = list()
+    for i, node in enumerate(nodes):
+        for target, key_dict in graph.adj[node].items():
+            for key, data in key_dict.items():
+                if not isinstance(key, str):
+                    raise TypeError('Edge key %r of (%s, %s) is not a string' % (key, node, target))
+                targets.append(node_index[target])
+                keys.append(table(key))
+                edge_attributes.append(data)
+        indptr[i + 1] = len(targets)
+    edge_order = _insertion_order(graph, nodes)
+    edge_attributes = _attribute_columns(table, edge_attributes)
+
+    blob, offsets = table.to_arrays()
+    return {
+        'node_names': node_names,
+        'node_attr_names': node_attributes[0],
+        'node_attr_codes': node_attributes[1],
+        'node_attr_layout_offsets': node_attributes[2],
+        'node_attr_layout_rows': node_attributes[3],
+        'node_attr_layout': node_attributes[4],
+        'indptr': indptr,
+        'targets': np.asarray(targets, dtype=np.int32),
+        'keys': np.asarray(keys, dtype=np.int32),
+        'edge_order': edge_order,
+        'edge_attr_names': edge_attributes[0],
+        'edge_attr_codes': edge_attributes[1],
+        'edge_attr_layout_offsets': edge_attributes[2],
+        'edge_attr_layout_rows': edge_attributes[3],
+        'edge_attr_layout': edge_attributes[4],
+        'strings': blob,
+        'string_offsets': offsets,
+    }
+
+
+def arrays_to_graph(arrays: Dict[str, np.ndarray]) -> nx.MultiDiGraph:
+    strings = _strings_from_arrays(arrays['strings'], arrays['string_offsets'])
+    nodes = [strings[n] for n in arrays['node_names'].tolist()]
+    node_attributes = _attribute_dicts(strings, *(arrays['node_attr_' + k] for k in _attribute_arrays))
+    edge_attributes = _attribute_dicts(strings, *(arrays['edge_attr_' + k] for k in _attribute_arrays))
+    sources = np.repeat(np.arange(len(nodes)), np.diff(arrays['indptr']))
+    order = arrays['edge_order']
+
+    graph = nx.MultiDiGraph()
+    graph.add_nodes_from(zip(nodes, node_attributes))
+    graph.add_edges_from((nodes[s], nodes[t], strings[k], edge_attributes[e])
+                         for s, t, k, e in zip(sources[order].tolist(), arrays['targets'][order].tolist(),
+                                               arrays['keys'][order].tolist(), order.tolist()))
+    return graph
+
+
+def _file_hash(location: str) -> str:
+    sha = hashlib.sha1()
+    with open(location, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def write_graph_cache(graph: nx.MultiDiGraph, source_location: str, cache_location: str = None):
+    """
+    Store graph as the binary sidecar of the DOT file it was read from
+    :param graph: The graph read from source_location
+    :param source_location: The DOT file, its mtime, size and hash are recorded to validate the cache later
+    :param cache_location: Where to store the cache, defaults to source_location + CACHE_SUFFIX
+    """
+    cache_location = source_location + CACHE_SUFFIX if cache_location is None else cache_location
+    stat = os.stat(source_location)
+    arrays = graph_to_arrays(graph)
+    arrays['version'] = np.asarray([FORMAT_VERSION, stat.st_mtime_ns, stat.st_size], dtype=np.int64)
+    arrays['source_hash'] = np.frombuffer(_file_hash(source_location).encode('ascii'), dtype=np.uint8)
+    _save_arrays(arrays, cache_location)
+
+
+def _save_arrays(arrays: Dict[str, np.ndarray], cache_location: str):
+    # Write to a temporary file first so that concurrent readers never see a partial cache
+    temp_location = '%s.%d.tmp' % (cache_location, os.getpid())
+    with open(temp_location, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(temp_location, cache_location)
+
+
+def read_graph_cache(source_location: str, cache_location: str = None) -> Optional[nx.MultiDiGraph]:
+    """
+    Load the binary sidecar of a DOT file
+    :param source_location: The DOT file the cache was built from
+    :param cache_location: Where the cache is stored, defaults to source_location + CACHE_SUFFIX
+    :return: The cached graph, None when there is no cache or it is stale w.r.t. source_location
+    """
+    cache_location = source_location + CACHE_SUFFIX if cache_location is None else cache_location
+    try:
+        with np.load(cache_location, allow_pickle=False) as cached:
+            arrays = {k: cached[k] for k in cached.files}
+        stat = os.stat(source_location)
+    except (OSError, EOFError, ValueError, KeyError, zipfile.BadZipFile):
+        return None
+
+    version, mtime, size = arrays['version'].tolist()
+    if version != FORMAT_VERSION:
+        return None
+    if (mtime, size) != (stat.st_mtime_ns, stat.st_size):
+        # The file was touched, it is only stale if the contents changed
+        if arrays['source_hash'].tobytes().decode('ascii') != _file_hash(source_location):
+            return None
+        # Record the new mtime so that later loads do not hash the file again
+        arrays['version'] = np.asarray([FORMAT_VERSION, stat.st_mtime_ns, stat.st_size], dtype=np.int64)
+        try:
+            _save_arrays(arrays, cache_location)
+        except OSError:
+            pass
+    return arrays_to_graph(arrays)
+
+
+def _iteration_order(graph: nx.MultiDiGraph) -> Tuple[list, list, list]:
+    """
+    :return: The nodes, out-edges and in-edges of graph with their attributes, in iteration order; unlike dicts, these
+             are only equal if the orders are
+    """
+    return ([(n, list(d.items())) for n, d in graph.nodes(data=True)],
+            [(u, v, k, list(d.items())) for u, v, k, d in graph.edges(keys=True, data=True)],
+            list(graph.in_edges(keys=True)))
+
+
+if __name__ == '__main__':
+    import sys
+    import tempfile
+    import time
+
+    from Util.general_util import get_pattern_paths
+    from deltaPDG.Util.pygraph_util import read_networkx_from_dot
+
+    # Check that cached graphs are the graphs DOT parsing gives on a corpus, e.g. ./data/corpora_clean/<repository>
+    all_graphs = get_pattern_paths('*.dot', sys.argv[1])
+    dot_time, cache_time, mismatches = 0.0, 0.0, list()
+    with tempfile.TemporaryDirectory() as temp_dir:
+        cache_location = os.path.join(temp_dir, 'graph.dot' + CACHE_SUFFIX)
+        for graph_location in all_graphs:
+            t0 = time.perf_counter()
+            graph = read_networkx_from_dot(graph_location, use_cache=False)
+            t1 = time.perf_counter()
+            write_graph_cache(graph, graph_location, cache_location)
+            t2 = time.perf_counter()
+            cached = read_graph_cache(graph_location, cache_location)
+            t3 = time.perf_counter()
+            dot_time += t1 - t0
+            cache_time += t3 - t2
+            if cached is None or _iteration_order(cached) != _iteration_order(graph):
+                mismatches.append(graph_location)
+    print('Read %d graphs: DOT %.3fs, cache %.3fs (%.1fx)' % (len(all_graphs), dot_time, cache_time,
+                                                              dot_time / max(cache_time, 1e-9)))
+    for mismatch in mismatches:
+        print('Mismatch: %s' % mismatch)
@@ -0,0 +1,127 @@
+import os
+import threading
+from collections import namedtuple
+from typing import Any, Callable, List, Tuple
+
+Cache_Info = namedtuple('Cache_Info', ['hits', 'misses', 'evictions', 'maxsize', 'currsize'])
+
+# Eviction removes the least recently used entries until the store is back under this fraction of its maximum size
+_low_water = 0.9
+
+
+class LRU_File_Store(object):
+    """
+    Directory of cache entries, one file per key under location/key[:2]/. The store is shared by all processes using
+    the same location; once it grows beyond max_size bytes the least recently used entries (by file mtime, refreshed
+    on every hit) are evicted. Subclasses define the keys and the entry format, and read and write entries through
+    _load and _store.
+    """
+
+    # The file name extension of entries
+    suffix = ''
+    # The errors of reading an entry that count as a miss, e.g. because it was evicted or is of an older format
+    read_errors = (FileNotFoundError,)
+
+    def __init__(self, location: str, max_size: int):
+        """
+        :param location: The directory holding the entries
+        :param max_size: The size in bytes the store is trimmed down to, 0 disables caching
+        """
+        self.location = location
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Guards the statistics when the store is shared by threads
+        self.lock = threading.Lock()
+        os.makedirs(location, exist_ok=True)
+        self.size = sum(size for _, _, size in self._entries())
+
+    def _entries(self) -> List[Tuple[str, int, int]]:
+        """
+        :return: The path, mtime and size of every entry
+        """
+        entries = list()
+        for bucket in os.scandir(self.location):
+            if not bucket.is_dir():
+                continue
+            for entry in os.scandir(bucket.path):
+                if entry.name.endswith(self.suffix):
+                    try:
+                        stat = entry.stat()
+                        entries.append((entry.path, stat.st_mtime_ns, stat.st_size))
+                    except FileNotFoundError:
+                        pass  # Evicted by another process
+        return entries
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.location, key[:2], key + self.suffix)
+
+    def _load(self, key: str, read: Callable[[str], Any]) -> Any:
+        """
+        :param read: Reads the entry at the path it is given
+        :return: What read returned, None on a miss
+        """
+        if self.max_size > 0:
+            path = self._path(key)
+            try:
+                value = read(path)
+            except self.read_errors:
+                pass
+            else:
+                try:
+                    os.utime(path)
+                except FileNotFoundError:
+                    pass  # Evicted by another process since it was read, the data read is still good
+                with self.lock:
+                    self.hits += 1
+                return value
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def _store(self, key: str, write: Callable[[str], None]):
+        """
+        :param write: Writes the entry to the path it is given. That is a temporary file, moved in place once written
+                      so that concurrent readers never see a partial entry.
+        """
+        if self.max_size <= 0:
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = '%s.%d.%d.tmp' % (path, os.getpid(), threading.get_ident())
+        write(temp_path)
+        size = os.path.getsize(temp_path)
+        os.replace(temp_path, path)
+        with self.lock:
+            self.size += size
+            if self.size > self.max_size:
+                self._evict()
+
+    def evict(self):
+        with self.lock:
+            self._evict()
+
+    def _evict(self):
+        """
+        Remove the least recently used entries until the store is under its low water mark. Other processes sharing
+        the store are accounted for as the sizes are taken from disk.
+        """
+        entries = sorted(self._entries(), key=lambda e: e[1])
+        self.size = sum(size for _, _, size in entries)
+        for path, _, size in entries:
+            if self.size <= self.max_size * _low_water:
+                break
+            try:
+                os.remove(path)
+                self.evictions += 1
+            except FileNotFoundError:
+                pass
+            self.size -= size
+
+    def cache_info(self) -> Cache_Info:
+        return Cache_Info(self.hits, self.misses, self.evictions, self.max_size, self.size)
+
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups > 0 else 0.0
@@ -2,10 +2,9 @@
 import itertools
 import os
 
-import networkx as nx
-
 from Util.general_util import get_pattern_paths
-from deltaPDG.Util.pygraph_util import read_graph_from_dot, obj_dict_to_networkx, get_context_from_nxgraph
+from deltaPDG.Util.pygraph_util import read_graph_from_dot, obj_dict_to_networkx, get_context_from_nxgraph, \
+    write_dot
 
 
 def find_entry_and_exit(context, graph):
@@ -118,4 +117,4 @@ if __name__ == '__main__':
         'out',
         'gui.cs'
     )))
-    nx.drawing.nx_pydot.write_dot(merged, './out/gui.cs/gui.cs.dot')
+    write_dot(merged, './out/gui.cs/gui.cs.dot')
@@ -1,71 +1,136 @@
+from collections import defaultdict, deque
+
 from deltaPDG.Util.equivalence_util import Eq_Utils
 
 
+def _is_anchor_candidate(data) -> bool:
+    return 'color' not in data.keys() or data['color'] == 'orange'
+
+
 class Marked_Merger(object):
     def __init__(self, m_fuzziness: int, n_fuzziness: int):
         self.m_fuzziness = m_fuzziness
         self.n_fuzziness = n_fuzziness
         self.eq_utils = Eq_Utils(m_fuzziness, n_fuzziness)
 
-    def __call__(self, before_apdg, after_apdg):
-        before_apdg = before_apdg.copy()
-        after_apdg = after_apdg.copy()
+    def _is_equivalent(self, before_apdg, node, data, after_apdg, other_node, other_data) -> bool:
+        equivalent = self.eq_utils.node_eq(before_apdg, node, after_apdg, other_node)
+        try:
+            equivalent = equivalent \
+                         and self.eq_utils.context_eq(data['cluster'], other_data['cluster'])
+        except KeyError:
+            equivalent = equivalent \
+                         and 'cluster' not in data.keys() \
+                         and 'cluster' not in other_data.keys()
+        return equivalent
+
+    def _find_anchors_linear(self, before_apdg, after_apdg):
+        """
+        Reference anchor search: every unchanged before-node is compared against every unchanged after-node
+        """
         label_map_ab = dict()
         label_map_ba = dict()
-
         for node, data in before_apdg.nodes(data=True):
-            if 'color' in data.keys() and data['color'] != 'orange':
+            if not _is_anchor_candidate(data):
                 continue
             for other_node, other_data in after_apdg.nodes(data=True):
                 if other_node in label_map_ba.keys():
                     continue
-                if 'color' in other_data.keys() and other_data['color'] != 'orange':
+                if not _is_anchor_candidate(other_data):
+                    continue
+                if self._is_equivalent(before_apdg, node, data, after_apdg, other_node, other_data):
+                    label_map_ab[str(node)] = str(other_node)
+                    label_map_ba[str(other_node)] = str(node)
+                    break
+        return label_map_ab, label_map_ba
+
+    def _find_anchors(self, before_apdg, after_apdg):
+        """
+        Same result as _find_anchors_linear, but only after-nodes whose label can reach the n_fuzziness cutoff are
+        compared: equal labels when n_fuzziness is 100, otherwise the labels Eq_Utils found similar when batching
+        the label comparisons. Candidates are visited in graph order so the first equivalent node is still the one
+        picked.
+        """
+        before_nodes = [(n, d) for n, d in before_apdg.nodes(data=True) if _is_anchor_candidate(d)]
+        after_nodes = [(n, d) for n, d in after_apdg.nodes(data=True) if _is_anchor_candidate(d)]
+        if any('label' not in d.keys() for _, d in before_nodes + after_nodes):
+            # Eq_Utils.node_eq raises on unlabelled nodes, keep the reference behaviour for such graphs
+            return self._find_anchors_linear(before_apdg, after_apdg)
+        self.eq_utils.precompute([d['label'] for _, d in before_nodes], [d['label'] for _, d in after_nodes],
+                                 [d['cluster'] for _, d in before_nodes if 'cluster' in d.keys()],
+                                 [d['cluster'] for _, d in after_nodes if 'cluster' in d.keys()])
+
+        buckets = defaultdict(list)
+        for position, (_, other_data) in enumerate(after_nodes):
+            buckets[other_data['label']].append(position)
+
+        if self.n_fuzziness >= 100:
+            def candidates(label):
+                return buckets.get(label, [])
+        else:
+            def candidates(label):
+                return sorted(p for other_label in self.eq_utils.similar_labels(label, list(buckets.keys()))
+                              for p in buckets[other_label])
+
+        label_map_ab = dict()
+        label_map_ba = dict()
+        mapped = set()
+        for node, data in before_nodes:
+            for position in candidates(data['label']):
+                if position in mapped:
                     continue
-                equivalent = self.eq_utils.node_eq(before_apdg, node, after_apdg, other_node)
-                try:
-                    equivalent = equivalent \
-                                 and self.eq_utils.context_eq(data['cluster'], other_data['cluster'])
-                except KeyError:
-                    equivalent = equivalent \
-                                 and 'cluster' not in data.keys() \
-                                 and 'cluster' not in other_data.keys()
-                if equivalent:
+                other_node, other_data = after_nodes[position]
+                if self._is_equivalent(before_apdg, node, data, after_apdg, other_node, other_data):
                     label_map_ab[str(node)] = str(other_node)
                     label_map_ba[str(other_node)] = str(node)
+                    mapped.add(position)
                     break
+        return label_map_ab, label_map_ba
+
+    def __call__(self, before_apdg, after_apdg):
+        before_apdg = before_apdg.copy()
+        label_map_ab, label_map_ba = self._find_anchors(before_apdg, after_apdg)
+        # Edges of the after graph that have been moved over (or discarded), tracked instead of removing them from a
+        # copy of the after graph
+        removed = set()
+
+        def live_in_edges(node):
+            return [e for e in after_apdg.in_edges(nbunch=[node], keys=True) if e not in removed]
+
+        def live_out_edges(node):
+            return [e for e in after_apdg.out_edges(nbunch=[node], keys=True) if e not in removed]
+
         # Visit anchors, explore neighbourhood and copy over nodes
         # Each node copied: add to a list to be explored
         # As each node is explored add copied nodes
         # Stop when list is empty
         # Boot strap list with all marked nodes in v2
-        to_visit = [str(node) for node in after_apdg.nodes() if
-                    'color' in after_apdg.node[node].keys() and after_apdg.node[node]['color'] != 'orange']
-        visited = list()
+        to_visit = deque(str(node) for node in after_apdg.nodes() if
+                         'color' in after_apdg.nodes[node].keys() and after_apdg.nodes[node]['color'] != 'orange')
+        queued = set(to_visit)
+        visited = set()
 
-        work_to_be_done = len(to_visit) > 0
-        # counter = 1
         # We fixed-point compute this due to the fact that we leave potentially dangling edges, 
         # so we iterate until all edges point to real nodes
-        while work_to_be_done:
-            # print(to_visit)
-            # print(visited)
-            node_id = to_visit[0]
+        while to_visit:
+            node_id = to_visit.popleft()
+            queued.discard(node_id)
             node_id = node_id.replace('n', 'd') if node_id not in label_map_ba.keys() else label_map_ba[node_id]
-            to_visit = to_visit[1:]
-            if not (before_apdg.has_node(node_id) and 'label' in before_apdg.node[node_id].keys()):
+            if not (before_apdg.has_node(node_id) and 'label' in before_apdg.nodes[node_id].keys()):
                 # Find node in after graph and visit if not visited (sanity check)
                 other_node = 'n' + node_id[1:]
                 if other_node not in visited:
-                    before_apdg.add_node(node_id, **after_apdg.node[other_node])
+                    before_apdg.add_node(node_id, **after_apdg.nodes[other_node])
 
                     # Add in-edges from after graph to before graph, we leave references to un-imported nodes dangling
                     # However, we also add the un-imported nodes to the to-visit list
-                    in_edges = after_apdg.in_edges(nbunch=[other_node], keys=True)
-                    for in_edge in list(in_edges):
+                    for in_edge in live_in_edges(other_node):
                         in_, _, key = in_edge
                         if in_ not in label_map_ba.keys():
                             in_id = str(in_).replace('n', 'd')
-                            if in_ not in to_visit and in_ not in visited: to_visit.append(in_)
+                            if in_ not in queued and in_ not in visited:
+                                to_visit.append(in_)
+                                queued.add(in_)
                         else:
                             in_id = label_map_ba[str(in_)]
                         if before_apdg.has_edge(in_id, node_id, key):
@@ -73,19 +138,20 @@ class Marked_Merger(object):
                                                           after_apdg[in_][other_node][key])):
                                 before_apdg.add_edge(in_id, node_id, key,
                                                      **after_apdg[in_][other_node][key])
-                                after_apdg.remove_edge(in_, other_node, key)
+                                removed.add(in_edge)
                         else:
                             before_apdg.add_edge(in_id, node_id, key, **after_apdg[in_][other_node][key])
-                            after_apdg.remove_edge(in_, other_node, key)
+                            removed.add(in_edge)
 
                     # Add out-edges from after graph to before graph, we leave references to un-imported nodes dangling
                     # However, we also add the un-imported nodes to the to-visit list
-                    out_edges = after_apdg.out_edges(nbunch=[other_node], keys=True)
-                    for out_edge in list(out_edges):
+                    for out_edge in live_out_edges(other_node):
                         _, out_, key = out_edge
                         if out_ not in label_map_ba.keys():
                             out_id = str(out_).replace('n', 'd')
-                            if out_ not in to_visit and out_ not in visited: to_visit.append(out_)
+                            if out_ not in queued and out_ not in visited:
+                                to_visit.append(out_)
+                                queued.add(out_)
                         else:
                             out_id = label_map_ba[str(out_)]
                         if before_apdg.has_edge(node_id, out_id, key):
@@ -93,23 +159,22 @@ class Marked_Merger(object):
                                                           after_apdg[other_node][out_][key])):
                                 before_apdg.add_edge(node_id, out_id, key,
                                                      **after_apdg[other_node][out_][key])
-                                after_apdg.remove_edge(other_node, out_, key)
+                                removed.add(out_edge)
                         else:
                             before_apdg.add_edge(node_id, out_id, key,
                                                  **after_apdg[other_node][out_][key])
-                            after_apdg.remove_edge(other_node, out_, key)
-                    visited.append(other_node)
-            work_to_be_done = len(to_visit) > 0
+                            removed.add(out_edge)
+                    visited.add(other_node)
 
         for node in before_apdg.nodes():
-            if 'color' in before_apdg.node[node].keys():
+            if 'color' in before_apdg.nodes[node].keys():
                 for edge in list(before_apdg.in_edges(nbunch=[node], keys=True)) \
                             + list(before_apdg.out_edges(nbunch=[node], keys=True)):
                     s, t, k = edge
-                    before_apdg[s][t][k]['color'] = before_apdg.node[node]['color']
+                    before_apdg[s][t][k]['color'] = before_apdg.nodes[node]['color']
 
         for node, other_node in label_map_ab.items():
-            for edge in list(after_apdg.in_edges(nbunch=[other_node], keys=True)):
+            for edge in live_in_edges(other_node):
                 source, sink, key = edge
                 assert sink == other_node
                 if source in label_map_ba.keys():
@@ -117,15 +182,15 @@ class Marked_Merger(object):
                     if before_apdg.has_edge(before_node, node):
                         if not (self.eq_utils.attr_eq(before_apdg[before_node][node][key],
                                                       after_apdg[source][sink][key])):
-                            after_apdg[source][sink][key]['color'] = 'green'
-                            before_apdg.add_edge(before_node, node, key, **after_apdg[source][sink][key])
-                            after_apdg.remove_edge(source, sink, key)
+                            before_apdg.add_edge(before_node, node, key, **dict(after_apdg[source][sink][key],
+                                                                                color='green'))
+                            removed.add(edge)
                     else:
-                        after_apdg[source][sink][key]['color'] = 'green'
-                        before_apdg.add_edge(before_node, node, key, **after_apdg[source][sink][key])
-                        after_apdg.remove_edge(source, sink, key)
+                        before_apdg.add_edge(before_node, node, key, **dict(after_apdg[source][sink][key],
+                                                                            color='green'))
+                        removed.add(edge)
 
-            for edge in list(after_apdg.out_edges(nbunch=[other_node], keys=True)):
+            for edge in live_out_edges(other_node):
                 source, sink, key = edge
                 assert source == other_node
                 if sink in label_map_ba.keys():
@@ -133,18 +198,22 @@ class Marked_Merger(object):
                     if before_apdg.has_edge(node, before_node, key):
                         if not (self.eq_utils.attr_eq(before_apdg[node][before_node][key],
                                                       after_apdg[source][sink][key])):
-                            after_apdg[source][sink][key]['color'] = 'green'
-                            before_apdg.add_edge(node, before_node, key, **after_apdg[source][sink][key])
-                            after_apdg.remove_edge(source, sink, key)
+                            before_apdg.add_edge(node, before_node, key, **dict(after_apdg[source][sink][key],
+                                                                                color='green'))
+                            removed.add(edge)
                     else:
-                        after_apdg[source][sink][key]['color'] = 'green'
-                        before_apdg.add_edge(node, before_node, key, **after_apdg[source][sink][key])
-                        after_apdg.remove_edge(source, sink, key)
+                        before_apdg.add_edge(node, before_node, key, **dict(after_apdg[source][sink][key],
+                                                                            color='green'))
+                        removed.add(edge)
 
         for edge in list(after_apdg.edges(keys=True)):
             source, target, key = edge
-            if after_apdg[source][target][key]['style'] != 'solid':
-                after_apdg.remove_edge(source, target, key=key)
+            if edge not in removed and after_apdg[source][target][key]['style'] != 'solid':
+                removed.add(edge)
+
+        def has_live_edge(source, target):
+            return after_apdg.has_edge(source, target) \
+                   and any((source, target, key) not in removed for key in after_apdg[source][target].keys())
 
         for node, other_node in label_map_ab.items():
             for edge in before_apdg.out_edges(nbunch=[node], data=True, keys=True):
@@ -155,7 +224,27 @@ class Marked_Merger(object):
                 if 'color' not in data.keys():
                     if sink in label_map_ab.keys():
                         after_node = label_map_ab[sink]
-                        if not (after_apdg.has_edge(other_node, after_node)):
+                        if not (has_live_edge(other_node, after_node)):
                             before_apdg[source][sink][key]['color'] = 'red'
 
         return before_apdg
+
+
+if __name__ == '__main__':
+    import sys
+    import time
+
+    from deltaPDG.Util.pygraph_util import read_networkx_from_dot
+
+    # Benchmark the anchor search on a pair of PDGs: <before.dot> <after.dot> [node fuzziness]
+    before = read_networkx_from_dot(sys.argv[1], use_cache=False)
+    after = read_networkx_from_dot(sys.argv[2], use_cache=False)
+    merger = Marked_Merger(m_fuzziness=100, n_fuzziness=int(sys.argv[3]) if len(sys.argv) > 3 else 100)
+    t0 = time.perf_counter()
+    reference = merger._find_anchors_linear(before, after)
+    t1 = time.perf_counter()
+    indexed = merger._find_anchors(before, after)
+    t2 = time.perf_counter()
+    assert reference == indexed
+    print('%d anchors: linear %.3fs, indexed %.3fs (%.1fx)' % (len(indexed[0]), t1 - t0, t2 - t1,
+                                                               (t1 - t0) / max(t2 - t1, 1e-9)))
@@ -1,37 +1,46 @@
 from typing import Dict, List, Any
 
+from deltaPDG.Util.span_index import Span_Index
 
-def find_node_in_graph(node: Any, apdg):
+
+def find_node_in_graph(node: Any, apdg, index: Span_Index = None):
+    """
+    :param node: The nameflow node to look up
+    :param apdg: The PDG
+    :param index: The span index of apdg, built on the fly when not given
+    :return: The first PDG node whose span contains the nameflow node's line, None if there is none
+    """
     if not node['Infile']: return None
-    pdg_node = None
-    for node_pdg, data in apdg.nodes(data=True):
-        if '-' not in data['span']:
-            continue
-        start, end = data['span'].split('-')
-        is_in_span = int(start) <= int(node['Location'][1]) <= int(end)
-        if is_in_span:
-            pdg_node = node_pdg
-            break
-    return pdg_node
+    if index is None:
+        index = Span_Index.from_graph(apdg)
+    return index.first_containing(int(node['Location'][1]))
+
+
+def resolve_nameflow_nodes(nameflow_data: Dict[str, List[Any]], apdg, index: Span_Index = None) -> List[Any]:
+    """
+    Resolve every nameflow node to its PDG node, as find_node_in_graph would, looking up each line only once
+    :return: The PDG node of each nameflow node, None where there is none
+    """
+    if index is None:
+        index = Span_Index.from_graph(apdg)
+    lines = [int(node['Location'][1]) if node['Infile'] else None for node in nameflow_data['nodes']]
+    line_to_node = {line: index.first_containing(line) for line in set(lines) if line is not None}
+    return [line_to_node[line] if line is not None else None for line in lines]
 
 
 def add_nameflow_edges(nameflow_data: Dict[str, List[Any]], apdg):
     apdg = apdg.copy()
     if nameflow_data is not None:
-        for i in range(len(nameflow_data['nodes'])):
-            node = nameflow_data['nodes'][i]
-            relations = nameflow_data['relations'][i]
-            pdg_node = find_node_in_graph(node, apdg)
-            if pdg_node:
-                for relation in relations:
-                    if relation == -1:
-                        continue
-                    other_node = nameflow_data['nodes'][relation]
-                    other_pdg_node = find_node_in_graph(other_node, apdg)
-                    if other_pdg_node:
-                        apdg.add_edge(pdg_node, other_pdg_node, key=3, color='darkorchid', style='bold',
-                                      label='%s %s %s %s' %
-                                            (node['symbolKind'], node['kind'], node['type'], node['name'])
-                                      )
+        pdg_nodes = resolve_nameflow_nodes(nameflow_data, apdg)
+        edges = list()
+        for node, relations, pdg_node in zip(nameflow_data['nodes'], nameflow_data['relations'], pdg_nodes):
+            if not pdg_node:
+                continue
+            targets = [pdg_nodes[relation] for relation in relations if relation != -1 and pdg_nodes[relation]]
+            if len(targets) > 0:
+                label = '%s %s %s %s' % (node['symbolKind'], node['kind'], node['type'], node['name'])
+                edges.extend((pdg_node, target, 3, {'color': 'darkorchid', 'style': 'bold', 'label': label})
+                             for target in targets)
+        apdg.add_edges_from(edges)
 
     return apdg
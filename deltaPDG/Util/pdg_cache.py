@@ -0,0 +1,101 @@
+import hashlib
+import json
+import os
+from typing import Any, Optional, Tuple
+
+from deltaPDG.Util.lru_file_store import LRU_File_Store
+
+_chunk_size = 1 << 20
+# Extractor hashes by (location, size, mtime), the binary is only rehashed when it changes
+_extractor_hashes = dict()
+
+
+def blob_sha(location: str) -> str:
+    """
+    :return: The git blob hash of a file's content, as `git hash-object --no-filters` would compute it
+    """
+    with open(location, 'rb') as f:
+        content = f.read()
+    return hashlib.sha1(b'blob %d\0' % len(content) + content).hexdigest()
+
+
+def extractor_hash(location: str) -> str:
+    """
+    :return: The sha1 of the extractor binary at location
+    """
+    stat = os.stat(location)
+    key = (os.path.abspath(location), stat.st_size, stat.st_mtime_ns)
+    if key not in _extractor_hashes:
+        sha = hashlib.sha1()
+        with open(location, 'rb') as f:
+            for chunk in iter(lambda: f.read(_chunk_size), b''):
+                sha.update(chunk)
+        _extractor_hashes[key] = sha.hexdigest()
+    return _extractor_hashes[key]
+
+
+class PDG_Cache(LRU_File_Store):
+    """
+    Content addressed store of extractor output. Entries are keyed by the blob hash of the extracted file, its path in
+    the repository (the output names it, e.g. in cluster labels and nameflow locations) and the hash of the extractor
+    binary and hold the PDG (DOT text, None when the extractor produced none) and the nameflow data, one JSON file
+    per entry. Eviction is that of LRU_File_Store: least recently used first, by file mtime.
+    """
+
+    suffix = '.json'
+    read_errors = (FileNotFoundError, ValueError, KeyError)
+
+    @staticmethod
+    def key(extractor_location: str, repository_location: str, filename: str) -> Optional[str]:
+        """
+        :param filename: The file's path in the repository
+        :return: The key of the extractor's output for the file, None if the file or the extractor cannot be read
+        """
+        filename = filename.replace('\\', '/').lstrip('/')
+        try:
+            content = blob_sha(os.path.join(repository_location, filename))
+            extractor = extractor_hash(extractor_location)
+        except OSError:
+            return None
+        return hashlib.sha1(('%s\0%s\0%s' % (extractor, content, filename)).encode('utf-8', 'surrogateescape')) \
+            .hexdigest()
+
+    def get(self, key: str) -> Optional[Tuple[Optional[str], Any]]:
+        """
+        :return: The stored PDG and nameflow data, None on a miss
+        """
+        return self._load(key, _read_entry)
+
+    def put(self, key: str, pdg: Optional[str], nameflow_data: Any):
+        def write(path: str):
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump({'pdg': pdg, 'nameflows': nameflow_data}, f)
+
+        self._store(key, write)
+
+
+def _read_entry(path: str) -> Tuple[Optional[str], Any]:
+    with open(path, encoding='utf-8') as f:
+        entry = json.load(f)
+    return entry['pdg'], entry['nameflows']
+
+
+def relocate_nameflows(nameflow_data: Any, old: str, new: str) -> Any:
+    """
+    :return: A copy of the raw nameflow data with old replaced by new in the node locations
+    """
+    if not isinstance(nameflow_data, dict) or not isinstance(nameflow_data.get('nodes'), list):
+        return nameflow_data
+    relocated = dict(nameflow_data)
+    relocated['nodes'] = [dict(node, Location=node['Location'].replace(old, new))
+                          if isinstance(node, dict) and isinstance(node.get('Location'), str) else node
+                          for node in nameflow_data['nodes']]
+    return relocated
+
+
+if __name__ == '__main__':
+    import sys
+
+    # Report on a cache directory, e.g. ./data/pdg_cache
+    entries = PDG_Cache(sys.argv[1], max_size=0)._entries()
+    print('%d entries, %.1f MB' % (len(entries), sum(size for _, _, size in entries) / (1 << 20)))
@@ -1,10 +1,177 @@
-from typing import Tuple, Dict
+import io
+import os
+import re
+from typing import Tuple, Dict, Any, Optional
 
 import networkx as nx
 import pydot
 
+from deltaPDG.Util.graph_cache import read_graph_cache, write_graph_cache
 
-def read_graph_from_dot(file_: str) -> Tuple[Dict, Dict[str, str]]:
+# The extractor (and nx_pydot.write_dot) only emit a small subset of DOT: node, edge and attribute statements,
+# optionally grouped under (cluster) subgraphs. We tokenise that subset with a single regex pass.
+_dot_token = re.compile(r'''
+    (?P<skip>\s+|//[^\n]*|/\*.*?\*/|^\#[^\n]*)
+  | (?P<string>"(?:[^"\\]|\\.)*")
+  | (?P<html><(?:[^<>]|<[^<>]*>)*>)
+  | (?P<edge_op>->|--)
+  | (?P<id>[^\W\d]\w*|-?(?:\.\d+|\d+(?:\.\d*)?))
+  | (?P<punct>[{}\[\]=;,])
+''', re.DOTALL | re.MULTILINE | re.VERBOSE)
+
+_dot_keywords = {'strict', 'graph', 'digraph', 'subgraph', 'node', 'edge'}
+
+
+class _Dot_Parser(object):
+    """
+    Recursive descent parser for the restricted DOT dialect we read and write.
+    It produces the same `obj_dict` layout pydot does (nodes, edges and subgraphs keyed by name, each holding a
+    list of declarations with raw, still-quoted attribute values), so it can be used as a drop-in for pydot.
+    Anything outside of the dialect raises a ValueError so that the caller can fall back to pydot.
+    """
+
+    def __init__(self, text: str):
+        self.tokens = list()
+        position = 0
+        for match in _dot_token.finditer(text):
+            if match.start() != position:
+                raise ValueError('Unexpected DOT input at offset %d' % position)
+            position = match.end()
+            kind = match.lastgroup
+            if kind != 'skip':
+                self.tokens.append((kind, match.group(kind)))
+        if position != len(text):
+            raise ValueError('Unexpected DOT input at offset %d' % position)
+        self.index = 0
+
+    def _peek(self) -> Tuple[str, str]:
+        return self.tokens[self.index] if self.index < len(self.tokens) else ('eof', '')
+
+    def _next(self) -> Tuple[str, str]:
+        token = self._peek()
+        self.index += 1
+        return token
+
+    def _expect(self, value: str):
+        _, text = self._next()
+        if text != value:
+            raise ValueError('Expected %s in DOT input, got %s' % (value, text))
+
+    def _is_keyword(self, token: Tuple[str, str], keyword: str) -> bool:
+        return token[0] == 'id' and token[1].lower() == keyword
+
+    def _id(self) -> str:
+        kind, text = self._next()
+        if kind not in ['id', 'string', 'html']:
+            raise ValueError('Expected an ID in DOT input, got %s' % text)
+        return text
+
+    @staticmethod
+    def _new_graph(name: str) -> Dict[str, Any]:
+        return {'name': name, 'attributes': dict(), 'nodes': dict(), 'edges': dict(), 'subgraphs': dict()}
+
+    def parse(self) -> Dict[str, Any]:
+        if self._is_keyword(self._peek(), 'strict'):
+            self._next()
+        kind = self._next()
+        if not (self._is_keyword(kind, 'digraph') or self._is_keyword(kind, 'graph')):
+            raise ValueError('DOT input does not start with a graph declaration')
+        name = self._id() if self._peek()[1] != '{' else ''
+        graph = self._new_graph(name)
+        graph['type'] = kind[1].lower()
+        self._expect('{')
+        self._stmt_list(graph)
+        if self._peek()[0] != 'eof':
+            raise ValueError('Trailing content after DOT graph')
+        return graph
+
+    def _stmt_list(self, graph: Dict[str, Any]):
+        while True:
+            token = self._peek()
+            if token[1] == '}':
+                self._next()
+                return
+            if token[0] == 'eof':
+                raise ValueError('Unterminated DOT graph')
+            self._stmt(graph)
+            if self._peek()[1] == ';':
+                self._next()
+
+    def _attr_list(self) -> Dict[str, str]:
+        attributes = dict()
+        while self._peek()[1] == '[':
+            self._next()
+            while self._peek()[1] != ']':
+                key = self._id()
+                if self._peek()[1] == '=':
+                    self._next()
+                    attributes[key] = self._id()
+                else:
+                    attributes[key] = 'true'
+                if self._peek()[1] in [',', ';']:
+                    self._next()
+            self._next()
+        return attributes
+
+    def _subgraph(self, graph: Dict[str, Any]):
+        name = ''
+        if self._is_keyword(self._peek(), 'subgraph'):
+            self._next()
+            if self._peek()[1] != '{':
+                name = self._id()
+        self._expect('{')
+        subgraph = self._new_graph(name)
+        self._stmt_list(subgraph)
+        graph['subgraphs'].setdefault(name, list()).append(subgraph)
+
+    def _stmt(self, graph: Dict[str, Any]):
+        token = self._peek()
+        if token[1] == '{' or self._is_keyword(token, 'subgraph'):
+            self._subgraph(graph)
+            return
+        if token[0] == 'id' and token[1].lower() in _dot_keywords:
+            # Default attribute statements, pydot records these as nodes named after the keyword
+            self._next()
+            graph['nodes'].setdefault(token[1], list()).append({'attributes': self._attr_list()})
+            return
+
+        name = self._id()
+        if self._peek()[1] == '=':
+            self._next()
+            graph['attributes'][name] = self._id()
+            return
+
+        if self._peek()[0] != 'edge_op':
+            graph['nodes'].setdefault(name, list()).append({'attributes': self._attr_list()})
+            return
+
+        chain = [name]
+        while self._peek()[0] == 'edge_op':
+            self._next()
+            if self._peek()[1] == '{' or self._is_keyword(self._peek(), 'subgraph'):
+                raise ValueError('Subgraph edge end-points are not supported')
+            chain.append(self._id())
+        attributes = self._attr_list()
+        for source, target in zip(chain[:-1], chain[1:]):
+            graph['edges'].setdefault((source, target), list()).append({'attributes': dict(attributes)})
+
+
+def parse_dot(text: str) -> Dict[str, Any]:
+    """
+    Parse DOT source into a pydot-compatible obj_dict
+    :param text: The DOT source
+    :return: The obj_dict of the (first) graph in text
+    :raises ValueError: when the source is outside of the supported DOT dialect
+    """
+    return _Dot_Parser(text).parse()
+
+
+def read_graph_from_dot(file_: str) -> Dict[str, Any]:
+    try:
+        with open(file_) as f:
+            return parse_dot(f.read())
+    except (IndexError, ValueError):
+        pass
     try:
         apdg = pydot.graph_from_dot_file(file_)[0].obj_dict
     except (IndexError, AttributeError, RuntimeError, TypeError, ValueError):
@@ -12,38 +179,279 @@ def read_graph_from_dot(file_: str) -> Tuple[Dict, Dict[str, str]]:
     return apdg
 
 
+def read_graph_from_dot_string(text: str) -> Dict[str, Any]:
+    """
+    As read_graph_from_dot, for DOT source held in memory
+    """
+    # Reading a file in text mode normalises line breaks, do the same so that both give the same graph
+    text = text.replace('\r\n', '\n').replace('\r', '\n')
+    try:
+        return parse_dot(text)
+    except (IndexError, ValueError):
+        pass
+    try:
+        apdg = pydot.graph_from_dot_data(text)[0].obj_dict
+    except (IndexError, AttributeError, RuntimeError, TypeError, ValueError):
+        apdg = ""
+    return apdg
+
+
+def _unquote(attributes: Dict[str, str]) -> Dict[str, str]:
+    return {k: v[1:-1] if v[0] == v[-1] == '"' else v for k, v in attributes.items()}
+
+
 def obj_dict_to_networkx(obj_dict):
     graph = nx.MultiDiGraph()
 
     if isinstance(obj_dict, str):
         return graph
 
-    for node, data in list(obj_dict['nodes'].items()):
-        if node != 'graph' and 'span' in data[0]['attributes'].keys():
-            attr = {k: v[1:-1] if v[0] == v[-1] == '"' else v for k, v in data[0]['attributes'].items()}
-            graph.add_node(node, **attr)
+    graph.add_nodes_from((node, _unquote(data[0]['attributes'])) for node, data in obj_dict['nodes'].items()
+                         if node != 'graph' and 'span' in data[0]['attributes'].keys())
 
-    for edge, data in list(obj_dict['edges'].items()):
-        s, t = edge
-        attr = {k: v[1:-1] if v[0] == v[-1] == '"' else v for k, v in data[0]['attributes'].items()}
-        graph.add_edge(s, t, **attr)
+    for (s, t), data in obj_dict['edges'].items():
+        graph.add_edge(s, t, **_unquote(data[0]['attributes']))
 
-    for subgraph in list(obj_dict['subgraphs'].keys()):
-        for node, data in list(obj_dict['subgraphs'][subgraph][0]['nodes'].items()):
+    for subgraph in obj_dict['subgraphs'].values():
+        subgraph = subgraph[0]
+        if 'label' in subgraph['attributes'].keys():
+            cluster = subgraph['attributes']['label'][1:-1]
+        elif 'graph' in subgraph['nodes'].keys():
+            cluster = subgraph['nodes']['graph'][0]['attributes']['label'][1:-1]
+        else:
+            cluster = None
+        for node, data in subgraph['nodes'].items():
             if node != 'graph' and 'span' in data[0]['attributes'].keys():
-                attr = {k: v[1:-1] if v[0] == v[-1] == '"' else v for k, v in data[0]['attributes'].items()}
-                if 'label' in obj_dict['subgraphs'][subgraph][0]['attributes'].keys():
-                    attr['cluster'] = obj_dict['subgraphs'][subgraph][0]['attributes']['label'][1:-1]
-                elif 'graph' in obj_dict['subgraphs'][subgraph][0]['nodes'].keys():
-                    attr['cluster'] = obj_dict['subgraphs'][subgraph][0]['nodes']['graph'][0]['attributes']['label'][1:-1]
+                attr = _unquote(data[0]['attributes'])
+                if cluster is not None:
+                    attr['cluster'] = cluster
                 graph.add_node(node, **attr)
 
     return graph
 
 
+def read_networkx_from_dot(file_: str, use_cache: bool = True) -> nx.MultiDiGraph:
+    """
+    Read a DOT file as a MultiDiGraph, going through its binary sidecar cache when possible
+    :param file_: The DOT file to read
+    :param use_cache: Whether to load from (and populate) the binary cache next to file_
+    :return: The graph, equivalent to obj_dict_to_networkx(read_graph_from_dot(file_))
+    """
+    if use_cache:
+        graph = read_graph_cache(file_)
+        if graph is not None:
+            return graph
+    graph = obj_dict_to_networkx(read_graph_from_dot(file_))
+    if use_cache and os.path.exists(file_):
+        try:
+            write_graph_cache(graph, file_)
+        except OSError:
+            pass  # Read-only corpora are still readable, just not cached
+        except TypeError:
+            pass  # Edges without a key attribute get int keys, which the cache can not represent
+    return graph
+
+
+# How pydot (and so nx_pydot.write_dot) decides whether an ID or attribute value needs quoting
+_numeric = re.compile(r'^([0-9]+\.?[0-9]*|[0-9]*\.[0-9]+)$')
+_double_quoted = re.compile(r'^".*"$', re.DOTALL)
+_html = re.compile(r'^<.*>$', re.DOTALL)
+_alpha_numeric_id = re.compile(r'^[_a-zA-Z][a-zA-Z0-9_]*$')
+_alpha_numeric_port_id = re.compile(r'^[_a-zA-Z][a-zA-Z0-9_:"]*[a-zA-Z0-9_"]+$')
+_quote_escapes = {ord('"'): r'\"', ord('\n'): r'\n', ord('\r'): r'\r'}
+
+
+def _needs_quotes(s: str) -> Optional[bool]:
+    if s.isdigit():
+        return False
+    if s.isalnum():
+        return s[0].isdigit()
+    if (not s.isascii() or '\0' in s) and not _double_quoted.match(s) and not _html.match(s):
+        return True
+    if _numeric.match(s) or _double_quoted.match(s) or _html.match(s):
+        return False
+    return None
+
+
+def _quote_id(s: str, keywords_unquoted: bool = True) -> str:
+    """
+    :param keywords_unquoted: Leave graph, node and edge unquoted, as pydot does in node statements
+    """
+    if s == '' or keywords_unquoted and s.lower() in ('graph', 'node', 'edge'):
+        return s
+    if s.lower() in _dot_keywords:
+        return '"%s"' % s.translate(_quote_escapes)
+    needs_quotes = _needs_quotes(s)
+    if needs_quotes is None:
+        needs_quotes = _alpha_numeric_id.match(s) is None and _alpha_numeric_port_id.match(s) is None
+    return '"%s"' % s.translate(_quote_escapes) if needs_quotes else s
+
+
+def _quote_attr(s: str) -> str:
+    if s.lower() in _dot_keywords or _needs_quotes(s) is not False:
+        return '"%s"' % s.translate(_quote_escapes)
+    return s
+
+
+def _endpoint(s: str) -> str:
+    if s.startswith('"') and s.endswith('"'):
+        return s
+    # As in node statements, pydot reads whatever follows the last colon as a port, but keeps it in edges
+    port = s.rfind(':')
+    if port > 0 and not (s[0] == '"' and s[port - 1] == '"'):
+        return _quote_id(s[:port], keywords_unquoted=False) + ':' + _quote_id(s[port + 1:], keywords_unquoted=False)
+    return s if port > 0 else _quote_id(s, keywords_unquoted=False)
+
+
+def _attribute_list(attributes: Dict[str, Any]) -> str:
+    if len(attributes) == 0:
+        return ''
+    return ' [%s]' % ', '.join('%s=%s' % (k, _quote_attr(str(v))) for k, v in attributes.items())
+
+
+def _node_name(node: Any) -> str:
+    name = str(node)
+    # pydot takes anything after a colon in a node statement for a port, and leaves it out
+    port = name.find(':')
+    if not name.startswith('"') and 0 < port < len(name) - 1:
+        name = name[:port]
+    return _quote_id(name)
+
+
+def _node_statement(node: Any, data: Dict[str, Any]) -> str:
+    name = _node_name(node)
+    if name in ('graph', 'node', 'edge') and len(data) == 0:
+        # pydot leaves out attribute-less defaults statements, but not the line they would be on
+        return '\n'
+    return '%s%s;\n' % (name, _attribute_list({str(k): v for k, v in data.items()}))
+
+
+@nx.utils.open_file(1, mode='w')
+def write_dot(graph, path, clusters: bool = False):
+    """
+    Write a graph as DOT, streaming statements to the file instead of building a pydot graph first.
+    The output is the same as that of nx.drawing.nx_pydot.write_dot
+    :param graph: The graph
+    :param path: The file (or file name) to write to
+    :param clusters: Group nodes by their 'cluster' attribute into labelled cluster subgraphs, as the extractor
+                     does. Reading such a file back gives the same nodes and edges, but nodes come back in a
+                     different order, so corpora are written without.
+    """
+    name = graph.name
+    header = ['strict'] if nx.number_of_selfloops(graph) == 0 and not graph.is_multigraph() else []
+    header.append('digraph' if graph.is_directed() else 'graph')
+    if name != '':
+        header.append('"%s"' % name)
+    path.write('%s {\n' % ' '.join(header))
+    for k, v in graph.graph.get('graph', dict()).items():
+        path.write('%s=%s;\n' % (k, _quote_attr(str(v))))
+    for defaults in ['node', 'edge']:
+        if defaults in graph.graph.keys():
+            path.write(_node_statement(defaults, graph.graph[defaults]))
+
+    if clusters:
+        grouped = dict()
+        for node, data in graph.nodes(data=True):
+            if 'cluster' in data.keys():
+                grouped.setdefault(str(data['cluster']), list()).append(node)
+            else:
+                path.write(_node_statement(node, data))
+        for i, (cluster, nodes) in enumerate(grouped.items()):
+            path.write('subgraph cluster_%d {\nlabel="%s";\n' % (i, cluster.translate(_quote_escapes)))
+            for node in nodes:
+                path.write(_node_statement(node, {k: v for k, v in graph.nodes[node].items() if k != 'cluster'}))
+            path.write('}\n')
+    else:
+        for node, data in graph.nodes(data=True):
+            path.write(_node_statement(node, data))
+
+    # Every node is the endpoint of many edges, quote it only once
+    endpoints = dict()
+
+    def endpoint(node):
+        if node not in endpoints:
+            endpoints[node] = _endpoint(str(node))
+        return endpoints[node]
+
+    edge_op = '->' if graph.is_directed() else '--'
+    if graph.is_multigraph():
+        for source, target, key, data in graph.edges(keys=True, data=True):
+            attributes = {'key': key}
+            attributes.update((str(k), v) for k, v in data.items() if k != 'key')
+            path.write('%s %s %s%s;\n' % (endpoint(source), edge_op, endpoint(target),
+                                          _attribute_list(attributes)))
+    else:
+        for source, target, data in graph.edges(data=True):
+            path.write('%s %s %s%s;\n' % (endpoint(source), edge_op, endpoint(target),
+                                          _attribute_list({str(k): v for k, v in data.items()})))
+    path.write('}\n')
+
+
+def read_back(graph: nx.MultiDiGraph) -> nx.MultiDiGraph:
+    """
+    :return: The graph as obj_dict_to_networkx(read_graph_from_dot(...)) returns it after writing it with write_dot,
+             by doing exactly that in memory rather than through a file
+    """
+    output = io.StringIO()
+    write_dot(graph, output)
+    return obj_dict_to_networkx(read_graph_from_dot_string(output.getvalue()))
+
+
 def get_context_from_nxgraph(graph):
     contexts = dict()
     for node in graph.nodes():
         if 'cluster' in list(graph.nodes[node].keys()):
             contexts[str(node)] = graph.nodes[node]['cluster']
     return contexts
+
+
+def same_graph(graph, other) -> bool:
+    """
+    :return: Whether both graphs have the same nodes and edges with the same attributes, in any order
+    """
+    return dict(graph.nodes(data=True)) == dict(other.nodes(data=True)) \
+        and sorted(graph.edges(keys=True, data=True), key=str) == sorted(other.edges(keys=True, data=True), key=str)
+
+
+if __name__ == '__main__':
+    import sys
+    import time
+
+    from Util.general_util import get_pattern_paths
+
+    # Benchmark the DOT reader and writer against pydot on a corpus, e.g. ./data/corpora_clean/<repository>
+    all_graphs = get_pattern_paths('*.dot', sys.argv[1])
+    fast_time, pydot_time, mismatches = 0.0, 0.0, list()
+    fast_write_time, pydot_write_time, write_mismatches = 0.0, 0.0, list()
+    for graph_location in all_graphs:
+        t0 = time.perf_counter()
+        fast = obj_dict_to_networkx(read_graph_from_dot(graph_location))
+        t1 = time.perf_counter()
+        try:
+            reference = obj_dict_to_networkx(pydot.graph_from_dot_file(graph_location)[0].obj_dict)
+        except (IndexError, AttributeError, RuntimeError, TypeError, ValueError):
+            reference = obj_dict_to_networkx("")
+        t2 = time.perf_counter()
+        fast_time += t1 - t0
+        pydot_time += t2 - t1
+        if not same_graph(fast, reference):
+            mismatches.append(graph_location)
+
+        fast_output, pydot_output = io.StringIO(), io.StringIO()
+        t0 = time.perf_counter()
+        write_dot(fast, fast_output)
+        t1 = time.perf_counter()
+        nx.drawing.nx_pydot.write_dot(fast, pydot_output)
+        t2 = time.perf_counter()
+        fast_write_time += t1 - t0
+        pydot_write_time += t2 - t1
+        if fast_output.getvalue() != pydot_output.getvalue():
+            write_mismatches.append(graph_location)
+    print('Read %d graphs: fast %.3fs, pydot %.3fs (%.1fx)' % (len(all_graphs), fast_time, pydot_time,
+                                                               pydot_time / max(fast_time, 1e-9)))
+    print('Wrote %d graphs: fast %.3fs, pydot %.3fs (%.1fx)' % (len(all_graphs), fast_write_time, pydot_write_time,
+                                                                pydot_write_time / max(fast_write_time, 1e-9)))
+    for mismatch in mismatches:
+        print('Mismatch: %s' % mismatch)
+    for mismatch in write_mismatches:
+        print('Write mismatch: %s' % mismatch)
@@ -1,6 +1,6 @@
 import networkx as nx
 
-from deltaPDG.Util.pygraph_util import get_context_from_nxgraph
+from deltaPDG.Util.pygraph_util import get_context_from_nxgraph, write_dot
 
 
 def slice_delta(graph):
@@ -45,4 +45,4 @@ if __name__ == '__main__':
 
     graph = obj_dict_to_networkx(read_graph_from_dot('./out/gui.cs/gui.cs.dot'))
     slice = slice_delta(graph)
-    nx.drawing.nx_pydot.write_dot(slice, './out/gui.cs/sliced_gui.cs.dot')
+    write_dot(slice, './out/gui.cs/sliced_gui.cs.dot')
@@ -0,0 +1,115 @@
+from typing import Any, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+# Intervals spanning more lines than this are checked linearly, all others are found through their start line
+_short_span = 64
+
+
+def parse_span(span: str) -> Optional[Tuple[int, int]]:
+    """
+    :return: The (start, end) line numbers of a 'start-end' span, None if it cannot be parsed
+    """
+    parts = span.split('-')
+    if len(parts) != 2:
+        return None
+    try:
+        return int(parts[0]), int(parts[1])
+    except ValueError:
+        return None
+
+
+class Span_Index(object):
+    """
+    Static index over closed integer intervals, e.g. the spans of PDG nodes, answering point and range stabbing
+    queries. Results are always returned in the order the intervals were given in.
+    """
+
+    def __init__(self, intervals: Iterable[Tuple[Any, int, int]]):
+        self.items = list()
+        starts = list()
+        ends = list()
+        for item, start, end in intervals:
+            self.items.append(item)
+            starts.append(start)
+            ends.append(end)
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.ends = np.asarray(ends, dtype=np.int64)
+
+        short = self.ends - self.starts <= _short_span
+        self.long = np.flatnonzero(~short)
+        self.short = np.flatnonzero(short)
+        self.short = self.short[np.argsort(self.starts[self.short], kind='stable')]
+        self.short_starts = self.starts[self.short]
+        self.by_start = np.argsort(self.starts, kind='stable')
+        self.sorted_starts = self.starts[self.by_start]
+        self.by_end = np.argsort(self.ends, kind='stable')
+        self.sorted_ends = self.ends[self.by_end]
+
+    @classmethod
+    def from_graph(cls, graph, nodes: Iterable[Any] = None, missing: Tuple[int, int] = None) -> 'Span_Index':
+        """
+        Index the 'span' attribute of graph nodes
+        :param graph: The PDG
+        :param nodes: The nodes to index, all nodes in graph order by default
+        :param missing: The interval to use for nodes without a parsable span, such nodes are left out by default
+        """
+        intervals = list()
+        for node in graph.nodes if nodes is None else nodes:
+            data = graph.nodes[node]
+            span = parse_span(data['span']) if 'span' in data.keys() else None
+            if span is None:
+                if missing is None:
+                    continue
+                span = missing
+            intervals.append((node, span[0], span[1]))
+        return cls(intervals)
+
+    def __len__(self):
+        return len(self.items)
+
+    def _items(self, indices: np.ndarray) -> List[Any]:
+        return [self.items[i] for i in np.sort(indices)]
+
+    def overlapping(self, lo: int, hi: int) -> List[Any]:
+        """
+        :return: The items whose interval shares at least one line with [lo, hi]
+        """
+        a = np.searchsorted(self.short_starts, lo - _short_span, side='left')
+        b = np.searchsorted(self.short_starts, hi, side='right')
+        candidates = np.concatenate([self.short[a:b], self.long])
+        starts = self.starts[candidates]
+        ends = self.ends[candidates]
+        return self._items(candidates[(starts <= hi) & (ends >= lo) & (starts <= ends)])
+
+    def stab(self, line: int) -> List[Any]:
+        """
+        :return: The items whose interval contains line
+        """
+        return self.overlapping(line, line)
+
+    def first_containing(self, line: int) -> Optional[Any]:
+        found = self.stab(line)
+        return found[0] if len(found) > 0 else None
+
+    def starting_or_ending_in(self, lo: int, hi: int) -> List[Any]:
+        """
+        :return: The items whose interval starts or ends within [lo, hi]
+        """
+        a = np.searchsorted(self.sorted_starts, lo, side='left')
+        b = np.searchsorted(self.sorted_starts, hi, side='right')
+        c = np.searchsorted(self.sorted_ends, lo, side='left')
+        d = np.searchsorted(self.sorted_ends, hi, side='right')
+        return self._items(np.union1d(self.by_start[a:b], self.by_end[c:d]))
+
+    def containing_any(self, lines: Iterable[int]) -> List[Any]:
+        """
+        :return: The items whose interval contains at least one of lines
+        """
+        lines = np.unique(np.asarray(list(lines), dtype=np.int64))
+        if len(lines) == 0:
+            return list()
+        first = np.searchsorted(lines, self.starts, side='left')
+        hit = first < len(lines)
+        hit[hit] = lines[first[hit]] <= self.ends[hit]
+        return self._items(np.flatnonzero(hit))
@@ -3,7 +3,7 @@ from collections import deque
 import networkx as nx
 import numpy as np
 
-from deltaPDG.Util.pygraph_util import get_context_from_nxgraph
+from deltaPDG.Util.pygraph_util import get_context_from_nxgraph, write_dot
 
 
 def compress_delta(graph, node_context_size=1, line_context_size=3):
@@ -203,4 +203,4 @@ if __name__ == '__main__':
 
     graph = obj_dict_to_networkx(read_graph_from_dot('./out/gui.cs/Core.cs.dot'))
     compressed = compress_delta(graph)
-    nx.drawing.nx_pydot.write_dot(compressed, './out/gui.cs/compressed_Core.cs.dot')
+    write_dot(compressed, './out/gui.cs/compressed_Core.cs.dot')
@@ -1,17 +1,26 @@
-from typing import List, Tuple
+from typing import List, Tuple, Union
+
+import networkx as nx
 
 from .Util.mark_pdgs import mark_pdg_nodes
 from .Util.merge_marked_pdgs import Marked_Merger
 from .Util.pygraph_util import read_graph_from_dot, obj_dict_to_networkx
 
 
+def _as_graph(pdg: Union[str, nx.MultiDiGraph]) -> nx.MultiDiGraph:
+    return obj_dict_to_networkx(read_graph_from_dot(pdg)) if isinstance(pdg, str) else pdg
+
+
 class deltaPDG(object):
-    def __init__(self, base_pdg_location: str, m_fuzziness: int, n_fuzziness: int):
-        self.before_pdg = obj_dict_to_networkx(read_graph_from_dot(base_pdg_location))
+    def __init__(self, base_pdg_location: Union[str, nx.MultiDiGraph], m_fuzziness: int, n_fuzziness: int):
+        """
+        :param base_pdg_location: The before PDG, either a DOT file or the graph itself
+        """
+        self.before_pdg = _as_graph(base_pdg_location)
         self.merger = Marked_Merger(m_fuzziness=m_fuzziness, n_fuzziness=n_fuzziness)
 
-    def __call__(self, target_pdg_location: str, diff: List[Tuple[str, str, int, int, str]]):
-        after_pdg = obj_dict_to_networkx(read_graph_from_dot(target_pdg_location))
+    def __call__(self, target_pdg_location: Union[str, nx.MultiDiGraph], diff: List[Tuple[str, str, int, int, str]]):
+        after_pdg = _as_graph(target_pdg_location)
         marked_before = mark_pdg_nodes(self.before_pdg, '-', diff)
         marked_after = mark_pdg_nodes(after_pdg, '+', diff)
         self.deltaPDG = self.merger(before_apdg=marked_before, after_apdg=marked_after)
@@ -3,39 +3,29 @@ import time
 from threading import Thread
 from typing import List
 
-import networkx as nx
 import numpy as np
 from tqdm import tqdm
 
 from Util.evaluation import evaluate
-from deltaPDG.Util.pygraph_util import read_graph_from_dot, obj_dict_to_networkx
+from deltaPDG.Util.delta_graph import DeltaGraph, DATA
+from deltaPDG.Util.pygraph_util import read_networkx_from_dot, write_dot
+
+
+_assignment_operators = {'=', '+=', '-=', '*=', '/=', '%=', '<<=', '>>=', '&=', '^=', '|='}
 
 
 def extract_DU_chains_from_delta(graph):
     # Remove non-data-flow edges from graph
     # That is we keep only edges with key=1 for out graph format
-    graph = graph.copy()
-    for edge in list(graph.edges(keys=True)):
-        source, target, key = edge
-        if key != '1':
-            try:
-                graph.remove_edge(source, target, key=key)
-            except KeyError:
-                pass
+    delta = DeltaGraph.from_networkx(graph)
 
     # Find Assignments, at each assign, delete all incoming edges.
-    for node, data in list(graph.nodes(data=True)):
-        if 'label' in data.keys():
-            label = data['label']
-            label = label.split()
-            if any([op in label for op in ['=', '+=', '-=', '*=', '/=', '%=', '<<=', '>>=', '&=', '^=', '|=']]):
-                for in_edge in list(graph.in_edges(nbunch=[node])):
-                    try:
-                        graph.remove_edge(*in_edge)
-                    except KeyError:
-                        pass
+    # Labels are interned, so each distinct label is only split once
+    assigns = np.asarray([len(_assignment_operators.intersection(label.split())) > 0
+                          for label in delta.tables['label']] + [False], dtype=bool)
+    not_assigned = ~assigns[delta.node_codes['label']]
 
-    return graph
+    return delta.edge_subgraph([DATA], targets=not_assigned).to_networkx()
 
 
 def defUsesInDiffs(diff_node1, diff_node2, graph):
@@ -76,7 +66,7 @@ def closure_of_DU_on_diff(graph):
     return graph
 
 
-def validate(files: List[str], times, repository_name):
+def validate(files: List[str], times, repository_name, pack=None):
     n_workers = 4
     chunk_size = int(len(files) / n_workers)
     while chunk_size == 0:
@@ -88,7 +78,7 @@ def validate(files: List[str], times, repository_name):
         for graph_location in tqdm(work, leave=False):
             chain = os.path.basename(os.path.dirname(os.path.dirname(graph_location)))
             q = int(os.path.basename(os.path.dirname(graph_location)))
-            graph = obj_dict_to_networkx(read_graph_from_dot(graph_location))
+            graph = read_networkx_from_dot(graph_location) if pack is None else pack.load(graph_location)
 
             t0 = time.process_time()
             for i in range(times):
@@ -110,7 +100,7 @@ def validate(files: List[str], times, repository_name):
                         label.append(int(closure.nodes[node]['prediction']))
                     except KeyError:
                         label.append(-1)
-            nx.drawing.nx_pydot.write_dot(closure, graph_location[:-4] + '_closure.dot')
+            write_dot(closure, graph_location[:-4] + '_closure.dot')
             truth = np.asarray(truth)
             label = np.asarray(label)
             acc, overlap = evaluate(truth[label > -1], label[label > -1],
@@ -1,19 +1,39 @@
 import json
 import os
 import sys
-from threading import Thread
+import time
+import traceback
+from multiprocessing import Process
+from multiprocessing.connection import wait
 
 import jsonpickle
-import networkx as nx
 
-from deltaPDG.Util.generate_pdg import PDG_Generator
+from deltaPDG.Util.equivalence_util import configure_similarity_cache, configure_similarity_workers, \
+    similarity_cache_info
+from deltaPDG.Util.generate_pdg import PDG_Generator, PDG_Executor
 from deltaPDG.Util.git_util import Git_Util
+from deltaPDG.Util.pdg_cache import PDG_Cache
+from deltaPDG.Util.pygraph_util import write_dot
+from deltaPDG.Util.span_index import Span_Index
 from deltaPDG.deltaPDG import deltaPDG
+from tangle_concerns.job_queue import Job_Queue
 from tangle_concerns.tangle_by_file import tangle_by_file
 
+# Extractor output shared by all workers, keyed by file content; a size of 0 disables it
+PDG_CACHE_LOCATION = './data/pdg_cache'
+DEFAULT_PDG_CACHE_SIZE = 2 << 30
+# Extractors each worker runs at once
+DEFAULT_EXTRACTOR_PROCESSES = 2
+
 
 def mark_originating_commit(dpdg, marked_diff, filename):
     dpdg = dpdg.copy()
+    # Index the changed lines of this file by their after and before line numbers
+    diff_indices = dict()
+    for change_type in ['+', '-']:
+        masked_diff = [p for p in marked_diff if p[0] == change_type and p[1] == filename]
+        diff_indices[change_type] = (Span_Index((p, p[2], p[2]) for p in masked_diff),
+                                     Span_Index((p, p[3], p[3]) for p in masked_diff))
 
     for node, data in dpdg.nodes(data=True):
         if 'color' in data.keys() and data['color'] != 'orange':
@@ -23,7 +43,8 @@ def mark_originating_commit(dpdg, marked_diff, filename):
                 continue
 
             change_type = '+' if data['color'] == 'green' else '-'
-            masked_diff = [p for p in marked_diff if p[0] == change_type and p[1] == filename]
+            after_index, before_index = diff_indices[change_type]
+            masked_diff = after_index.overlapping(start, end) + before_index.overlapping(start, end)
 
             label = data['label'].replace('\'\'', '"')
             if 'Entry' in label:
@@ -37,10 +58,7 @@ def mark_originating_commit(dpdg, marked_diff, filename):
             elif '\\n' in label:
                 label = label.split('\\n')[0]
 
-            community = max([cm
-                             for _, _, after_coord, before_coord, line, cm in masked_diff
-                             if label in line and (start <= after_coord <= end or start <= before_coord <= end)],
-                            default=0)
+            community = max([cm for _, _, _, _, line, cm in masked_diff if label in line], default=0)
 
             dpdg.node[node]['community'] = community
 
@@ -60,78 +78,173 @@ def mark_origin(tangled_diff, atomic_diffs):
     return output
 
 
-def worker(work, subject_location, id_, temp_loc, extractor_location):
+def chain_step_changes(gh, chain, step, path):
+    """
+    :return: The changes of the tangled commit chain[0]^..chain[step] and the changes of each commit in it
+    """
+    from_ = chain[0]
+    changes = gh.process_diff_between_commits(from_ + '^', chain[step], path)
+    labeli_changes = dict()
+    labeli_changes[0] = gh.process_diff_between_commits(from_ + '^', from_, path)
+    for i in range(1, step + 1):
+        labeli_changes[i] = gh.process_diff_between_commits(chain[i - 1], chain[i], path)
+    return changes, labeli_changes
+
+
+def files_touched(changes):
+    return sorted({filename for _, filename, _, _, _ in changes if os.path.basename(filename).split('.')[-1] == 'cs'})
+
+
+def check_out_step(gh, chain, step, v1, v2, checked_out_step=None):
+    """
+    Bring v1 to chain[0]^ and v2 to chain[0] with chain[1..step] cherry-picked on top
+    :param checked_out_step: The step of the same chain v1 and v2 are currently at, if any, so that only the missing
+                             commits are cherry-picked
+    """
+    if checked_out_step is None or checked_out_step > step:
+        gh.set_git_to_rev(chain[0] + '^', v1)
+        gh.set_git_to_rev(chain[0], v2)
+        checked_out_step = 0
+    for to_ in chain[checked_out_step + 1:step + 1]:
+        gh.cherry_pick_on_top(to_, v2)
+
+
+def worker(queue_location, subject_location, id_, temp_loc, extractor_location, similarity_cache_size=None,
+           pdg_cache_size=DEFAULT_PDG_CACHE_SIZE, extractor_processes=DEFAULT_EXTRACTOR_PROCESSES):
+    """
+    Claim and process tasks from the job queue until it runs dry, in a process of its own
+    """
     repository_name = os.path.basename(subject_location)
     method_fuzziness = 100
     node_fuzziness = 100
+    if similarity_cache_size is not None:
+        configure_similarity_cache(similarity_cache_size)
+    # There already is a worker process per core, so batched comparisons stay on this one
+    configure_similarity_workers(1)
 
-    git_handler = Git_Util(temp_dir=temp_loc)
-    with git_handler as gh:
+    queue = Job_Queue(queue_location)
+    pdg_cache = PDG_Cache(PDG_CACHE_LOCATION, pdg_cache_size)
+    # Each file takes two extractions, before and after
+    files_per_batch = max(1, extractor_processes // 2)
+    git_handler = Git_Util(temp_dir=temp_loc, mode='worktree')
+    with git_handler as gh, PDG_Executor(extractor_processes, temp_loc) as executor:
         v1 = gh.move_git_repo_to_tmp(subject_location)
         v2 = gh.move_git_repo_to_tmp(subject_location)
         os.makedirs('./temp/%d' % id_, exist_ok=True)
         v1_pdg_generator = PDG_Generator(extractor_location=extractor_location,
                                          repository_location=v1,
                                          target_filename='before_pdg.dot',
-                                         target_location='./temp/%d' % id_)
+                                         target_location='./temp/%d' % id_,
+                                         cache=pdg_cache)
         v2_pdg_generator = PDG_Generator(extractor_location=extractor_location,
                                          repository_location=v2,
                                          target_filename='after_pdg.dot',
-                                         target_location='./temp/%d' % id_)
-        for chain in work:
-            print('Working on chain: %s' % str(chain))
-            from_ = chain[0]
-            gh.set_git_to_rev(from_ + '^', v1)
-            gh.set_git_to_rev(from_, v2)
-
-            labeli_changes = dict()
-            labeli_changes[0] = gh.process_diff_between_commits(from_ + '^', from_, v2)
-            previous_sha = from_
-            i = 1
-            for to_ in chain[1:]:
-                gh.cherry_pick_on_top(to_, v2)
-
-                changes = gh.process_diff_between_commits(from_ + '^', to_, v2)
-
-                labeli_changes[i] = gh.process_diff_between_commits(previous_sha, to_, v2)
-                i += 1
-                previous_sha = to_
-                files_touched = {filename for _, filename, _, _, _ in changes if
-                                 os.path.basename(filename).split('.')[-1] == 'cs'}
-
-                for filename in files_touched:
-                    try:
-                        output_path = './data/corpora_raw/%s/%s_%s/%d/%s.dot' % (
-                            repository_name, from_, to_, i, os.path.basename(filename))
+                                         target_location='./temp/%d' % id_,
+                                         cache=pdg_cache)
+        checked_out = None  # The (chain id, step) v1 and v2 are at
+        step_changes = dict()  # Changes and their originating commits of the last chain step worked on
+        while True:
+            work = queue.claim(id_, *checked_out) if checked_out is not None else queue.claim(id_)
+            if work is None:
+                break
+            kind, args = work
+
+            if kind == 'wait':
+                time.sleep(1)
+                continue
+            if kind == 'expand':
+                chain_id, chain = args
+                print('Expanding chain: %s' % str(chain))
+                try:
+                    tasks = [(step, filename) for step in range(1, len(chain))
+                             for filename in files_touched(gh.process_diff_between_commits(chain[0] + '^', chain[step],
+                                                                                           v2))]
+                    queue.expanded(chain_id, tasks)
+                except Exception:
+                    queue.expanded(chain_id, [], traceback.format_exc())
+                continue
+
+            _, chain_id, chain, step, _ = args
+            # Files of the same step share the checkout, so their PDGs can be extracted side by side
+            pending = list()
+            for task_id, _, _, _, filename in [args] + queue.claim_more(id_, chain_id, step, files_per_batch - 1):
+                output_path = './data/corpora_raw/%s/%s_%s/%d/%s.dot' % (
+                    repository_name, chain[0], chain[step], step + 1, os.path.basename(filename))
+                if os.path.exists(output_path):
+                    print('Skipping %s as it exits' % output_path)
+                    queue.finish(task_id)
+                else:
+                    pending.append((task_id, filename, output_path))
+            if len(pending) == 0:
+                continue
+
+            print('Working on chain: %s, step %d, %s' % (str(chain), step, ', '.join(f for _, f, _ in pending)))
+            try:
+                if (chain_id, step) not in step_changes.keys():
+                    changes, labeli_changes = chain_step_changes(gh, chain, step, v2)
+                    step_changes = {(chain_id, step): (changes, mark_origin(changes, labeli_changes))}
+                changes, marked_changes = step_changes[(chain_id, step)]
+
+                previous_step = checked_out[1] if checked_out is not None and checked_out[0] == chain_id else None
+                checked_out = None
+                check_out_step(gh, chain, step, v1, v2, previous_step)
+                checked_out = (chain_id, step)
+
+                # The PDGs stay in memory, they are only written out for tasks that fail
+                pdgs = executor.run([(generator, filename, '%d_%s' % (i, generator.target_filename))
+                                     for i, (_, filename, _) in enumerate(pending)
+                                     for generator in [v1_pdg_generator, v2_pdg_generator]], lazy=True)
+            except Exception:
+                error = traceback.format_exc()
+                for task_id, _, _ in pending:
+                    queue.finish(task_id, error)
+                continue
+
+            for (task_id, filename, output_path), before_pdg, after_pdg in zip(pending, pdgs[0::2], pdgs[1::2]):
+                try:
+                    delta_gen = deltaPDG(before_pdg.graph(), m_fuzziness=method_fuzziness,
+                                         n_fuzziness=node_fuzziness)
+                    delta_pdg = delta_gen(after_pdg.graph(), [ch for ch in changes if ch[1] == filename])
+                    delta_pdg = mark_originating_commit(delta_pdg, marked_changes, filename)
+                    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+                    # Write next to the target first, a partially written graph must never look like a finished one
+                    temp_path = '%s.%d.tmp' % (output_path, id_)
+                    write_dot(delta_pdg, temp_path)
+                    os.replace(temp_path, output_path)
+                    queue.finish(task_id)
+                except Exception:
+                    queue.finish(task_id, traceback.format_exc())
+                    # Keep the PDGs of the failed task for inspection, a failure to do so must not end the worker
+                    for pdg in [before_pdg, after_pdg]:
                         try:
-                            with open(output_path) as f:
-                                print('Skipping %s as it exits' % output_path)
-                                f.read()
-                        except FileNotFoundError:
-                            v1_pdg_generator(filename)
-                            v2_pdg_generator(filename)
-                            delta_gen = deltaPDG('./temp/%d/before_pdg.dot' % id_, m_fuzziness=method_fuzziness,
-                                                 n_fuzziness=node_fuzziness)
-                            delta_pdg = delta_gen('./temp/%d/after_pdg.dot' % id_,
-                                                  [ch for ch in changes if ch[1] == filename])
-                            delta_pdg = mark_originating_commit(delta_pdg, mark_origin(changes, labeli_changes), filename)
-                            os.makedirs(os.path.dirname(output_path), exist_ok=True)
-                            nx.drawing.nx_pydot.write_dot(delta_pdg, output_path)
-                    except Exception:
-                        pass
+                            pdg.write()
+                        except Exception:
+                            traceback.print_exc()
+
+    queue.close()
+    cache_info = similarity_cache_info()
+    print('Worker %d fuzzy matching cache: %d hits, %d misses (%d/%s entries)'
+          % (id_, cache_info.hits, cache_info.misses, cache_info.currsize, cache_info.maxsize))
+    cache_info = pdg_cache.cache_info()
+    print('Worker %d PDG cache: %d hits, %d misses (%.1f%% hit rate), %d evictions'
+          % (id_, cache_info.hits, cache_info.misses, 100 * pdg_cache.hit_rate(), cache_info.evictions))
 
 
 if __name__ == '__main__':
-    if len(sys.argv) != 7:
+    if len(sys.argv) not in [7, 8, 9, 10]:
         print('To use this script please run as `[python] generate_corpus.py '
               '<json file location> <git location> <temp location> '
-              '<thread id start> <number of threads> <extractor location>')
+              '<worker id start> <number of processes> <extractor location> [<similarity cache size>] '
+              '[<PDG cache size in MB>] [<extractor processes per worker>]')
         exit(1)
     json_location = sys.argv[1]
     subject_location = sys.argv[2]
     n_workers = int(sys.argv[5])
     temp_loc = sys.argv[3]
     extractor_location = sys.argv[6]
+    similarity_cache_size = int(sys.argv[7]) if len(sys.argv) >= 8 and sys.argv[7] != '-' else None
+    pdg_cache_size = int(sys.argv[8]) << 20 if len(sys.argv) >= 9 and sys.argv[8] != '-' else DEFAULT_PDG_CACHE_SIZE
+    extractor_processes = int(sys.argv[9]) if len(sys.argv) == 10 else DEFAULT_EXTRACTOR_PROCESSES
 
     try:
         with open(json_location) as f:
@@ -141,16 +254,32 @@ if __name__ == '__main__':
         with open(json_location, 'w') as f:
             f.write(json.dumps(list_to_tangle))
 
-    chunk_size = int(len(list_to_tangle) / n_workers)
-    list_to_tangle = [list_to_tangle[i:i + chunk_size] for i in range(0, len(list_to_tangle), chunk_size)]
+    # The queue lives next to the corpus it produces, rerunning the script resumes from it
+    queue_location = './data/corpora_raw/%s/jobs.sqlite' % os.path.basename(subject_location)
+    os.makedirs(os.path.dirname(queue_location), exist_ok=True)
+    job_queue = Job_Queue(queue_location)
+    job_queue.add_chains(list_to_tangle)
+    job_queue.resume()
 
-    threads = []
+    processes = []
     id_ = int(sys.argv[4])
-    for work in list_to_tangle:
-        t = Thread(target=worker, args=(work, subject_location, id_, temp_loc, extractor_location))
+    for _ in range(n_workers):
+        p = Process(target=worker, args=(queue_location, subject_location, id_, temp_loc, extractor_location,
+                                         similarity_cache_size, pdg_cache_size, extractor_processes))
+        processes.append((p, id_))
         id_ += 1
-        threads.append(t)
-        t.start()
+        p.start()
+
+    # A worker that dies (e.g. killed for running out of memory) leaves its work claimed, hand it to the others
+    running = {p.sentinel: (p, worker_id) for p, worker_id in processes}
+    while len(running) > 0:
+        for sentinel in wait(list(running.keys())):
+            p, worker_id = running.pop(sentinel)
+            p.join()
+            if p.exitcode != 0:
+                print('Worker %d exited with code %s, releasing its work' % (worker_id, p.exitcode))
+                job_queue.release(worker_id, 'Worker %d exited with code %s' % (worker_id, p.exitcode))
 
-    for t in threads:
-        t.join()
+    for status, count in sorted(job_queue.summary().items()):
+        print('%s: %d' % (status, count))
+    job_queue.close()
@@ -0,0 +1,235 @@
+import json
+import sqlite3
+import time
+from typing import Dict, List, Any, Iterable, Optional, Tuple
+
+# Chain expansion states
+_UNEXPANDED, _EXPANDING, _EXPANDED = 0, 1, 2
+# Failed tasks are retried on later runs until they have been attempted this often
+MAX_ATTEMPTS = 2
+
+_schema = '''
+CREATE TABLE IF NOT EXISTS chains (
+    chain_id INTEGER PRIMARY KEY,
+    chain TEXT UNIQUE NOT NULL,
+    expanded INTEGER NOT NULL DEFAULT 0,
+    worker INTEGER,
+    error TEXT
+);
+CREATE TABLE IF NOT EXISTS tasks (
+    task_id INTEGER PRIMARY KEY,
+    chain_id INTEGER NOT NULL REFERENCES chains(chain_id),
+    step INTEGER NOT NULL,
+    filename TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker INTEGER,
+    error TEXT,
+    started REAL,
+    finished REAL,
+    UNIQUE (chain_id, step, filename)
+);
+CREATE INDEX IF NOT EXISTS tasks_by_status ON tasks (status, chain_id, step);
+'''
+
+
+class Job_Queue(object):
+    """
+    Durable queue of corpus generation tasks, one per (chain, step, file), shared by worker processes through SQLite.
+    Chains are added up front and expanded into their tasks lazily by whichever worker claims them. Every task keeps
+    its status (pending, running, done or failed), the worker that ran it and, on failure, the error.
+    Reopening the queue after an interruption puts the tasks that were running back up for grabs, as release does for
+    the work of a single worker that died.
+    """
+
+    def __init__(self, location: str):
+        self.location = location
+        self.connection = sqlite3.connect(location, timeout=600, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.executescript(_schema)
+        # Queues created before chains recorded the worker expanding them
+        if 'worker' not in [column[1] for column in self.connection.execute('PRAGMA table_info(chains)')]:
+            self.connection.execute('ALTER TABLE chains ADD COLUMN worker INTEGER')
+
+    def close(self):
+        self.connection.close()
+
+    def _transaction(self):
+        # BEGIN IMMEDIATE takes the write lock up front so that concurrent claims cannot interleave
+        self.connection.execute('BEGIN IMMEDIATE')
+        return self.connection
+
+    def add_chains(self, chains: Iterable[List[str]]):
+        connection = self._transaction()
+        try:
+            connection.executemany('INSERT OR IGNORE INTO chains (chain) VALUES (?)',
+                                   [(json.dumps(list(chain)),) for chain in chains])
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+
+    def resume(self):
+        """
+        Make the work of an interrupted run available again: running tasks and half-expanded chains become pending,
+        failed tasks that have attempts left are retried
+        """
+        connection = self._transaction()
+        try:
+            connection.execute("UPDATE tasks SET status = 'pending', worker = NULL WHERE status = 'running'")
+            connection.execute("UPDATE tasks SET status = 'pending', worker = NULL "
+                               "WHERE status = 'failed' AND attempts < ?", (MAX_ATTEMPTS,))
+            connection.execute('UPDATE chains SET expanded = ?, worker = NULL WHERE expanded = ?',
+                               (_UNEXPANDED, _EXPANDING))
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+
+    def release(self, worker: int, error: str):
+        """
+        Make the work of a worker that died available again: the chains it was expanding become unexpanded, its
+        running tasks pending. Tasks it was running on their last attempt fail with error instead, so that a task
+        that kills its worker (e.g. by running out of memory) is not retried over and over.
+        """
+        connection = self._transaction()
+        try:
+            connection.execute("UPDATE tasks SET status = 'failed', error = ?, finished = ? "
+                               "WHERE status = 'running' AND worker = ? AND attempts >= ?",
+                               (error, time.time(), worker, MAX_ATTEMPTS))
+            connection.execute("UPDATE tasks SET status = 'pending', worker = NULL "
+                               "WHERE status = 'running' AND worker = ?", (worker,))
+            connection.execute('UPDATE chains SET expanded = ?, worker = NULL WHERE expanded = ? AND worker = ?',
+                               (_UNEXPANDED, _EXPANDING, worker))
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+
+    def claim(self, worker: int, chain_id: Optional[int] = None, step: int = 0) \
+            -> Optional[Tuple[str, Any]]:
+        """
+        Claim the next piece of work. Pending tasks of chain_id from step onwards come first so that a worker can
+        keep building on the checkout it has, then unexpanded chains and finally any pending task.
+        :return: ('task', (task_id, chain_id, chain, step, filename)), ('expand', (chain_id, chain)), ('wait', None)
+                 while other workers are still expanding chains or running tasks, which release may put back up for
+                 grabs, or None when there is no work left
+        """
+        connection = self._transaction()
+        try:
+            row = None
+            if chain_id is not None:
+                row = connection.execute("SELECT task_id FROM tasks WHERE status = 'pending' AND chain_id = ? "
+                                         "AND step >= ? ORDER BY step, task_id LIMIT 1", (chain_id, step)).fetchone()
+            if row is None:
+                expand = connection.execute('SELECT chain_id, chain FROM chains WHERE expanded = ? '
+                                            'ORDER BY chain_id LIMIT 1', (_UNEXPANDED,)).fetchone()
+                if expand is not None:
+                    connection.execute('UPDATE chains SET expanded = ?, worker = ? WHERE chain_id = ?',
+                                       (_EXPANDING, worker, expand[0]))
+                    connection.execute('COMMIT')
+                    return 'expand', (expand[0], json.loads(expand[1]))
+                row = connection.execute("SELECT task_id FROM tasks WHERE status = 'pending' "
+                                         "ORDER BY chain_id, step, task_id LIMIT 1").fetchone()
+            if row is None:
+                expanding = connection.execute('SELECT COUNT(*) FROM chains WHERE expanded = ?',
+                                               (_EXPANDING,)).fetchone()[0]
+                running = connection.execute("SELECT COUNT(*) FROM tasks WHERE status = 'running' AND worker != ?",
+                                             (worker,)).fetchone()[0]
+                connection.execute('COMMIT')
+                return ('wait', None) if expanding + running > 0 else None
+            connection.execute("UPDATE tasks SET status = 'running', worker = ?, attempts = attempts + 1, "
+                               "started = ?, error = NULL WHERE task_id = ?", (worker, time.time(), row[0]))
+            task = connection.execute('SELECT t.task_id, t.chain_id, c.chain, t.step, t.filename '
+                                      'FROM tasks t JOIN chains c ON t.chain_id = c.chain_id '
+                                      'WHERE t.task_id = ?', (row[0],)).fetchone()
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        task_id, chain_id, chain, step, filename = task
+        return 'task', (task_id, chain_id, json.loads(chain), step, filename)
+
+    def claim_more(self, worker: int, chain_id: int, step: int, limit: int) \
+            -> List[Tuple[int, int, List[str], int, str]]:
+        """
+        Claim up to limit further pending tasks of the same chain and step as one already claimed, so that they can
+        be processed together on the same checkout
+        :return: The (task_id, chain_id, chain, step, filename) of every claimed task
+        """
+        if limit <= 0:
+            return list()
+        connection = self._transaction()
+        try:
+            rows = connection.execute("SELECT task_id FROM tasks WHERE status = 'pending' AND chain_id = ? "
+                                      "AND step = ? ORDER BY task_id LIMIT ?", (chain_id, step, limit)).fetchall()
+            started = time.time()
+            connection.executemany("UPDATE tasks SET status = 'running', worker = ?, attempts = attempts + 1, "
+                                   "started = ?, error = NULL WHERE task_id = ?",
+                                   [(worker, started, row[0]) for row in rows])
+            tasks = [connection.execute('SELECT t.task_id, t.chain_id, c.chain, t.step, t.filename '
+                                        'FROM tasks t JOIN chains c ON t.chain_id = c.chain_id '
+                                        'WHERE t.task_id = ?', (row[0],)).fetchone() for row in rows]
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        return [(task_id, chain_id, json.loads(chain), step, filename)
+                for task_id, chain_id, chain, step, filename in tasks]
+
+    def expanded(self, chain_id: int, tasks: Iterable[Tuple[int, str]], error: Optional[str] = None):
+        """
+        Record the (step, filename) tasks of a chain claimed for expansion, or the error that prevented expanding it
+        """
+        connection = self._transaction()
+        try:
+            connection.executemany('INSERT OR IGNORE INTO tasks (chain_id, step, filename) VALUES (?, ?, ?)',
+                                   [(chain_id, step, filename) for step, filename in tasks])
+            connection.execute('UPDATE chains SET expanded = ?, error = ? WHERE chain_id = ?',
+                               (_EXPANDED, error, chain_id))
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+
+    def finish(self, task_id: int, error: Optional[str] = None):
+        """
+        Mark a claimed task as done, or as failed with the given error
+        """
+        self.connection.execute('UPDATE tasks SET status = ?, error = ?, finished = ? WHERE task_id = ?',
+                                ('done' if error is None else 'failed', error, time.time(), task_id))
+
+    def summary(self) -> Dict[str, int]:
+        """
+        :return: The number of tasks per status, and the number of chains still to be expanded
+        """
+        counts = dict(self.connection.execute('SELECT status, COUNT(*) FROM tasks GROUP BY status').fetchall())
+        counts['unexpanded chains'] = self.connection.execute('SELECT COUNT(*) FROM chains WHERE expanded != ?',
+                                                              (_EXPANDED,)).fetchone()[0]
+        return counts
+
+    def failures(self) -> List[Tuple[List[str], int, str, int, str]]:
+        """
+        :return: The chain, step, filename, attempts and error of every failed task, and of every chain that could
+                 not be expanded (with step 0 and no filename)
+        """
+        chains = [(json.loads(chain), 0, '', 1, error) for chain, error in
+                  self.connection.execute('SELECT chain, error FROM chains WHERE error IS NOT NULL '
+                                          'ORDER BY chain_id').fetchall()]
+        return chains + [(json.loads(chain), step, filename, attempts, error)
+                         for chain, step, filename, attempts, error in
+                         self.connection.execute("SELECT c.chain, t.step, t.filename, t.attempts, t.error "
+                                                 "FROM tasks t JOIN chains c ON t.chain_id = c.chain_id "
+                                                 "WHERE t.status = 'failed' ORDER BY t.chain_id, t.step").fetchall()]
+
+
+if __name__ == '__main__':
+    import sys
+
+    # Report on a queue, e.g. ./data/corpora_raw/<repository>/jobs.sqlite
+    queue = Job_Queue(sys.argv[1])
+    for status, count in sorted(queue.summary().items()):
+        print('%s: %d' % (status, count))
+    if len(sys.argv) > 2 and sys.argv[2] == 'errors':
+        for chain, step, filename, attempts, error in queue.failures():
+            print('%s step %d %s (%d attempts):\n%s' % (','.join(chain), step, filename, attempts, error))
@@ -2,10 +2,8 @@ import os
 import sys
 from threading import Thread
 
-import networkx as nx
-
 from Util.general_util import get_pattern_paths
-from deltaPDG.Util.pygraph_util import read_graph_from_dot, obj_dict_to_networkx
+from deltaPDG.Util.pygraph_util import read_graph_from_dot, obj_dict_to_networkx, write_dot
 
 
 def worker(all_graph_locations, corpus_name):
@@ -43,7 +41,7 @@ def worker(all_graph_locations, corpus_name):
             output_path = os.path.join('.', 'data', 'corpora_clean',
                                        corpus_name, data_point_name, nr_concepts, 'merged.dot')
             os.makedirs(os.path.dirname(output_path), exist_ok=True)
-            nx.drawing.nx_pydot.write_dot(graph, output_path)
+            write_dot(graph, output_path)
 
 
 if __name__ == '__main__':
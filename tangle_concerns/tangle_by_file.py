@@ -7,6 +7,7 @@ from typing import List, Tuple, Any
 
 import numpy as np
 
+from deltaPDG.Util.commit_index import Commit_Index
 from deltaPDG.Util.git_util import Git_Util
 
 KEYWORDS = {'FIX', 'FIXES', 'FIXED', 'IMPLEMENTS', 'IMPLEMENTED', 'IMPLEMENT', 'BUG', 'FEATURE', }
@@ -51,15 +52,19 @@ def filter_pairs_by_predicates(list_of_pairs: List[Tuple[str, str]], predicates:
     return result
 
 
-def commits_within(gh, path, days):
+def commits_within(gh, path, days, index: Commit_Index = None):
     def inner_predicate(sha1, sha2):
+        if index is not None and sha1 in index and sha2 in index:
+            return index.date(sha2) - index.date(sha1) <= datetime.timedelta(days=days)
         return gh.get_time_between_commits(sha1, sha2, path) <= datetime.timedelta(days=days)
 
     return inner_predicate
 
 
-def same_author(gh, path):
+def same_author(gh, path, index: Commit_Index = None):
     def inner_predicate(sha1, sha2):
+        if index is not None and sha1 in index and sha2 in index:
+            return index.author(sha1) == index.author(sha2)
         author_old = gh.get_author(sha1, path)
         author_new = gh.get_author(sha2, path)
         return author_old == author_new
@@ -67,15 +72,20 @@ def same_author(gh, path):
     return inner_predicate
 
 
-def diff_regions_size(gh, path, max_regions):
+def diff_regions_size(gh, path, max_regions, index: Commit_Index = None):
     def inner_predicate(sha1, sha2):
+        # The index only knows the diff-regions of a commit against its (first) parent
+        if index is not None and sha2 in index and index.parents(sha2)[:1] == [sha1]:
+            return index.diff_regions(sha2) <= max_regions
         return len(gh.merge_diff_into_diff_regions(gh.process_diff_between_commits(sha1, sha2, path))) <= max_regions
 
     return inner_predicate
 
 
-def both_are_atomic(gh, path):
+def both_are_atomic(gh, path, index: Commit_Index = None):
     def inner_predicate(sha1, sha2):
+        if index is not None and sha1 in index and sha2 in index:
+            return len(index.keywords(sha1, KEYWORDS)) <= 1 and len(index.keywords(sha2, KEYWORDS)) <= 1
         commit_msg1 = gh.get_commit_msg(sha1, path)
         commit_msg2 = gh.get_commit_msg(sha2, path)
         return len(set(commit_msg1.upper().split()).intersection(KEYWORDS)) <= 1 \
@@ -88,38 +98,35 @@ def tangle_by_file(subject, temp_loc):
     days = 14
     up_to_concerns = 4
 
-    git_handler = Git_Util(temp_dir=temp_loc)
-
-    with git_handler as gh:
-        temp = gh.move_git_repo_to_tmp(subject)
-        candidates = gh.get_all_commit_hashes_authors_dates_messages(temp)
-
-        candidates_by_author = defaultdict(list)
-        for sha, author, date, msg, diff in candidates:
-            candidates_by_author[author].append((sha, date, msg))
-        candidates_by_author = dict(candidates_by_author)
-
-        history_flat = list()
-        for candidates in candidates_by_author.values():
-            candidates = sorted(candidates, key=lambda p: p[1])
-            index = 0
-            while index < len(candidates):
-                sha, date, msg = candidates[index]
-                index += 1
-                if len(set(msg.upper().split()).intersection(KEYWORDS)) <= 1:
-                    chain = [sha]
-                    for offset in range(0, up_to_concerns):
-                        try:
-                            new_sha, new_date, new_msg = candidates[index + offset]
-                            if new_date - date <= datetime.timedelta(days=days) \
-                                    and len(set(new_msg.upper().split()).intersection(KEYWORDS)) <= 1:
-                                chain.append(new_sha)
-                            else:
-                                break
-                        except IndexError:
+    # The commit index only reads the repository, it does not need a temporary copy
+    candidates = Commit_Index.open(subject).candidates()
+
+    candidates_by_author = defaultdict(list)
+    for sha, author, date, msg in candidates:
+        candidates_by_author[author].append((sha, date, msg))
+    candidates_by_author = dict(candidates_by_author)
+
+    history_flat = list()
+    for candidates in candidates_by_author.values():
+        candidates = sorted(candidates, key=lambda p: p[1])
+        index = 0
+        while index < len(candidates):
+            sha, date, msg = candidates[index]
+            index += 1
+            if len(set(msg.upper().split()).intersection(KEYWORDS)) <= 1:
+                chain = [sha]
+                for offset in range(0, up_to_concerns):
+                    try:
+                        new_sha, new_date, new_msg = candidates[index + offset]
+                        if new_date - date <= datetime.timedelta(days=days) \
+                                and len(set(new_msg.upper().split()).intersection(KEYWORDS)) <= 1:
+                            chain.append(new_sha)
+                        else:
                             break
-                    if len(chain) > 1:
-                        history_flat.append(chain)
+                    except IndexError:
+                        break
+                if len(chain) > 1:
+                    history_flat.append(chain)
 
     return history_flat
 
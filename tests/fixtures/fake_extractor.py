@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""
+Stands in for the PDG extractor: `fake_extractor.py <solution> <.\\file>` writes pdg.dot and nameflows.json to the
+working directory as the extractor does. Every non-empty line of the file becomes a node, consecutive lines are
+linked by control flow. In the name flow every line is related to the next line sharing a word with it, and a
+declaration of Console.WriteLine in another file to the lines calling it. When FAKE_EXTRACTOR_LOG is set, the file
+and working directory of every run are appended to it.
+"""
+import json
+import os
+import sys
+import time
+
+if __name__ == '__main__':
+    filename = sys.argv[2].replace('\\', '/')
+    if 'FAKE_EXTRACTOR_LOG' in os.environ:
+        with open(os.environ['FAKE_EXTRACTOR_LOG'], 'a') as log:
+            log.write('%s %s\n' % (filename, os.getcwd()))
+    # Give concurrent runs a chance to overlap
+    time.sleep(0.05)
+    with open(filename) as f:
+        lines = [(i + 1, line.strip()) for i, line in enumerate(f) if line.strip() != '']
+
+    with open('pdg.dot', 'w') as f:
+        f.write('digraph "extractedGraph" {\nsubgraph cluster_0 {\nlabel="%s";\n' % filename[2:])
+        for number, line in lines:
+            f.write('n%d [label="%s", span="%d-%d"];\n' % (number, line.replace('"', '\\"'), number, number))
+        f.write('}\n')
+        for (number, _), (next_number, _) in zip(lines, lines[1:]):
+            f.write('n%d -> n%d [key=0, style=solid, label=Ctrl];\n' % (number, next_number))
+        f.write('}\n')
+
+    words = [set(line.replace(';', ' ').split()) for _, line in lines]
+    relations = [next(([j] for j in range(i + 1, len(lines)) if words[i] & words[j]), None)
+                 for i in range(len(lines))]
+    # Locations in the extracted file are relative to the solution, the others are absolute
+    nodes = [{'Location': '%s : %d' % (filename, number), 'symbolKind': 'Local', 'kind': 'ref', 'type': 'int',
+              'name': line.split()[0]} for number, line in lines]
+    nodes.append({'Location': '%s : 1' % os.path.join(os.getcwd(), 'src', 'Console.cs'), 'symbolKind': 'Method',
+                  'kind': 'def', 'type': 'void', 'name': 'Console.WriteLine'})
+    relations.append([i for i, (_, line) in enumerate(lines) if 'Console.WriteLine' in line])
+    with open('nameflows.json', 'w') as f:
+        json.dump({'nodes': nodes, 'relations': relations}, f)
@@ -0,0 +1,6 @@
+int count = 0;
+int step = 2;
+
+count += step;
+Console.WriteLine(count);
+step = count;
@@ -0,0 +1,3 @@
+string name = "World";
+string greeting = "Hello, " + name;
+Console.WriteLine(greeting);
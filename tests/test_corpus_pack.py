@@ -0,0 +1,49 @@
+import os
+import pickle
+import shutil
+import warnings
+
+import pytest
+
+import Util.corpus_pack as corpus_pack
+from deltaPDG.Util.pygraph_util import read_networkx_from_dot, same_graph
+
+fixture = os.path.join(os.path.dirname(__file__), 'fixtures', 'extractor_pdg.dot')
+
+
+@pytest.fixture
+def corpus(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    for datapoint in ['a', 'b']:
+        os.makedirs(os.path.join(corpus_pack.corpus_root('repo'), datapoint, '2'))
+        shutil.copy(fixture, os.path.join(corpus_pack.corpus_root('repo'), datapoint, '2', 'merged.dot'))
+    corpus_pack.build_corpus_pack('repo')
+    return corpus_pack.corpus_root('repo')
+
+
+def test_lookups_do_not_walk_the_corpus(corpus, monkeypatch):
+    def walk(*args):
+        raise AssertionError('The corpus tree was walked')
+    monkeypatch.setattr(corpus_pack, 'get_pattern_paths', walk)
+    pack = pickle.loads(pickle.dumps(corpus_pack.open_corpus_pack('repo')))
+    assert pack.datapoints() == ['a', 'b']
+    assert pack.paths(exclude=['a']) == [os.path.join(corpus, 'b', '2', 'merged.dot')]
+    assert len(pack) == 2
+    path = pack.paths()[0]
+    assert same_graph(pack.load(path), read_networkx_from_dot(path, use_cache=False))
+
+
+def test_check_finds_changed_and_removed_graphs(corpus):
+    shutil.rmtree(os.path.join(corpus, 'a'))
+    changed = os.path.join(corpus, 'b', '2', 'merged.dot')
+    with open(changed, 'a') as f:
+        f.write('\n')
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        pack = corpus_pack.open_corpus_pack('repo', check=True)
+    assert len(caught) == 1
+    assert pack.stale == [changed] and pack.removed == [os.path.join(corpus, 'a', '2', 'merged.dot')]
+    assert pack.paths() == [changed]
+
+    pack = corpus_pack.open_corpus_pack('repo', rebuild=True)
+    assert pack.check() and pack.paths() == [changed]
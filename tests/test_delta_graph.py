@@ -0,0 +1,48 @@
+import os
+
+import networkx as nx
+
+from deltaPDG.Util.delta_graph import DeltaGraph, NAME
+from deltaPDG.Util.merge_nameflow import add_nameflow_edges
+from deltaPDG.Util.pygraph_util import read_networkx_from_dot, same_graph
+from du_chains.DU_chains_closure import extract_DU_chains_from_delta
+
+fixture = os.path.join(os.path.dirname(__file__), 'fixtures', 'extractor_pdg.dot')
+
+
+def _nameflow_graph():
+    graph = read_networkx_from_dot(fixture, use_cache=False)
+    nameflow = {
+        'nodes': [{'Infile': True, 'Location': [0, 9], 'symbolKind': 'Local', 'kind': 'def', 'type': 'int',
+                   'name': 'count'},
+                  {'Infile': True, 'Location': [0, 10], 'symbolKind': 'Local', 'kind': 'use', 'type': 'int',
+                   'name': 'count'}],
+        'relations': [[1], []],
+    }
+    graph = add_nameflow_edges(nameflow, graph)
+    graph.add_edge('n0', 'n1', key='x', weight=1.5)
+    return graph
+
+
+def test_round_trip():
+    graph = _nameflow_graph()
+    assert graph.has_edge('n3', 'n4', key=3)
+    delta = DeltaGraph.from_networkx(graph)
+    assert delta.out_neighbours(delta.node_index['n3'], keys=[NAME]) == [delta.node_index['n4']]
+    assert [key for _, _, key, _ in delta.edge_extra] == ['x']
+    assert same_graph(delta.to_networkx(), graph)
+
+
+def test_du_chains():
+    graph = nx.MultiDiGraph()
+    graph.add_node('a', label='int x = 0;', span='1-1')
+    graph.add_node('b', label='x += y;', span='2-2', color='green')
+    graph.add_node('c', label='Console.Write(x);', span='3-3', color='red')
+    graph.add_edge('a', 'b', '1', style='dotted', label='x')
+    graph.add_edge('a', 'c', '1', style='dotted', label='x')
+    graph.add_edge('b', 'c', '1', style='dotted', label='x')
+    graph.add_edge('a', 'b', '0', style='solid')
+    graph.add_edge('b', 'c', 3, style='bold')
+    chains = extract_DU_chains_from_delta(graph)
+    assert dict(chains.nodes(data=True)) == dict(graph.nodes(data=True))
+    assert sorted(chains.edges(keys=True)) == [('a', 'c', '1'), ('b', 'c', '1')]
@@ -0,0 +1,102 @@
+import os
+import shutil
+
+import pytest
+
+from deltaPDG.Util.generate_pdg import PDG_Executor, PDG_Generator
+from deltaPDG.Util.pdg_cache import PDG_Cache
+from deltaPDG.Util.pygraph_util import same_graph
+
+fixtures = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+extractor = os.path.join(fixtures, 'fake_extractor.py')
+files = ['/src/Counter.cs', '/src/Greeter.cs']
+
+
+@pytest.fixture
+def generators(tmp_path, monkeypatch):
+    """
+    :return: A before and after generator, each on a checkout of its own, and the log of extractor runs
+    """
+    monkeypatch.setenv('FAKE_EXTRACTOR_LOG', str(tmp_path / 'extractor.log'))
+    generators = list()
+    for name in ['before', 'after']:
+        location = str(tmp_path / name)
+        shutil.copytree(os.path.join(fixtures, 'repository'), location)
+        generators.append(PDG_Generator(extractor_location=extractor, repository_location=location,
+                                        target_filename='%s_pdg.dot' % name, target_location=str(tmp_path)))
+    with open(os.path.join(generators[1].repository_location, 'src', 'Counter.cs'), 'a') as f:
+        f.write('Console.WriteLine(step);\n')
+    return generators, tmp_path / 'extractor.log'
+
+
+def _jobs(generators):
+    return [(generator, filename, '%d_%s' % (i, generator.target_filename))
+            for i, filename in enumerate(files) for generator in generators]
+
+
+def _sequential(generators):
+    return [generator(filename, target_filename, lazy=True) for generator, filename, target_filename
+            in _jobs(generators)]
+
+
+def _working_directories(log):
+    return [line.split(' ', 1)[1] for line in log.read_text().splitlines()]
+
+
+def test_concurrent_runs_match_sequential_runs(generators, tmp_path):
+    generators, log = generators
+    sequential = _sequential(generators)
+    log.unlink()
+
+    with PDG_Executor(4, str(tmp_path)) as executor:
+        scratch_location = executor.scratch_location
+        concurrent = executor.run(_jobs(generators), lazy=True)
+    assert not os.path.exists(scratch_location)
+    # Every run had a mirror of its own
+    directories = _working_directories(log)
+    assert len(set(directories)) == len(directories) == len(concurrent)
+    assert all(d.startswith(scratch_location) for d in directories)
+    for expected, pdg in zip(sequential, concurrent):
+        assert same_graph(pdg.graph(), expected.graph())
+    assert any(key == '3' for pdg in concurrent for _, _, key in pdg.graph().edges(keys=True))
+
+    # As written out, by the same generators
+    sequential = [generator(filename, 'sequential_' + target_filename)
+                  for generator, filename, target_filename in _jobs(generators)]
+    with PDG_Executor(4, str(tmp_path)) as executor:
+        concurrent = executor.run(_jobs(generators))
+    for expected, pdg in zip(sequential, concurrent):
+        with open(expected.location) as f, open(pdg.location) as g:
+            assert f.read() == g.read()
+
+
+def test_nameflows_are_relocated_out_of_mirrors(generators, tmp_path):
+    generators, _ = generators
+    cache = PDG_Cache(str(tmp_path / 'cache'), 1 << 20)
+    for generator in generators:
+        generator.cache = cache
+    with PDG_Executor(4, str(tmp_path)) as executor:
+        scratch_location = executor.scratch_location
+        executor.run(_jobs(generators), lazy=True)
+    entries = [path for path, _, _ in cache._entries()]
+    # Greeter.cs is the same in both checkouts
+    assert len(entries) == 3
+    for path in entries:
+        with open(path) as f:
+            entry = f.read()
+        assert scratch_location not in entry and '<repository>' in entry
+
+
+def test_repository_is_locked_without_links(generators, tmp_path, monkeypatch):
+    generators, log = generators
+    sequential = _sequential(generators)
+    log.unlink()
+
+    def symlink(*args):
+        raise OSError('Links are not supported')
+    monkeypatch.setattr(os, 'symlink', symlink)
+    with PDG_Executor(4, str(tmp_path)) as executor:
+        concurrent = executor.run(_jobs(generators), lazy=True)
+    assert sorted(_working_directories(log)) == sorted(g.repository_location for g, _, _ in _jobs(generators))
+    for expected, pdg in zip(sequential, concurrent):
+        assert same_graph(pdg.graph(), expected.graph())
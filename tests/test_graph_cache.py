@@ -0,0 +1,42 @@
+import os
+import shutil
+
+import networkx as nx
+import numpy as np
+import pytest
+
+from deltaPDG.Util.graph_cache import CACHE_SUFFIX, graph_to_arrays, read_graph_cache
+from deltaPDG.Util.pygraph_util import read_networkx_from_dot, same_graph
+
+fixtures = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+def test_touched_file_updates_cached_stat(tmp_path):
+    location = str(tmp_path / 'pdg.dot')
+    shutil.copy(os.path.join(fixtures, 'extractor_pdg.dot'), location)
+    graph = read_networkx_from_dot(location)
+    assert os.path.exists(location + CACHE_SUFFIX)
+
+    stat = os.stat(location)
+    os.utime(location, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    cached = read_graph_cache(location)
+    assert cached is not None and same_graph(cached, graph)
+    with np.load(location + CACHE_SUFFIX) as arrays:
+        assert arrays['version'].tolist()[1] == os.stat(location).st_mtime_ns
+
+
+def test_dot_file_without_edge_keys_is_read_uncached(tmp_path):
+    location = str(tmp_path / 'pdg.dot')
+    with open(location, 'w') as f:
+        f.write('digraph "extractedGraph" {\na [label="x = 1;"];\nb [label="y = x;"];\na -> b [style=solid];\n}\n')
+    graph = read_networkx_from_dot(location)
+    assert list(graph.edges(keys=True)) == [('a', 'b', 0)]
+    assert not os.path.exists(location + CACHE_SUFFIX)
+    assert same_graph(read_networkx_from_dot(location), graph)
+
+
+def test_int_edge_keys_are_rejected():
+    graph = nx.MultiDiGraph()
+    graph.add_edge('a', 'b', key=3)
+    with pytest.raises(TypeError):
+        graph_to_arrays(graph)
@@ -0,0 +1,68 @@
+import sqlite3
+
+from tangle_concerns.job_queue import Job_Queue, MAX_ATTEMPTS
+
+
+def _queue(tmp_path, chains=(['a', 'b', 'c'],)) -> Job_Queue:
+    queue = Job_Queue(str(tmp_path / 'jobs.sqlite'))
+    queue.add_chains(chains)
+    return queue
+
+
+def test_chain_of_dead_expanding_worker_is_released(tmp_path):
+    queue = _queue(tmp_path)
+    kind, (chain_id, chain) = queue.claim(1)
+    assert kind == 'expand'
+    # Worker 1 dies while expanding, the others wait on it
+    assert queue.claim(2) == ('wait', None)
+    queue.release(1, 'Worker 1 exited with code -9')
+    assert queue.claim(2) == ('expand', (chain_id, chain))
+    queue.close()
+
+
+def test_tasks_of_dead_worker_are_released(tmp_path):
+    queue = _queue(tmp_path)
+    _, (chain_id, _) = queue.claim(1)
+    queue.expanded(chain_id, [(1, 'x.cs'), (2, 'x.cs')])
+    kind, (task_id, _, _, step, _) = queue.claim(1)
+    assert (kind, step) == ('task', 1)
+    queue.finish(queue.claim(2)[1][0])
+    # Worker 2 has nothing left to do, but worker 1 may still die
+    assert queue.claim(2) == ('wait', None)
+
+    queue.release(1, 'Worker 1 exited with code -9')
+    assert queue.claim(2)[1][0] == task_id
+    queue.release(2, 'Worker 2 exited with code -9')
+    # The task killed its worker on every attempt, it is not handed out again
+    assert queue.summary()['failed'] == 1 and MAX_ATTEMPTS == 2
+    assert queue.failures()[0][4] == 'Worker 2 exited with code -9'
+    assert queue.claim(3) is None
+    queue.close()
+
+
+def test_release_leaves_other_workers_alone(tmp_path):
+    queue = _queue(tmp_path, [['a', 'b'], ['c', 'd']])
+    _, (first, _) = queue.claim(1)
+    _, (second, _) = queue.claim(2)
+    queue.release(1, 'Worker 1 exited with code 1')
+    assert queue.claim(3)[1][0] == first
+    queue.expanded(second, [])
+    queue.expanded(first, [])
+    assert queue.claim(3) is None
+    queue.close()
+
+
+def test_queue_without_chain_workers_is_upgraded(tmp_path):
+    location = str(tmp_path / 'jobs.sqlite')
+    connection = sqlite3.connect(location)
+    connection.execute('CREATE TABLE chains (chain_id INTEGER PRIMARY KEY, chain TEXT UNIQUE NOT NULL, '
+                       'expanded INTEGER NOT NULL DEFAULT 0, error TEXT)')
+    connection.execute("INSERT INTO chains (chain) VALUES ('[\"a\", \"b\"]')")
+    connection.commit()
+    connection.close()
+
+    queue = Job_Queue(location)
+    assert queue.claim(1)[0] == 'expand'
+    queue.release(1, 'Worker 1 exited with code 1')
+    assert queue.claim(2)[0] == 'expand'
+    queue.close()
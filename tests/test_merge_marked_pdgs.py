@@ -0,0 +1,216 @@
+"""
+Checks Marked_Merger against the merger as it was before its anchor index, batched fuzzy matching and deque worklist,
+loaded from git history. Running this file also times both on a large synthetic pair:
+    PYTHONPATH=. python tests/test_merge_marked_pdgs.py [pairs] [size of large pair]
+"""
+import contextlib
+import os
+import random
+import subprocess
+import sys
+import time
+import types
+from typing import List, Tuple
+from unittest import mock
+
+import networkx as nx
+import pytest
+
+from deltaPDG.Util.equivalence_util import configure_similarity_cache, similarity_cache_info
+from deltaPDG.Util.merge_marked_pdgs import Marked_Merger
+from deltaPDG.Util.pygraph_util import same_graph
+
+# The last revision before the merger and Eq_Utils were optimised
+REFERENCE_REVISION = '92068c9'
+_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_words = ['foo', 'bar', 'baz', 'x', 'y', 'count', 'items', 'Add', 'return', 'if']
+
+
+def _module_from_git(name: str, path: str) -> types.ModuleType:
+    source = subprocess.check_output(['git', 'show', '%s:%s' % (REFERENCE_REVISION, path)], cwd=_root)
+    module = types.ModuleType(name)
+    exec(compile(source, '%s:%s' % (REFERENCE_REVISION, path), 'exec'), module.__dict__)
+    return module
+
+
+def reference_merger_class():
+    """
+    :return: Marked_Merger at REFERENCE_REVISION, using Eq_Utils at that revision
+    """
+    equivalence_util = _module_from_git('reference_equivalence_util', 'deltaPDG/Util/equivalence_util.py')
+    with mock.patch.dict(sys.modules, {'deltaPDG.Util.equivalence_util': equivalence_util}):
+        return _module_from_git('reference_merge_marked_pdgs', 'deltaPDG/Util/merge_marked_pdgs.py').Marked_Merger
+
+
+def reference_graph_api():
+    """
+    :return: A context in which graphs have Graph.node, which the reference merger and Eq_Utils use. networkx 2.4
+             removed it in favour of Graph.nodes.
+    """
+    if hasattr(nx.Graph, 'node'):
+        return contextlib.nullcontext()
+    return mock.patch.object(nx.Graph, 'node', property(lambda graph: graph.nodes), create=True)
+
+
+def _random_label(rng: random.Random) -> str:
+    return ' '.join(rng.choice(_words) for _ in range(rng.randint(1, 4))) + ';'
+
+
+def synthetic_pdg(rng: random.Random, n: int) -> nx.MultiDiGraph:
+    """
+    :return: A PDG of n statements on consecutive lines, grouped into methods of 40 statements that start with an
+             Entry node, with edges between nearby statements, a third of them non-solid (e.g. name flow). There are
+             no parallel edges: the merger raises a KeyError when the two graphs have different keys on an edge
+             between anchors.
+    """
+    graph = nx.MultiDiGraph()
+    for i in range(n):
+        graph.add_node('n%d' % i, label=_random_label(rng) if i % 40 else 'Entry C%d' % (i // 40),
+                       span='%d-%d' % (i + 1, i + 1), cluster='C%d' % (i // 40))
+    for _ in range(2 * n):
+        u = rng.randrange(n)
+        v = min(n - 1, max(0, u + rng.randint(-4, 4)))
+        style = rng.choice(['solid', 'solid', 'dashed'])
+        if not graph.has_edge('n%d' % u, 'n%d' % v):
+            graph.add_edge('n%d' % u, 'n%d' % v, style=style)
+    return graph
+
+
+def synthetic_pdg_pair(rng: random.Random, n: int, added: float = 0.1, removed: float = 1 / 15,
+                       relabelled: float = 0.1) -> Tuple[nx.MultiDiGraph, nx.MultiDiGraph]:
+    """
+    :param added, removed: The fraction of statements marked as added in the after graph or removed from the before
+                           graph, as mark_pdg_nodes marks the lines of a diff
+    :param relabelled: The fraction of statements whose label differs in the after graph
+    :return: The marked before and after PDGs
+    """
+    before = synthetic_pdg(rng, n)
+    after = before.copy()
+    for i in rng.sample(range(n), int(n * relabelled)):
+        after.nodes['n%d' % i]['label'] = _random_label(rng)
+    for graph, fraction, color in [(after, added, 'green'), (before, removed, 'red')]:
+        for i in rng.sample(range(1, n), int(n * fraction)):
+            if i % 40:
+                graph.nodes['n%d' % i]['color'] = color
+    return before, after
+
+
+def malformed_pdg_pairs(rng: random.Random) -> List[Tuple[str, nx.MultiDiGraph, nx.MultiDiGraph]]:
+    """
+    :return: Marked PDG pairs with malformed input, with a description, the merger raises on most of them
+    """
+    pairs = list()
+    before, after = synthetic_pdg_pair(rng, 80)
+    u, v, k = next((u, v, k) for u, v, k in before.edges(keys=True)
+                   if 'color' not in before.nodes[u].keys() and before.nodes[u]['label'] == after.nodes[u]['label'])
+    del before[u][v][k]['style']
+    pairs.append(('before edge without style', before, after))
+
+    before, after = synthetic_pdg_pair(rng, 80)
+    u, v = next((u, v) for u, v in before.edges() if 'color' not in before.nodes[u].keys())
+    after.add_edge(u, v, style='solid')
+    pairs.append(('after edge parallel to an edge between anchors', before, after))
+
+    before, after = synthetic_pdg_pair(rng, 80)
+    del after.nodes[next(n for n, d in after.nodes(data=True) if 'color' not in d.keys())]['label']
+    pairs.append(('unmarked after node without label', before, after))
+
+    before, after = synthetic_pdg_pair(rng, 80)
+    after = nx.relabel_nodes(after, {n: 'x' + n[1:] for n, d in after.nodes(data=True) if 'color' in d.keys()})
+    pairs.append(('marked after node not named n<id>', before, after))
+    return pairs
+
+
+def merge(merger, before: nx.MultiDiGraph, after: nx.MultiDiGraph):
+    """
+    :return: The merged graph or the exception raised, and the time the merge took on an empty similarity cache
+    """
+    configure_similarity_cache(similarity_cache_info().maxsize)
+    t0 = time.perf_counter()
+    try:
+        result = merger(before, after)
+    except Exception as e:
+        result = e
+    return result, time.perf_counter() - t0
+
+
+def merge_both(reference_merger, fuzziness: int, before: nx.MultiDiGraph, after: nx.MultiDiGraph):
+    """
+    :return: The results of the reference merger and of Marked_Merger and the times they took, see merge
+    """
+    with reference_graph_api():
+        reference, t_reference = merge(reference_merger(m_fuzziness=fuzziness, n_fuzziness=fuzziness), before, after)
+    result, t_result = merge(Marked_Merger(m_fuzziness=fuzziness, n_fuzziness=fuzziness), before, after)
+    return reference, t_reference, result, t_result
+
+
+def same_result(result, reference) -> bool:
+    if isinstance(reference, Exception) or isinstance(result, Exception):
+        return type(result) is type(reference) and str(result) == str(reference)
+    return same_graph(result, reference)
+
+
+def well_formed_cases(rng: random.Random, n_pairs: int, sizes: List[int]):
+    for _ in range(n_pairs):
+        n = rng.choice(sizes)
+        before, after = synthetic_pdg_pair(rng, n)
+        for fuzziness in [100, 80]:
+            yield '%d nodes, fuzziness %d' % (n, fuzziness), fuzziness, before, after
+
+
+def malformed_cases(rng: random.Random):
+    for description, before, after in malformed_pdg_pairs(rng):
+        yield description, 100, before, after
+
+
+@pytest.fixture(scope='module')
+def reference_merger():
+    try:
+        return reference_merger_class()
+    except (OSError, subprocess.CalledProcessError):
+        pytest.skip('The reference merger is only available in a git checkout with its history')
+
+
+@pytest.mark.parametrize('case', list(well_formed_cases(random.Random(5), 4, [50, 200])), ids=lambda case: case[0])
+def test_same_as_reference(reference_merger, case):
+    _, fuzziness, before, after = case
+    reference, _, result, _ = merge_both(reference_merger, fuzziness, before, after)
+    # Both have to merge, matching errors would not show that the merged graphs are the same
+    assert isinstance(reference, nx.MultiDiGraph), repr(reference)
+    assert isinstance(result, nx.MultiDiGraph), repr(result)
+    assert same_graph(result, reference)
+
+
+@pytest.mark.parametrize('case', list(malformed_cases(random.Random(7))), ids=lambda case: case[0])
+def test_same_error_as_reference(reference_merger, case):
+    _, fuzziness, before, after = case
+    reference, _, result, _ = merge_both(reference_merger, fuzziness, before, after)
+    assert not isinstance(reference, AttributeError), repr(reference)
+    assert same_result(result, reference)
+
+
+if __name__ == '__main__':
+    n_pairs = int(sys.argv[1]) if len(sys.argv) > 1 else 6
+    large = int(sys.argv[2]) if len(sys.argv) > 2 else 4000
+    rng = random.Random(5)
+    all_cases = list(well_formed_cases(rng, n_pairs, [50, 200, 600])) + list(malformed_cases(rng))
+    if large > 0:
+        before, after = synthetic_pdg_pair(rng, large, added=1 / 3)
+        all_cases.append(('%d nodes, a third of the lines added' % large, 100, before, after))
+
+    Reference_Merger = reference_merger_class()
+    reference_time, merger_time, mismatches = 0.0, 0.0, list()
+    for description, fuzziness, before, after in all_cases:
+        reference, t_reference, result, t_result = merge_both(Reference_Merger, fuzziness, before, after)
+        reference_time += t_reference
+        merger_time += t_result
+        if not same_result(result, reference):
+            mismatches.append(description)
+        print('%s: %s, reference %.3fs, merger %.3fs (%.1fx)'
+              % (description, 'raised %s' % type(reference).__name__ if isinstance(reference, Exception)
+                 else 'merged', t_reference, t_result, t_reference / max(t_result, 1e-9)), flush=True)
+    print('Merged %d pairs: reference %.3fs, merger %.3fs (%.1fx)' % (len(all_cases), reference_time, merger_time,
+                                                                      reference_time / max(merger_time, 1e-9)))
+    for mismatch in mismatches:
+        print('Mismatch: %s' % mismatch)
+    assert len(mismatches) == 0
@@ -0,0 +1,96 @@
+import os
+import shutil
+
+import pytest
+
+from deltaPDG.Util.generate_pdg import PDG_Generator
+from deltaPDG.Util.pdg_cache import PDG_Cache
+from deltaPDG.Util.pygraph_util import same_graph
+
+fixtures = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+extractor = os.path.join(fixtures, 'fake_extractor.py')
+
+
+@pytest.fixture
+def checkouts(tmp_path, monkeypatch):
+    """
+    :return: Two checkouts of the same repository and the log of extractor runs
+    """
+    monkeypatch.setenv('FAKE_EXTRACTOR_LOG', str(tmp_path / 'extractor.log'))
+    locations = [str(tmp_path / name) for name in ['v1', 'v2']]
+    for location in locations:
+        shutil.copytree(os.path.join(fixtures, 'repository'), location)
+    return locations, tmp_path / 'extractor.log'
+
+
+def _runs(log) -> int:
+    return len(log.read_text().splitlines()) if log.exists() else 0
+
+
+def _generator(repository_location, target_location, cache=None):
+    return PDG_Generator(extractor_location=extractor, repository_location=repository_location,
+                         target_location=str(target_location), cache=cache)
+
+
+def test_hit_in_another_checkout(checkouts, tmp_path):
+    (v1, v2), log = checkouts
+    cache = PDG_Cache(str(tmp_path / 'cache'), 1 << 20)
+    first = _generator(v1, tmp_path, cache)('/src/Counter.cs', lazy=True)
+    assert (cache.hits, cache.misses, _runs(log)) == (0, 1, 1)
+    # Only the repository location stands in the cached nameflows, as a placeholder
+    with open(cache._path(cache.key(extractor, v1, '/src/Counter.cs'))) as f:
+        entry = f.read()
+    assert v1 not in entry and '<repository>' in entry
+
+    hit = _generator(v2, tmp_path, cache)('/src/Counter.cs', lazy=True)
+    assert (cache.hits, cache.misses, _runs(log)) == (1, 1, 1)
+    uncached = _generator(v2, tmp_path)('/src/Counter.cs', lazy=True)
+    assert same_graph(hit.graph(), uncached.graph())
+    assert same_graph(hit.graph(), first.graph())
+    assert any(key == '3' for _, _, key in hit.graph().edges(keys=True))
+
+    # Changing the file changes its key
+    with open(os.path.join(v2, 'src', 'Counter.cs'), 'a') as f:
+        f.write('count = 1;\n')
+    _generator(v2, tmp_path, cache)('/src/Counter.cs', lazy=True)
+    assert (cache.hits, cache.misses, _runs(log)) == (1, 2, 3)
+
+
+def test_identical_files_at_other_paths(checkouts, tmp_path):
+    (v1, _), log = checkouts
+    shutil.copy(os.path.join(v1, 'src', 'Counter.cs'), os.path.join(v1, 'src', 'Copy.cs'))
+    cache = PDG_Cache(str(tmp_path / 'cache'), 1 << 20)
+    _generator(v1, tmp_path, cache)('/src/Counter.cs', lazy=True)
+    # The output names the file, in its clusters and which nameflow locations are in it
+    copy = _generator(v1, tmp_path, cache)('/src/Copy.cs', lazy=True)
+    assert (cache.hits, cache.misses, _runs(log)) == (0, 2, 2)
+    uncached = _generator(v1, tmp_path)('/src/Copy.cs', lazy=True)
+    assert same_graph(copy.graph(), uncached.graph())
+    assert any(key == '3' for _, _, key in copy.graph().edges(keys=True))
+    assert all('Counter.cs' not in data.get('cluster', '') for _, data in copy.graph().nodes(data=True))
+
+
+def test_disabled_cache(checkouts, tmp_path):
+    (v1, _), log = checkouts
+    cache = PDG_Cache(str(tmp_path / 'cache'), 0)
+    for _ in range(2):
+        _generator(v1, tmp_path, cache)('/src/Counter.cs', lazy=True)
+    assert (cache.hits, cache.misses, _runs(log)) == (0, 2, 2)
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = PDG_Cache(str(tmp_path), 1 << 20)
+    pdg = 'x' * 1000
+    for key in ['a0', 'b0', 'c0']:
+        cache.put(key, pdg, None)
+    entry_size = cache.size // 3
+    for i, key in enumerate(['a0', 'b0', 'c0']):
+        os.utime(cache._path(key), ns=(i * 10 ** 9, i * 10 ** 9))
+    assert cache.get('a0') == (pdg, None)
+
+    cache.max_size = int(entry_size * 3.5)
+    cache.put('d0', pdg, None)
+    assert cache.evictions == 1
+    assert cache.get('b0') is None
+    assert all(cache.get(key) == (pdg, None) for key in ['a0', 'c0', 'd0'])
+    assert cache.cache_info().currsize == 3 * entry_size
@@ -0,0 +1,45 @@
+import os
+import random
+
+import networkx as nx
+import pydot
+
+from deltaPDG.Util.pygraph_util import parse_dot, obj_dict_to_networkx, read_graph_from_dot, same_graph, read_back, \
+    write_dot
+
+fixtures = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+def test_parse_dot_matches_pydot():
+    fixture = os.path.join(fixtures, 'extractor_pdg.dot')
+    with open(fixture) as f:
+        text = f.read()
+    reference = obj_dict_to_networkx(pydot.graph_from_dot_data(text)[0].obj_dict)
+    graph = obj_dict_to_networkx(parse_dot(text))
+    assert same_graph(graph, reference)
+    assert same_graph(obj_dict_to_networkx(read_graph_from_dot(fixture)), reference)
+    assert graph.nodes['n3']['cluster'] == 'Demo.Program.Main(string[])'
+    assert graph.nodes['n8']['cluster'] == 'Demo.Program.Greet(string)'
+    assert 'cluster' not in graph.nodes['n0']
+
+
+def _random_id(rng: random.Random) -> str:
+    return ''.join(rng.choice(['q', 'p', '_', '1', '.', '-', ':', ' ', '"', '\\', '\n', '\r', 'é', 'node', 'graph'])
+                   for _ in range(rng.randint(1, 4)))
+
+
+def test_read_back_matches_writing_and_reading(tmp_path):
+    rng = random.Random(3)
+    location = str(tmp_path / 'graph.dot')
+    for _ in range(100):
+        graph = nx.MultiDiGraph()
+        for _ in range(rng.randint(1, 5)):
+            graph.add_node(_random_id(rng), span=_random_id(rng), label=_random_id(rng))
+        # Unquoted IDs ending in a line break, pydot leaves them unquoted but DOT drops the line break
+        graph.add_node('qp\n', span='1-1')
+        graph.add_node('string name = \\"World\\";', span='2-2')
+        nodes = list(graph.nodes)
+        for _ in range(rng.randint(0, 8)):
+            graph.add_edge(rng.choice(nodes), rng.choice(nodes), rng.choice(['0', '1', 3]), label=_random_id(rng))
+        write_dot(graph, location)
+        assert same_graph(read_back(graph), obj_dict_to_networkx(read_graph_from_dot(location)))
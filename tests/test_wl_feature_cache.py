@@ -0,0 +1,46 @@
+import networkx as nx
+import numpy as np
+
+from wl_kernel.wl_feature_cache import WL_Feature_Cache
+
+
+def _graph() -> nx.MultiDiGraph:
+    graph = nx.MultiDiGraph()
+    graph.add_node('a', color='green', community='0')
+    graph.add_node('b', color='red', community='1')
+    graph.add_edge('a', 'b', key='1')
+    return graph
+
+
+def test_round_trip(tmp_path):
+    cache = WL_Feature_Cache(str(tmp_path), 1 << 20)
+    key = cache.key(_graph(), 1)
+    histograms = [(np.asarray([3, 7], dtype=np.uint64), np.asarray([1, 2])),
+                  (np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=np.int64))]
+    assert cache.get(key) is None
+    cache.put(key, histograms, 0.25)
+    stored, seconds = cache.get(key)
+    assert seconds == 0.25
+    assert len(stored) == len(histograms)
+    for (columns, counts), (expected_columns, expected_counts) in zip(stored, histograms):
+        assert np.array_equal(columns, expected_columns) and np.array_equal(counts, expected_counts)
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_key_shared_by_label_configurations(tmp_path):
+    cache = WL_Feature_Cache(str(tmp_path), 1 << 20)
+    # Both label the nodes by their data-flow edges
+    assert cache.key(_graph(), 1, with_data=True, with_call=True) == cache.key(_graph(), 1, with_call=False)
+    assert cache.key(_graph(), 1) != cache.key(_graph(), 1, with_data=False)
+    assert cache.key(_graph(), 1) != cache.key(_graph(), 2)
+
+
+def test_unreadable_entry_is_a_miss(tmp_path):
+    cache = WL_Feature_Cache(str(tmp_path), 1 << 20)
+    key = cache.key(_graph(), 1)
+    cache.put(key, [(np.asarray([1], dtype=np.uint64), np.asarray([1]))], 0.0)
+    for path, _, _ in cache._entries():
+        with open(path, 'wb') as f:
+            f.write(b'not an npz file')
+    assert cache.get(key) is None
+    assert (cache.hits, cache.misses) == (0, 1)
@@ -6,7 +6,9 @@ import sys
 import jsonpickle
 from tqdm import tqdm
 
+from Util.corpus_pack import open_corpus_pack
 from Util.general_util import get_pattern_paths
+from wl_kernel.wl_feature_cache import WL_Feature_Cache, WL_CACHE_LOCATION
 from wl_kernel.wl_kernel_untangle import validate
 
 if __name__ == '__main__':
@@ -14,8 +16,12 @@ if __name__ == '__main__':
     edges_kept = sys.argv[2]
     k_hop = int(sys.argv[3])
     repository_name = sys.argv[4]
+    # Optionally keep the WL features of the graphs (up to this many MB) for the repetitions, later configurations and
+    # later runs. The recorded time still is that of the uncached untangler, see validate.
+    cache = WL_Feature_Cache(WL_CACHE_LOCATION, int(sys.argv[5]) << 20) if len(sys.argv) >= 6 else None
     l = [False, True]
     configs = list(itertools.product(l, repeat=3))[1:]
+    pack = open_corpus_pack(repository_name, check=True)
     for with_data, with_call, with_name in tqdm(configs):
         suffix = ""
         edges_kept = ""
@@ -29,8 +35,6 @@ if __name__ == '__main__':
             suffix += "n"
             edges_kept += "name"
 
-        all_graphs = sorted(
-            get_pattern_paths('*merged.dot', os.path.join('.', 'data', 'corpora_clean', repository_name)))
         try:
             with open('./out/%s/wl_%s_%d_results_%s.csv' % (repository_name, edges_kept, k_hop, suffix)) as f:
                 lines = f.read()
@@ -46,10 +50,21 @@ if __name__ == '__main__':
                 continue
         except FileNotFoundError:
             pass
-        all_graphs = [d for d in all_graphs
-                      if os.path.basename(os.path.dirname(os.path.dirname(d))) not in datapoints_done]
+        if pack is not None:
+            all_graphs = pack.paths(exclude=datapoints_done)
+        else:
+            all_graphs = sorted(
+                get_pattern_paths('*merged.dot', os.path.join('.', 'data', 'corpora_clean', repository_name)))
+            all_graphs = [d for d in all_graphs
+                          if os.path.basename(os.path.dirname(os.path.dirname(d))) not in datapoints_done]
         random.shuffle(all_graphs)
         if len(all_graphs) > 0:
-            validate(all_graphs, times, k_hop, repository_name, edges_kept=edges_kept, suffix=suffix)
+            # The cache holds the features of the numpy backend
+            validate(all_graphs, times, k_hop, repository_name, edges_kept=edges_kept, suffix=suffix, pack=pack,
+                     backend='grakel' if cache is None else 'numpy', cache=cache)
             with open('./out/%s/wl_%s_%d_results_%s.json' % (repository_name, edges_kept, k_hop, suffix), 'w') as f:
                 f.write(jsonpickle.encode({'done'}))
+    if cache is not None:
+        cache_info = cache.cache_info()
+        print('WL feature cache: %d hits, %d misses (%.1f%% hit rate), %d evictions'
+              % (cache_info.hits, cache_info.misses, 100 * cache.hit_rate(), cache_info.evictions))
@@ -0,0 +1,71 @@
+import hashlib
+import zipfile
+from typing import List, Optional, Tuple
+
+import networkx as nx
+import numpy as np
+
+from deltaPDG.Util.lru_file_store import LRU_File_Store
+from wl_kernel.wl_subtree import label_edge_type
+
+WL_CACHE_LOCATION = './data/wl_cache'
+# Bump whenever the labels of wl_subtree_histograms or the entries change, so that older entries are no longer hit
+FEATURE_VERSION = 2
+
+
+def graph_content_hash(graph: nx.MultiDiGraph) -> str:
+    """
+    :return: The sha1 of everything the WL features of a deltaPDG's seed subgraphs depend on: the nodes in graph
+             order with the colour and community that make them seeds, and the edges with their keys
+    """
+    sha = hashlib.sha1()
+    for node, data in graph.nodes(data=True):
+        sha.update(('%r\0%r\0%r\n' % (node, data.get('color'), data.get('community'))).encode('utf-8', 'replace'))
+    sha.update(b'\1')
+    for u, v, key in graph.edges(keys=True):
+        sha.update(('%r\0%r\0%r\n' % (u, v, key)).encode('utf-8', 'replace'))
+    return sha.hexdigest()
+
+
+class WL_Feature_Cache(LRU_File_Store):
+    """
+    Store of the hashed WL subtree histograms (see wl_subtree_histograms) of the seed subgraphs of deltaPDGs, one
+    .npz file per deltaPDG, k_hop, label configuration and n_iter, so that repeated runs over the same graphs only pay
+    for clustering. Entries also hold the time computing the histograms took, for timings that leave out the cache.
+    Eviction is that of LRU_File_Store: least recently used first, by file mtime.
+    """
+    suffix = '.npz'
+    read_errors = (OSError, ValueError, KeyError, zipfile.BadZipFile)
+
+    @staticmethod
+    def key(graph: nx.MultiDiGraph, k_hop: int, with_data: bool = True, with_call: bool = True,
+            with_name: bool = True, n_iter: int = 10) -> str:
+        """
+        Label configurations that label the nodes alike, i.e. select the same edge type, share their entries
+        """
+        return hashlib.sha1(('%d\0%s\0%d\0%r\0%d' % (FEATURE_VERSION, graph_content_hash(graph), k_hop,
+                                                     label_edge_type(with_data, with_call, with_name),
+                                                     n_iter)).encode('ascii')).hexdigest()
+
+    def get(self, key: str) -> Optional[Tuple[List[Tuple[np.ndarray, np.ndarray]], float]]:
+        """
+        :return: The stored histograms, in seed order, and the seconds computing them took, None on a miss
+        """
+        return self._load(key, _read_histograms)
+
+    def put(self, key: str, histograms: List[Tuple[np.ndarray, np.ndarray]], seconds: float):
+        def write(path: str):
+            with open(path, 'wb') as f:
+                np.savez(f, offsets=np.cumsum([0] + [len(columns) for columns, _ in histograms]),
+                         columns=np.concatenate([columns for columns, _ in histograms] + [np.zeros(0, np.uint64)]),
+                         counts=np.concatenate([counts for _, counts in histograms] + [np.zeros(0, np.int64)]),
+                         seconds=np.asarray(seconds, dtype=np.float64))
+
+        self._store(key, write)
+
+
+def _read_histograms(path: str) -> Tuple[List[Tuple[np.ndarray, np.ndarray]], float]:
+    with np.load(path) as entry:
+        offsets, columns, counts, seconds = entry['offsets'], entry['columns'], entry['counts'], entry['seconds']
+    return [(columns[offsets[i]:offsets[i + 1]], counts[offsets[i]:offsets[i + 1]])
+            for i in range(len(offsets) - 1)], float(seconds)
@@ -1,15 +1,13 @@
-import itertools
 import os
 import re
 import time
-from collections import defaultdict
-from multiprocessing.pool import ThreadPool
 from threading import Thread
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 
 import networkx as nx
 import numpy as np
 import scipy
+import scipy.sparse
 from grakel import GraphKernel
 from nltk import casual_tokenize
 from nltk.stem import PorterStemmer
@@ -18,7 +16,19 @@ from tqdm import tqdm
 
 from Util.evaluation import evaluate
 from confidence_voters.confidence_voters import remove_all_except
-from deltaPDG.Util.pygraph_util import obj_dict_to_networkx, read_graph_from_dot
+from deltaPDG.Util.pygraph_util import read_networkx_from_dot, write_dot
+from wl_kernel.wl_feature_cache import WL_Feature_Cache
+from wl_kernel.wl_lsh import LSH_BANDS, LSH_BAND_SIZE, approximate_clusters, distinct_histograms
+from wl_kernel.wl_subtree import wl_subtree_features, wl_subtree_kernel, wl_subtree_histograms, \
+    histograms_to_features
+
+# grakel's GraphKernel, or the WL subtree implementation in wl_subtree
+WL_BACKENDS = ['grakel', 'numpy']
+WL_ITERATIONS = 10
+# Seeds whose k-hop subgraphs are at least this far apart (1 - similarity) are not clustered together
+DISTANCE_THRESHOLD = 0.5
+# The approximate mode clusters up to this many distinct seed subgraphs exactly, O(n^2) in time and memory
+MAX_EXACT_SEEDS = 4000
 
 
 def split_camel_case(input: str) -> List[str]:
@@ -40,36 +50,239 @@ def process_line_of_code(line: str) -> str:
 
 
 def graph_to_grakel(g: nx.MultiDiGraph, with_data: bool = True, with_call: bool = True, with_name: bool = True):
-    nodelst = [n for n in g.nodes]
+    index = {n: i for i, n in enumerate(g.nodes)}
     adj = nx.adjacency_matrix(g)
-    node_labels = {nodelst.index(n):
+    # The types of the edges leaving each node and the edge labels, in a single pass over the edges
+    out_keys = [set() for _ in index]
+    edge_labels = dict()
+    for fro, to, type_of_edge in g.edges(keys=True):
+        out_keys[index[fro]].add(type_of_edge)
+        edge_labels[(index[fro], index[to])] = int(type_of_edge)
+    node_labels = {i:
                    # ('1' if "color" in g.nodes[n].keys() else '0')
-                       ('1' if any([k == 1 for u, v, k in g.edges(nbunch=[n], keys=True)]) else '0')
+                       ('1' if 1 in keys else '0')
                        if with_data else ""  # data-flow
-                                         + ('1' if any([k == 2 for u, v, k in g.edges(nbunch=[n], keys=True)]) else '0')
+                                         + ('1' if 2 in keys else '0')
                        if with_call else ""  # call-graph
-                                         + ('1' if any([k == 3 for u, v, k in g.edges(nbunch=[n], keys=True)]) else '0')
+                                         + ('1' if 3 in keys else '0')
                        if with_name else ""  # name-flow
-                   for n in g.nodes}
-    edge_labels = {(nodelst.index(fro), nodelst.index(to)): int(type_of_edge) for fro, to, type_of_edge in g.edges}
+                   for i, keys in enumerate(out_keys)}
     return adj, node_labels, edge_labels
 
 
+def k_hop_subgraphs(graph: nx.MultiDiGraph, sources: List[str], k: int) -> List[nx.MultiDiGraph]:
+    """
+    Extract the k-hop neighbourhood (following edge direction) of every source at once. The frontiers of all sources
+    are expanded together over a sparse adjacency matrix, and each neighbourhood's edges are picked from the edges
+    of its nodes grouped by source.
+    :return: Per source, the subgraph induced by the nodes nx.single_source_shortest_path_length(graph, source,
+             cutoff=k) reaches, as a graph of its own with copies of the node and edge data
+    """
+    nodes = list(graph.nodes(data=True))
+    index = {n: i for i, (n, _) in enumerate(nodes)}
+    edges = list(graph.edges(keys=True, data=True))
+    sources_of = np.asarray([index[u] for u, _, _, _ in edges], dtype=np.int64)
+    targets_of = np.asarray([index[v] for _, v, _, _ in edges], dtype=np.int64)
+    n = len(nodes)
+    adjacency = scipy.sparse.csr_matrix((np.ones(len(edges), dtype=np.int32), (sources_of, targets_of)), shape=(n, n))
+    # Edge ids grouped by source node, in graph order within each group
+    by_source = np.argsort(sources_of, kind='stable')
+    out_ptr = np.concatenate([[0], np.cumsum(np.bincount(sources_of, minlength=n))])
+
+    reached = scipy.sparse.csr_matrix((np.ones(len(sources), dtype=np.int32),
+                                       (np.arange(len(sources)), [index[s] for s in sources])), shape=(len(sources), n))
+    frontier = reached
+    for _ in range(k):
+        frontier = frontier @ adjacency
+        # Only whether a node was reached matters, not the number of paths to it
+        frontier.data[:] = 1
+        frontier = frontier - frontier.multiply(reached)
+        frontier.eliminate_zeros()
+        if frontier.nnz == 0:
+            break
+        reached = reached + frontier
+    reached.sort_indices()
+
+    subgraphs = list()
+    member = np.zeros(n, dtype=bool)
+    for i in range(len(sources)):
+        members = reached.indices[reached.indptr[i]:reached.indptr[i + 1]]
+        member[members] = True
+        counts = out_ptr[members + 1] - out_ptr[members]
+        positions = np.repeat(out_ptr[members] - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        edge_ids = by_source[positions]
+        edge_ids = np.sort(edge_ids[member[targets_of[edge_ids]]])
+        member[members] = False
+
+        subgraph = graph.__class__()
+        subgraph.graph.update(graph.graph)
+        subgraph.add_nodes_from(nodes[j] for j in members)
+        for e in edge_ids:
+            # add_edge rather than add_edges_from, which goes through adjacency views for every edge
+            u, v, key, data = edges[e]
+            subgraph.add_edge(u, v, key, **data)
+        subgraphs.append(subgraph)
+    return subgraphs
+
+
 def deltaPDG_to_list_of_Graphs(delta: nx.MultiDiGraph, khop_k: int = 1) -> Tuple[List[str], List[nx.MultiDiGraph]]:
-    seeds = [n for n, d in delta.nodes(data=True)
-             if 'color' in d.keys() and d['color'] != 'orange' and 'community' in d.keys()]
-    result = list()
-    with ThreadPool(processes=min(os.cpu_count() - 1, 12)) as wp:
-        for subgraph in wp.imap_unordered(lambda s:
-                                          delta.subgraph(
-                                              nx.single_source_shortest_path_length(delta, s, cutoff=khop_k).keys()),
-                                          seeds):
-            result.append(subgraph)
-    return seeds, result
+    """
+    :return: The seeds (changed nodes with a community) and, in the same order, their k-hop neighbourhoods as graphs
+             of their own, rather than views holding on to delta
+    """
+    seeds = _seeds(delta)
+    return seeds, k_hop_subgraphs(delta, seeds, khop_k)
+
+
+def _seeds(delta: nx.MultiDiGraph) -> List[str]:
+    return [n for n, d in delta.nodes(data=True)
+            if 'color' in d.keys() and d['color'] != 'orange' and 'community' in d.keys()]
+
+
+def wl_similarities(list_of_graphs: List[nx.MultiDiGraph], with_data: bool = True, with_call: bool = True,
+                    with_name: bool = True, backend: str = 'grakel') -> np.ndarray:
+    """
+    Compute the normalised WL subtree kernel between all k-hop subgraphs at once. A single fit_transform labels
+    every graph in one go, which gives the same similarities as fitting on one graph and transforming the other
+    for each pair, without refitting the kernel O(n^2) times.
+    :param backend: One of WL_BACKENDS, both give the same similarities
+    :return: The n x n similarity matrix, in the order of list_of_graphs
+    """
+    if backend == 'numpy':
+        return wl_subtree_kernel(wl_subtree_features(list_of_graphs, WL_ITERATIONS, with_data, with_call, with_name))
+    elif backend != 'grakel':
+        raise ValueError('Unknown WL backend %s, expected one of %s' % (backend, ', '.join(WL_BACKENDS)))
+    wl_subtree = GraphKernel(kernel=[{"name": "weisfeiler_lehman", "n_iter": WL_ITERATIONS}, {"name": "subtree_wl"}],
+                             normalize=True)
+    # The graphs have to be converted to {Graph, Node_Labels, Edge_Labels}
+    return wl_subtree.fit_transform([graph_to_grakel(g, with_data, with_call, with_name) for g in list_of_graphs])
+
+
+def seed_histograms(graph: nx.MultiDiGraph, k_hop: int, with_data: bool = True, with_call: bool = True,
+                    with_name: bool = True, cache: WL_Feature_Cache = None) \
+        -> Tuple[List[str], List[Tuple[np.ndarray, np.ndarray]], float]:
+    """
+    :param cache: Where to look up (and store) the histograms, None to always compute them
+    :return: The seeds of a deltaPDG, in the same order the wl_subtree_histograms of their k-hop subgraphs, and the
+             seconds computing these took. On a cache hit that is the time it took when they were computed.
+    """
+    seeds = _seeds(graph)
+    key = cache.key(graph, k_hop, with_data, with_call, with_name, WL_ITERATIONS) if cache is not None else None
+    cached = cache.get(key) if key is not None else None
+    if cached is not None:
+        histograms, seconds = cached
+    else:
+        t0 = time.perf_counter()
+        histograms = wl_subtree_histograms(k_hop_subgraphs(graph, seeds, k_hop), WL_ITERATIONS, with_data, with_call,
+                                           with_name)
+        seconds = time.perf_counter() - t0
+        if key is not None:
+            cache.put(key, histograms, seconds)
+    return seeds, histograms, seconds
+
+
+def seed_similarities(graph: nx.MultiDiGraph, k_hop: int, with_data: bool = True, with_call: bool = True,
+                      with_name: bool = True, backend: str = 'grakel', cache: WL_Feature_Cache = None) \
+        -> Tuple[List[str], Optional[np.ndarray]]:
+    """
+    Compute the similarities between the k-hop subgraphs of all seeds of a deltaPDG
+    :param cache: Where to look up (and store) the WL features of the subgraphs. It holds the hashed features of
+                  wl_subtree_histograms, so it can only be used with the numpy backend.
+    :return: The seeds and their similarity matrix, None if there are no seeds
+    """
+    if cache is not None and backend != 'numpy':
+        raise ValueError('A WL feature cache holds numpy backend features, it can not be used with backend %s'
+                         % backend)
+    if cache is None:
+        seeds, list_of_graphs = deltaPDG_to_list_of_Graphs(graph, khop_k=k_hop)
+        if len(list_of_graphs) == 0:
+            return seeds, None
+        return seeds, wl_similarities(list_of_graphs, with_data, with_call, with_name, backend)
+
+    seeds, histograms, _ = seed_histograms(graph, k_hop, with_data, with_call, with_name, cache)
+    if len(seeds) == 0:
+        return seeds, None
+    return seeds, wl_subtree_kernel(histograms_to_features(histograms))
+
+
+def complete_linkage(similarities: np.ndarray) -> np.ndarray:
+    """
+    :return: The clusters of complete linkage on 1 - similarities, cut at DISTANCE_THRESHOLD
+    """
+    # Condensed in itertools.combinations(range(n), 2) order, as squareform expects
+    affinity = 1 - similarities[np.triu_indices(len(similarities), k=1)]  # affinity is distance! so (1 - sim)
+
+    cluster = AgglomerativeClustering(n_clusters=None, distance_threshold=DISTANCE_THRESHOLD,
+                                      affinity='precomputed',
+                                      linkage='complete')
+    if len(affinity) < 2:
+        if len(affinity) == 1:
+            labels = np.asarray([0, 0]) if affinity[0] <= DISTANCE_THRESHOLD else np.asarray([0, 1])
+        else:
+            labels = np.asarray([0])
+    else:
+        labels = cluster.fit_predict(scipy.spatial.distance.squareform(affinity))
+    return labels
+
+
+def cluster_seeds(graph: nx.MultiDiGraph, k_hop: int, with_data: bool = True, with_call: bool = True,
+                  with_name: bool = True, backend: str = 'grakel', cache: WL_Feature_Cache = None,
+                  approximate: bool = False, max_exact: int = MAX_EXACT_SEEDS, n_bands: int = LSH_BANDS,
+                  band_size: int = LSH_BAND_SIZE) -> Tuple[List[str], Optional[np.ndarray]]:
+    """
+    Cluster the seeds of a deltaPDG by the WL similarity of their k-hop subgraphs, with complete linkage
+    :param approximate: Whether to scale to deltaPDGs with too many seeds for the O(n^2) time and memory of
+                        clustering over the full similarity matrix. Seeds with the same features are clustered as
+                        one, which leaves the clusters as they are up to ties. Beyond max_exact distinct seeds the
+                        clusters are those of approximate_clusters. The features are those of
+                        wl_subtree_histograms, whichever the backend.
+    :param max_exact: The number of distinct seeds the approximate mode still clusters exactly, 0 to always
+                      approximate
+    :param n_bands: The number of LSH bands of approximate_clusters, more find more of the similar seeds
+    :param band_size: The number of MinHash values per LSH band, fewer find more of the similar seeds
+    :return: The seeds and their cluster labels, None if there are no seeds
+    """
+    if not approximate:
+        seeds, similarities = seed_similarities(graph, k_hop, with_data, with_call, with_name, backend, cache)
+        return seeds, complete_linkage(similarities) if similarities is not None else None
+
+    seeds, histograms, _ = seed_histograms(graph, k_hop, with_data, with_call, with_name, cache)
+    if len(seeds) == 0:
+        return seeds, None
+    return seeds, cluster_histograms(histograms, approximate, max_exact, n_bands, band_size)
+
+
+def cluster_histograms(histograms: List[Tuple[np.ndarray, np.ndarray]], approximate: bool = False,
+                       max_exact: int = MAX_EXACT_SEEDS, n_bands: int = LSH_BANDS,
+                       band_size: int = LSH_BAND_SIZE) -> np.ndarray:
+    """
+    Cluster seeds by the wl_subtree_histograms of their k-hop subgraphs, see cluster_seeds for the parameters
+    :return: The cluster labels, in the order of histograms
+    """
+    if not approximate:
+        return complete_linkage(wl_subtree_kernel(histograms_to_features(histograms)))
+    histograms, inverse = distinct_histograms(histograms)
+    if len(histograms) > max_exact:
+        labels = approximate_clusters(histograms, DISTANCE_THRESHOLD, n_bands, band_size)
+    else:
+        labels = complete_linkage(wl_subtree_kernel(histograms_to_features(histograms)))
+    return labels[inverse]
 
 
 def validate(files: List[str], times, k_hop, repository_name, edges_kept="all",
-             with_data: bool = True, with_call: bool = True, with_name: bool = True, suffix="raw"):
+             with_data: bool = True, with_call: bool = True, with_name: bool = True, suffix="raw", pack=None,
+             backend: str = 'grakel', cache: WL_Feature_Cache = None, approximate: bool = False,
+             max_exact: int = MAX_EXACT_SEEDS, n_bands: int = LSH_BANDS, band_size: int = LSH_BAND_SIZE):
+    """
+    Untangle every deltaPDG times over and record the accuracy, overlap and mean time per deltaPDG
+    :param cache: Where to look up (and store) the WL features of the deltaPDGs, as cluster_seeds does with the numpy
+                  backend. The features are then computed once, rather than on every repetition, and only the
+                  clustering is repeated. The time recorded still is that of the uncached untangler: the time
+                  computing the features took, as measured when they were computed, plus that of the clustering.
+    """
+    if cache is not None and backend != 'numpy' and not approximate:
+        raise ValueError('A WL feature cache holds numpy backend features, it can not be used with backend %s'
+                         % backend)
     n_workers = 1
     chunk_size = int(len(files) / n_workers)
     while (chunk_size == 0) and (n_workers > 1):
@@ -81,55 +294,37 @@ def validate(files: List[str], times, k_hop, repository_name, edges_kept="all",
         for graph_location in tqdm(work, leave=False):
             chain = os.path.basename(os.path.dirname(os.path.dirname(graph_location)))
             q = int(os.path.basename(os.path.dirname(graph_location)))
-            graph = obj_dict_to_networkx(read_graph_from_dot(graph_location))
+            graph = read_networkx_from_dot(graph_location) if pack is None else pack.load(graph_location)
             graph = remove_all_except(graph, edges_kept)
 
             if len(graph.nodes) == 0:
                 continue
 
-            t0 = time.perf_counter()
-            for i in range(times):
-                seeds, list_of_graphs = deltaPDG_to_list_of_Graphs(graph, khop_k=k_hop)
-                wl_subtree = GraphKernel(kernel=[{"name": "weisfeiler_lehman", "n_iter": 10}, {"name": "subtree_wl"}],
-                                         normalize=True)
-                if len(list_of_graphs) > 0:
-                    similarities = defaultdict(lambda: (0, 0.0))
-                    for g1, g2 in itertools.combinations(list_of_graphs, 2):
-                        # The graph has to be converted to {Graph, Node_Labels, Edge_Labels}
-                        wl_subtree.fit([graph_to_grakel(g1, with_data, with_call, with_name)])
-                        similarity = wl_subtree.transform([graph_to_grakel(g2, with_data, with_call, with_name)])[0][0]
-                        similarities[(list_of_graphs.index(g1), list_of_graphs.index(g2))] = similarity
-
-                    n = len(list_of_graphs)
-                    affinity = np.zeros(shape=(scipy.special.comb(n, 2, exact=True),))
-                    args = list(enumerate(itertools.combinations(range(n), 2)))
-                    with ThreadPool(processes=min(os.cpu_count() - 1, 1)) as wp:
-                        for k, value in wp.imap_unordered(lambda i: (i[0], similarities[(i[-1][0], i[-1][1])]),
-                                                          args):
-                            affinity[k] += (1 - value)  # affinity is distance! so (1 - sim)
-
-                    cluster = AgglomerativeClustering(n_clusters=None, distance_threshold=0.5,
-                                                      affinity='precomputed',
-                                                      linkage='complete')
-                    if len(affinity) < 2:
-                        if len(affinity) == 1:
-                            labels = np.asarray([0, 0]) if affinity[0] <= 0.5 else np.asarray([0, 1])
-                        else:
-                            labels = np.asarray([0])
-                    else:
-                        labels = cluster.fit_predict(scipy.spatial.distance.squareform(affinity))
-                else:
-                    labels = None
-            t1 = time.perf_counter()
-            time_ = (t1 - t0) / times
-
+            if cache is None:
+                t0 = time.perf_counter()
+                for i in range(times):
+                    seeds, labels = cluster_seeds(graph, k_hop, with_data, with_call, with_name, backend, None,
+                                                  approximate, max_exact, n_bands, band_size)
+                t1 = time.perf_counter()
+                time_ = (t1 - t0) / times
+            else:
+                seeds, histograms, feature_time = seed_histograms(graph, k_hop, with_data, with_call, with_name,
+                                                                  cache)
+                t0 = time.perf_counter()
+                for i in range(times):
+                    labels = cluster_histograms(histograms, approximate, max_exact, n_bands, band_size) \
+                        if len(seeds) > 0 else None
+                t1 = time.perf_counter()
+                time_ = feature_time + (t1 - t0) / times
+
+            position = {seed: i for i, seed in enumerate(seeds)}
             truth = list()
             label = list()
             for node, data in graph.nodes(data=True):
                 if 'color' in data.keys():
                     if 'community' in data.keys():
                         truth.append(int(data['community']))
-                        i = seeds.index(node) if node in seeds else -1
+                        i = position.get(node, -1)
 
                         if labels is not None and i != -1:
                             data['label'] = '%d: ' % labels[i] + data['label']
@@ -140,7 +335,7 @@ def validate(files: List[str], times, k_hop, repository_name, edges_kept="all",
                             label.append(-1)
                             graph.add_node(node, **data)
 
-            nx.drawing.nx_pydot.write_dot(graph, graph_location[:-4] + '_output_wl_%d.dot' % k_hop)
+            write_dot(graph, graph_location[:-4] + '_output_wl_%d.dot' % k_hop)
 
             truth = np.asarray(truth)
             label = np.asarray(label)
@@ -158,43 +353,21 @@ def validate(files: List[str], times, k_hop, repository_name, edges_kept="all",
         t.join()
 
 
-def untangle(graph, k_hop, with_data: bool = True, with_call: bool = True, with_name: bool = True):
-    seeds, list_of_graphs = deltaPDG_to_list_of_Graphs(graph, khop_k=k_hop)
-    wl_subtree = GraphKernel(kernel=[{"name": "weisfeiler_lehman", "n_iter": 10}, {"name": "subtree_wl"}],
-                             normalize=True)
-    if len(list_of_graphs) > 0:
-        similarities = defaultdict(lambda: (0, 0.0))
-        for g1, g2 in itertools.combinations(list_of_graphs, 2):
-            # The graph has to be converted to {Graph, Node_Labels, Edge_Labels}
-            wl_subtree.fit([graph_to_grakel(g1, with_data, with_call, with_name)])
-            similarity = wl_subtree.transform([graph_to_grakel(g2, with_data, with_call, with_name)])[0][0]
-            similarities[(list_of_graphs.index(g1), list_of_graphs.index(g2))] = similarity
-
-        n = len(list_of_graphs)
-        affinity = np.zeros(shape=(scipy.special.comb(n, 2, exact=True),))
-        args = list(enumerate(itertools.combinations(range(n), 2)))
-        with ThreadPool(processes=min(os.cpu_count() - 1, 1)) as wp:
-            for k, value in wp.imap_unordered(lambda i: (i[0], similarities[(i[-1][0], i[-1][1])]),
-                                              args):
-                affinity[k] += (1 - value)  # affinity is distance! so (1 - sim)
-
-        cluster = AgglomerativeClustering(n_clusters=None, distance_threshold=0.5,
-                                          affinity='precomputed',
-                                          linkage='complete')
-        if len(affinity) < 2:
-            if len(affinity) == 1:
-                labels = np.asarray([0, 0]) if affinity[0] <= 0.5 else np.asarray([0, 1])
-            else:
-                labels = np.asarray([0])
-        else:
-            labels = cluster.fit_predict(scipy.spatial.distance.squareform(affinity))
-    else:
-        labels = None
+def untangle(graph, k_hop, with_data: bool = True, with_call: bool = True, with_name: bool = True,
+             backend: str = 'grakel', cache: WL_Feature_Cache = None, approximate: bool = False,
+             max_exact: int = MAX_EXACT_SEEDS, n_bands: int = LSH_BANDS, band_size: int = LSH_BAND_SIZE):
+    """
+    :param approximate: Whether to cluster in the approximate mode of cluster_seeds, see there for max_exact,
+                        n_bands and band_size
+    """
+    seeds, labels = cluster_seeds(graph, k_hop, with_data, with_call, with_name, backend, cache, approximate,
+                                  max_exact, n_bands, band_size)
 
+    position = {seed: i for i, seed in enumerate(seeds)}
     label = list()
     for node, data in graph.nodes(data=True):
         if 'color' in data.keys():
-            i = seeds.index(node) if node in seeds else -1
+            i = position.get(node, -1)
 
             if labels is not None and i != -1:
                 data['label'] = '%d: ' % labels[i] + data['label']
@@ -0,0 +1,200 @@
+import heapq
+from typing import List, Tuple
+
+import numpy as np
+import scipy.sparse
+
+from wl_kernel.wl_subtree import _mix, _seed, histograms_to_features
+
+# The default accuracy/speed tradeoff of approximate_clusters: n_bands bands of band_size MinHash values each
+LSH_BANDS = 32
+LSH_BAND_SIZE = 4
+# The number of graphs each graph is paired with per LSH bucket, and at random
+LSH_WINDOW = 8
+RANDOM_PARTNERS = 16
+# Bounds the temporaries of the vectorised steps, in array entries
+_chunk_entries = 1 << 22
+
+
+def distinct_histograms(histograms: List[Tuple[np.ndarray, np.ndarray]]) \
+        -> Tuple[List[Tuple[np.ndarray, np.ndarray]], np.ndarray]:
+    """
+    :return: The distinct histograms, in order of first occurrence, and the index of every histogram among them
+    """
+    index = dict()
+    inverse = np.asarray([index.setdefault((columns.tobytes(), counts.tobytes()), len(index))
+                          for columns, counts in histograms], dtype=np.int64)
+    return [histograms[i] for i in np.unique(inverse, return_index=True)[1]], inverse
+
+
+def minhash_signatures(histograms: List[Tuple[np.ndarray, np.ndarray]], n_perm: int) -> np.ndarray:
+    """
+    MinHash the label sets of WL histograms: the j-th value of a signature is the smallest of the graph's hashed
+    labels under the j-th of n_perm random hash functions, two signatures agree on it with probability the
+    Jaccard similarity of the label sets
+    :param histograms: Per graph, its distinct hashed labels and their counts, as wl_subtree_histograms returns them;
+                       every graph has at least one label
+    :return: One row of n_perm uint64 values per graph
+    """
+    columns = np.concatenate([columns for columns, _ in histograms])
+    starts = np.cumsum([0] + [len(columns) for columns, _ in histograms[:-1]])
+    salts = np.random.default_rng(_seed).integers(0, np.iinfo(np.uint64).max, size=n_perm, dtype=np.uint64,
+                                                  endpoint=True)
+    signatures = np.empty((len(histograms), n_perm), dtype=np.uint64)
+    step = max(1, _chunk_entries // max(1, len(columns)))
+    for j in range(0, n_perm, step):
+        signatures[:, j:j + step] = np.minimum.reduceat(_mix(columns[:, None] ^ salts[None, j:j + step]), starts,
+                                                        axis=0)
+    return signatures
+
+
+def lsh_candidate_pairs(signatures: np.ndarray, band_size: int, window: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Locality sensitive hashing of MinHash signatures: the signatures are cut into bands of band_size values and
+    graphs whose signatures agree on all values of a band share its bucket. Graphs with Jaccard similarity s share
+    at least one bucket with probability 1 - (1 - s^band_size)^n_bands. Rather than pairing everything in a bucket,
+    which is quadratic in its size, every graph is paired with the next window graphs of the bucket in an order
+    that differs from band to band.
+    :return: The candidate pairs (i, j), i < j, each once, sorted
+    """
+    n, n_perm = signatures.shape
+    indices = np.arange(n, dtype=np.uint64)
+    codes = [np.zeros(0, dtype=np.int64)]
+    for band in range(0, n_perm - band_size + 1, band_size):
+        keys = np.zeros(n, dtype=np.uint64)
+        for j in range(band, band + band_size):
+            keys = _mix(keys ^ signatures[:, j])
+        order = np.lexsort((_mix(indices ^ keys), keys))
+        keys = keys[order]
+        for offset in range(1, min(window, n - 1) + 1):
+            same = np.flatnonzero(keys[offset:] == keys[:-offset])
+            i, j = order[same], order[same + offset]
+            codes.append(np.minimum(i, j) * n + np.maximum(i, j))
+    codes = np.unique(np.concatenate(codes))
+    return codes // n, codes % n
+
+
+def random_pairs(n: int, partners: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    :return: Pairs (i, j), i < j, pairing each of n graphs with partners others at random, each pair once, sorted
+    """
+    if n < 2:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    i = np.repeat(np.arange(n), partners)
+    j = np.random.default_rng(_seed).integers(0, n - 1, size=len(i))
+    j[j >= i] += 1
+    codes = np.unique(np.minimum(i, j) * n + np.maximum(i, j))
+    return codes // n, codes % n
+
+
+def pair_similarities(features: scipy.sparse.csr_matrix, rows: np.ndarray, cols: np.ndarray) -> np.ndarray:
+    """
+    :return: For every pair (rows[i], cols[i]), the entry of the normalised kernel matrix wl_subtree_kernel would
+             compute from the same features, without computing the others
+    """
+    diagonal = np.asarray(features.multiply(features).sum(axis=1)).reshape(-1)
+    similarities = np.empty(len(rows), dtype=np.float64)
+    step = max(1, _chunk_entries // max(1, features.nnz // max(1, features.shape[0])))
+    for s in range(0, len(rows), step):
+        r, c = rows[s:s + step], cols[s:s + step]
+        products = np.asarray(features[r].multiply(features[c]).sum(axis=1)).reshape(-1)
+        similarities[s:s + step] = products / np.sqrt(diagonal[r] * diagonal[c])
+    return similarities
+
+
+def sparse_complete_linkage(n: int, rows: np.ndarray, cols: np.ndarray, distances: np.ndarray,
+                            threshold: float) -> np.ndarray:
+    """
+    Connectivity constrained complete linkage clustering, cut at threshold: only clusters joined by an edge of the
+    sparse distance graph are merged, and the distance between clusters is the largest distance of the edges
+    between them, as AgglomerativeClustering(linkage='complete', connectivity=...) computes it. With an edge for
+    every pair the clusters are those of complete linkage on the full distance matrix, up to ties.
+    :param rows, cols, distances: The edges (rows[i], cols[i]) and their distances
+    :return: The cluster of every element, numbered from 0 in order of first element
+    """
+    # links[a][b] holds the distance between clusters a and b, over the edges between them
+    links = [dict() for _ in range(n)]
+    heap = list()
+    for i, j, distance in zip(rows.tolist(), cols.tolist(), distances.tolist()):
+        links[i][j] = links[j][i] = distance
+        if distance < threshold:
+            heap.append((distance, i, j))
+    heapq.heapify(heap)
+    members = [[i] for i in range(n)]
+    cluster_of = np.arange(n)
+
+    while len(heap) > 0:
+        distance, a, b = heapq.heappop(heap)
+        # Skip entries made stale by earlier merges
+        if links[a].get(b) != distance:
+            continue
+        if len(members[a]) < len(members[b]):
+            a, b = b, a
+        # Only the distances to b's neighbours change, merging the smaller cluster keeps the updates few
+        for c, maximum in links[b].items():
+            del links[c][b]
+            if c != a:
+                maximum = max(maximum, links[a].get(c, maximum))
+                links[a][c] = links[c][a] = maximum
+                if maximum < threshold:
+                    heapq.heappush(heap, (maximum, min(a, c), max(a, c)))
+        links[b] = dict()
+        cluster_of[members[b]] = a
+        members[a].extend(members[b])
+        members[b] = list()
+
+    _, first, inverse = np.unique(cluster_of, return_index=True, return_inverse=True)
+    return np.argsort(np.argsort(first))[inverse.reshape(-1)]
+
+
+def approximate_clusters(histograms: List[Tuple[np.ndarray, np.ndarray]], threshold: float,
+                         n_bands: int = LSH_BANDS, band_size: int = LSH_BAND_SIZE) -> np.ndarray:
+    """
+    Cluster graphs by their WL features, approximating complete linkage on 1 - the normalised WL kernel with
+    O(n * (n_bands * LSH_WINDOW + RANDOM_PARTNERS)) kernel values rather than the O(n^2) of the full kernel and
+    distance matrices. MinHash/LSH over the label sets pairs up graphs that are likely close, random pairs add
+    some of the far ones that keep clusters apart, and the resulting sparse distance graph constrains
+    sparse_complete_linkage. More bands, or smaller ones, see more of the close pairs at a higher cost.
+    :param histograms: Per graph, as wl_subtree_histograms returns them
+    :return: The cluster of every graph
+    """
+    n = len(histograms)
+    rows, cols = lsh_candidate_pairs(minhash_signatures(histograms, n_bands * band_size), band_size, LSH_WINDOW)
+    random_rows, random_cols = random_pairs(n, RANDOM_PARTNERS)
+    codes = np.unique(np.concatenate([rows * n + cols, random_rows * n + random_cols]))
+    rows, cols = codes // n, codes % n
+    distances = 1 - pair_similarities(histograms_to_features(histograms), rows, cols)
+    return sparse_complete_linkage(n, rows, cols, distances, threshold)
+
+
+if __name__ == '__main__':
+    import sys
+    import time
+
+    from sklearn.metrics import adjusted_rand_score
+
+    from Util.general_util import get_pattern_paths
+    from deltaPDG.Util.pygraph_util import read_networkx_from_dot
+    from wl_kernel.wl_kernel_untangle import cluster_seeds
+
+    # Validate the approximate mode against the exact one on a corpus, e.g. ./data/corpora_clean/<repository>
+    k_hop = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    agreements = list()
+    for location in sorted(get_pattern_paths('*merged.dot', sys.argv[1])):
+        graph = read_networkx_from_dot(location)
+        t0 = time.perf_counter()
+        seeds, exact = cluster_seeds(graph, k_hop, backend='numpy')
+        t1 = time.perf_counter()
+        _, deduplicated = cluster_seeds(graph, k_hop, approximate=True)
+        t2 = time.perf_counter()
+        # Force LSH whatever the number of seeds
+        _, approximate = cluster_seeds(graph, k_hop, approximate=True, max_exact=0)
+        t3 = time.perf_counter()
+        if exact is None:
+            continue
+        agreements.append((adjusted_rand_score(exact, deduplicated), adjusted_rand_score(exact, approximate)))
+        print('%s: %d seeds, exact %.3fs, approximate %.3fs (adjusted Rand index %.3f), LSH only %.3fs (%.3f)'
+              % (location, len(seeds), t1 - t0, t2 - t1, agreements[-1][0], t3 - t2, agreements[-1][1]), flush=True)
+    if len(agreements) > 0:
+        print('Mean adjusted Rand index over %d graphs: approximate %.3f, LSH only %.3f'
+              % ((len(agreements),) + tuple(np.mean(agreements, axis=0))))
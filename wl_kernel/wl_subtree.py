@@ -0,0 +1,182 @@
+from typing import List, Optional, Tuple
+
+import networkx as nx
+import numpy as np
+import scipy.sparse
+
+# Fixed, so that the hashed labels and with them the feature columns are the same from run to run
+_seed = 0x5EED
+_golden = np.uint64(0x9E3779B97F4A7C15)
+
+
+def label_edge_type(with_data: bool, with_call: bool, with_name: bool) -> Optional[int]:
+    """
+    :return: The edge type graph_to_grakel labels nodes by: only the first selected one counts, None for no label
+    """
+    if with_data:
+        return 1
+    if with_call:
+        return 2
+    if with_name:
+        return 3
+    return None
+
+
+def _disjoint_union(list_of_graphs: List[nx.MultiDiGraph], edge_type: Optional[int]) \
+        -> Tuple[np.ndarray, np.ndarray, scipy.sparse.csr_matrix]:
+    """
+    :return: For the disjoint union of the graphs, the graph every node belongs to, the initial node labels (whether
+             the node has an outgoing edge of edge_type, as in graph_to_grakel) and the adjacency matrix
+    """
+    graph_of, labels, sources, targets = list(), list(), list(), list()
+    for i, g in enumerate(list_of_graphs):
+        index = {node: len(labels) + j for j, node in enumerate(g.nodes)}
+        flagged = set()
+        for u, v, k in g.edges(keys=True):
+            sources.append(index[u])
+            targets.append(index[v])
+            if edge_type is not None and k == edge_type:
+                flagged.add(u)
+        graph_of.extend([i] * len(index))
+        labels.extend(1 if node in flagged else 0 for node in index.keys())
+    n = len(labels)
+    adjacency = scipy.sparse.csr_matrix((np.ones(len(sources), dtype=np.int8), (sources, targets)), shape=(n, n))
+    # Parallel edges are one neighbour to WL
+    adjacency.sum_duplicates()
+    return np.asarray(graph_of, dtype=np.int64), np.asarray(labels, dtype=np.int64), adjacency
+
+
+def _neighbour_sums(values: np.ndarray, adjacency: scipy.sparse.csr_matrix) -> np.ndarray:
+    """
+    :return: Per node, the sum of the uint64 values of its out-neighbours, wrapping around
+    """
+    neighbours = values[adjacency.indices]
+    sums = np.zeros(adjacency.shape[0], dtype=np.uint64)
+    non_empty = np.diff(adjacency.indptr) > 0
+    if len(neighbours) > 0:
+        sums[non_empty] = np.add.reduceat(neighbours, adjacency.indptr[:-1][non_empty])
+    return sums
+
+
+def _mix(x: np.ndarray) -> np.ndarray:
+    """
+    splitmix64's finaliser: a bijection of uint64 that spreads every input bit over the whole output
+    """
+    x = x + _golden
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+def _relabel(labels: np.ndarray, adjacency: scipy.sparse.csr_matrix, rng: np.random.Generator) -> np.ndarray:
+    """
+    One WL iteration: nodes share a new label iff they share their label and the multiset of their out-neighbours'
+    labels. The multiset is hashed as the sum of a random 64 bit weight per label, collisions are negligible.
+    :return: The new labels, numbered from 0
+    """
+    weights = rng.integers(0, np.iinfo(np.uint64).max, size=labels.max() + 1, dtype=np.uint64, endpoint=True)
+    hashes = _neighbour_sums(weights[labels], adjacency)
+    _, new_labels = np.unique(np.stack([labels.astype(np.uint64), hashes], axis=1), axis=0, return_inverse=True)
+    return new_labels.reshape(-1)
+
+
+def wl_subtree_features(list_of_graphs: List[nx.MultiDiGraph], n_iter: int = 10, with_data: bool = True,
+                        with_call: bool = True, with_name: bool = True) -> scipy.sparse.csr_matrix:
+    """
+    Weisfeiler-Lehman subtree features of the (k-hop sub)graphs, computed over their disjoint union at once
+    :param n_iter: The number of relabelling iterations, as grakel's n_iter: each graph gets n_iter + 1 histograms
+    :return: One row per graph, counting how often each label of each iteration occurs in it
+    """
+    graph_of, labels, adjacency = _disjoint_union(list_of_graphs, label_edge_type(with_data, with_call, with_name))
+    labels = np.unique(labels, return_inverse=True)[1].reshape(-1)
+    rng = np.random.default_rng(_seed)
+    columns = list()
+    offset = 0
+    stable = len(labels) == 0
+    for i in range(n_iter + 1):
+        if i > 0 and not stable:
+            new_labels = _relabel(labels, adjacency, rng)
+            # Every iteration refines the last, once the number of labels stops growing the labels stay the same
+            stable = new_labels.max() == labels.max()
+            labels = new_labels
+        columns.append(offset + labels)
+        offset += labels.max(initial=-1) + 1
+    columns = np.concatenate(columns)
+    rows = np.tile(graph_of, n_iter + 1)
+    return scipy.sparse.csr_matrix((np.ones(len(columns), dtype=np.int64), (rows, columns)),
+                                   shape=(len(list_of_graphs), offset))
+
+
+def wl_subtree_kernel(features: scipy.sparse.csr_matrix) -> np.ndarray:
+    """
+    :return: The normalised kernel matrix of WL subtree features, as GraphKernel(normalize=True) computes it
+    """
+    km = (features @ features.T).toarray()
+    diagonal = np.diagonal(km)
+    old_settings = np.seterr(divide='ignore', invalid='ignore')
+    km = np.nan_to_num(np.divide(km, np.sqrt(np.outer(diagonal, diagonal))))
+    np.seterr(**old_settings)
+    return km
+
+
+def wl_subtree_histograms(list_of_graphs: List[nx.MultiDiGraph], n_iter: int = 10, with_data: bool = True,
+                          with_call: bool = True, with_name: bool = True) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Weisfeiler-Lehman subtree features of every graph in its own right, so that features computed apart (or
+    cached) can be compared. Rather than numbering the labels of a batch, every label is a 64 bit hash of the
+    node's rooted subtree and the iteration; collisions are negligible.
+    :param n_iter: The number of relabelling iterations, as in wl_subtree_features
+    :return: Per graph, its distinct hashed labels (sorted) and how often each occurs
+    """
+    graph_of, labels, adjacency = _disjoint_union(list_of_graphs, label_edge_type(with_data, with_call, with_name))
+    salts = _mix(np.arange(1, n_iter + 2, dtype=np.uint64))
+    hashes = _mix(labels.astype(np.uint64))
+    columns = [_mix(hashes ^ salts[0])]
+    for i in range(1, n_iter + 1):
+        hashes = _mix(hashes ^ _mix(_neighbour_sums(_mix(hashes), adjacency)))
+        columns.append(_mix(hashes ^ salts[i]))
+    columns = np.concatenate(columns)
+    rows = np.tile(graph_of, n_iter + 1)
+
+    # Count every (graph, label) pair, then split the counts by graph
+    order = np.lexsort((columns, rows))
+    rows, columns = rows[order], columns[order]
+    first = np.ones(len(rows), dtype=bool)
+    first[1:] = (rows[1:] != rows[:-1]) | (columns[1:] != columns[:-1])
+    starts = np.flatnonzero(first)
+    counts = np.diff(np.append(starts, len(rows)))
+    bounds = np.searchsorted(rows[starts], np.arange(len(list_of_graphs) + 1))
+    return [(columns[starts[bounds[i]:bounds[i + 1]]], counts[bounds[i]:bounds[i + 1]])
+            for i in range(len(list_of_graphs))]
+
+
+def histograms_to_features(histograms: List[Tuple[np.ndarray, np.ndarray]]) -> scipy.sparse.csr_matrix:
+    """
+    :return: The histograms of wl_subtree_histograms as the rows of a feature matrix, one column per distinct label
+    """
+    if len(histograms) == 0:
+        return scipy.sparse.csr_matrix((0, 0), dtype=np.int64)
+    labels, inverse = np.unique(np.concatenate([columns for columns, _ in histograms]), return_inverse=True)
+    rows = np.repeat(np.arange(len(histograms)), [len(columns) for columns, _ in histograms])
+    return scipy.sparse.csr_matrix((np.concatenate([counts for _, counts in histograms]).astype(np.int64),
+                                    (rows, inverse.reshape(-1))), shape=(len(histograms), len(labels)))
+
+
+if __name__ == '__main__':
+    import sys
+    import time
+
+    from deltaPDG.Util.pygraph_util import read_networkx_from_dot
+    from wl_kernel.wl_kernel_untangle import deltaPDG_to_list_of_Graphs, wl_similarities
+
+    # Compare both WL backends on the seed subgraphs of a deltaPDG, e.g. <corpus>/<chain>/<q>/merged.dot
+    k_hop = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    _, subgraphs = deltaPDG_to_list_of_Graphs(read_networkx_from_dot(sys.argv[1]), khop_k=k_hop)
+    t0 = time.perf_counter()
+    reference = wl_similarities(subgraphs, backend='grakel')
+    t1 = time.perf_counter()
+    similarities = wl_similarities(subgraphs, backend='numpy')
+    t2 = time.perf_counter()
+    print('%d subgraphs: grakel %.3fs, numpy %.3fs (%.1fx), max difference %g'
+          % (len(subgraphs), t1 - t0, t2 - t1, (t1 - t0) / max(t2 - t1, 1e-9),
+             np.abs(reference - similarities).max(initial=0)))